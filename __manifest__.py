@@ -1,6 +1,6 @@
 {
     "name": "BMI Invoice Parser",
-    "version": "16.0.1.0.27",
+    "version": "16.0.1.0.65",
     "category": "Accounting",
     "summary": "Procesa Facturas recibidas en Helpdesk para Pago a Proveedores",
     "description": """
@@ -13,21 +13,29 @@
     "depends": ["base", "account", "helpdesk", "purchase"],
     "data": [
         "security/ir.model.access.csv",
+        "data/ir_cron.xml",
+        "data/ir_config_parameter.xml",
         "views/server_actions.xml",
         "views/server_actions_multiple_tickets.xml",
         "views/invoice_parser_views.xml",
         "views/menu_item.xml",
         "views/menu_item_multipletickets.xml",
+        "views/invoice_extraction_result_views.xml",
+        "views/invoice_batch_views.xml",
+        "views/invoice_backfill_views.xml",
     ],
     "assets": {
         "web.assets_backend": [
             "bmi_invoice_parser/static/src/js/invoice_parser.js",
+            "bmi_invoice_parser/static/src/js/helpdesk_kanban.js",
             "bmi_invoice_parser/static/src/xml/invoice_parser.xml"
         ]
     },
     'external_dependencies': {
         'python': ['pdfminer.six'],
     },
+    "post_init_hook": "post_init_hook",
+    "uninstall_hook": "uninstall_hook",
     "installable": True,
     "application": False,
     "auto_install": False,
@@ -0,0 +1,3 @@
+from . import replay
+from . import backfill
+from . import loadtest
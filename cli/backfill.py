@@ -0,0 +1,118 @@
+import os
+import time
+import logging
+import optparse
+import multiprocessing
+import odoo
+from odoo.cli import Command
+from odoo.tools import config
+
+from ..models.invoice_backfill import BACKFILL_CHUNK_SIZE
+
+_logger = logging.getLogger(__name__)
+
+
+class InvoiceBackfill(Command):
+    """Reprocesar tickets históricos de facturas en tramos, con checkpoint y workers en paralelo"""
+    name = 'bmi_invoice_backfill'
+
+    def run(self, cmdargs):
+        parser = config.parser
+        parser.prog = f'{os.path.basename(parser.prog.split()[0])} {self.name}'
+        group = optparse.OptionGroup(parser, "Reprocesamiento de facturas")
+        group.add_option("--resume", dest="resume", type="int", default=0,
+                         help="ID de un reprocesamiento interrumpido a continuar")
+        group.add_option("--stages", dest="stages", default="",
+                         help="Nombres de etapas separados por coma (p. ej. 'PDF sin PO#,PO# Inexistente')")
+        group.add_option("--date-from", dest="date_from", help="Fecha de creación mínima (AAAA-MM-DD)")
+        group.add_option("--date-to", dest="date_to", help="Fecha de creación máxima (AAAA-MM-DD)")
+        group.add_option("--include-invoiced", dest="include_invoiced", action="store_true", default=False,
+                         help="Incluir los tickets que ya tienen una factura vinculada")
+        group.add_option("--chunk-size", dest="chunk_size", type="int", default=BACKFILL_CHUNK_SIZE,
+                         help="Tickets por tramo (unidad de checkpoint)")
+        group.add_option("--rate", dest="rate", type="int", default=0,
+                         help="Tickets por minuto entre todos los workers (0 para no limitar)")
+        group.add_option("--workers", dest="workers", type="int", default=1, help="Procesos en paralelo")
+        group.add_option("--progress-interval", dest="progress_interval", type="int", default=30,
+                         help="Segundos entre reportes de avance")
+        parser.add_option_group(group)
+        opt = config.parse_config(cmdargs)
+
+        dbname = config['db_name']
+        if not dbname:
+            parser.error("Se debe indicar la base de datos con -d")
+        if not opt.resume and not (opt.stages or opt.date_from or opt.date_to):
+            parser.error("Indicar al menos un filtro (--stages, --date-from, --date-to) o --resume")
+
+        with odoo.registry(dbname).cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            if opt.resume:
+                backfill = env['bmi.invoice.backfill'].browse(opt.resume).exists()
+                if not backfill:
+                    parser.error(f"No existe el reprocesamiento {opt.resume}")
+                if opt.rate:
+                    backfill.rate = opt.rate
+            else:
+                backfill = env['bmi.invoice.backfill']._create_backfill(
+                    date_from=opt.date_from,
+                    date_to=opt.date_to,
+                    stage_names=[s.strip() for s in opt.stages.split(',') if s.strip()],
+                    include_invoiced=opt.include_invoiced,
+                    chunk_size=opt.chunk_size,
+                    rate=opt.rate,
+                )
+            backfill_id = backfill.id
+            progress = backfill._get_progress()
+            cr.commit()
+
+        print(f"Reprocesamiento {backfill_id}: {progress['total']} tickets, "
+              f"{progress['chunks_done']}/{progress['chunks_total']} tramos terminados. "
+              f"Para continuarlo si se interrumpe: {self.name} -d {dbname} --resume {backfill_id}")
+
+        # Cada worker abre sus propias conexiones: se cierran las del proceso padre antes de crearlos
+        odoo.sql_db.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=_run_worker, args=(dbname, backfill_id, opt.workers), daemon=True)
+            for _index in range(max(opt.workers, 1))
+        ]
+        for process in processes:
+            process.start()
+
+        start = time.monotonic()
+        start_processed = progress['processed']
+        while any(process.is_alive() for process in processes):
+            for process in processes:
+                process.join(timeout=opt.progress_interval / len(processes))
+            self._print_progress(dbname, backfill_id, start, start_processed)
+        self._print_progress(dbname, backfill_id, start, start_processed, final=True)
+
+    def _print_progress(self, dbname, backfill_id, start, start_processed, final=False):
+        with odoo.registry(dbname).cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            progress = env['bmi.invoice.backfill'].browse(backfill_id)._get_progress()
+        elapsed = time.monotonic() - start
+        session = progress['processed'] - start_processed
+        rate = session * 60 / elapsed if elapsed else 0.0
+        remaining = progress['total'] - progress['processed']
+        eta = f"{remaining / rate:.0f} min" if rate else '-'
+        print(f"{progress['processed']}/{progress['total']} tickets, "
+              f"{progress['chunks_done']}/{progress['chunks_total']} tramos, "
+              f"{rate:.1f} tickets/min, restante {eta}")
+        if final:
+            print(f"Estado: {progress['state']}")
+            print(f"Resultados: {progress['outcomes']}")
+
+
+def _run_worker(dbname, backfill_id, workers):
+    """
+    Worker del reprocesamiento, en un proceso separado
+    """
+    try:
+        with odoo.registry(dbname).cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            processed = env['bmi.invoice.backfill'].browse(backfill_id)._run_worker(workers)
+        _logger.info(f"Worker {os.getpid()} del reprocesamiento {backfill_id}: {processed} tickets")
+    except Exception:
+        _logger.exception(f"Worker {os.getpid()} del reprocesamiento {backfill_id} interrumpido")
+        raise
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import logging
+import optparse
+import odoo
+from odoo.cli import Command
+from odoo.tools import config
+
+from ..models.invoice_parser import CLAIM_BATCH_SIZE
+from ..models.invoice_loadtest import LOADTEST_SUPPLIERS, LOADTEST_EXISTING_BILLS
+
+_logger = logging.getLogger(__name__)
+
+
+class InvoiceLoadTest(Command):
+    """Prueba de carga del procesamiento de facturas sobre datos generados (usar una copia de la base de datos)"""
+    name = 'bmi_invoice_loadtest'
+
+    def run(self, cmdargs):
+        parser = config.parser
+        parser.prog = f'{os.path.basename(parser.prog.split()[0])} {self.name}'
+        group = optparse.OptionGroup(parser, "Prueba de carga de facturas")
+        group.add_option("--tickets", dest="tickets", default="100",
+                         help="Cantidades de tickets separadas por coma; cada una es una prueba (p. ej. 100,1000,10000)")
+        group.add_option("--suppliers", dest="suppliers", type="int", default=LOADTEST_SUPPLIERS,
+                         help="Proveedores generados")
+        group.add_option("--bills", dest="bills", type="int", default=LOADTEST_EXISTING_BILLS,
+                         help="Facturas de proveedor existentes generadas, ajenas a los tickets")
+        group.add_option("--batch-size", dest="batch_size", type="int", default=CLAIM_BATCH_SIZE,
+                         help="Tickets por reserva")
+        group.add_option("--seed", dest="seed", type="int", default=0, help="Semilla del generador aleatorio")
+        group.add_option("--keep", dest="keep", action="store_true", default=False,
+                         help="No eliminar los datos generados al terminar")
+        group.add_option("--check-budgets", dest="check_budgets", action="store_true", default=False,
+                         help="Terminar con error si algún resultado supera su máximo de consultas por ticket")
+        group.add_option("--report", dest="report", help="Archivo donde guardar los reportes completos en JSON")
+        parser.add_option_group(group)
+        opt = config.parse_config(cmdargs)
+
+        dbname = config['db_name']
+        if not dbname:
+            parser.error("Se debe indicar la base de datos con -d")
+        scales = [int(value) for value in opt.tickets.split(',') if value.strip()]
+        if not scales or min(scales) <= 0:
+            parser.error("--tickets debe indicar cantidades positivas")
+
+        reports = []
+        for count in scales:
+            with odoo.registry(dbname).cursor() as cr:
+                env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+                loadtest = env['bmi.invoice.loadtest']
+                seeded = loadtest._seed(count, suppliers=opt.suppliers, existing_bills=opt.bills, seed=opt.seed)
+                try:
+                    report = loadtest._run(seeded['ticket_ids'], seeded['expected'], batch_size=opt.batch_size)
+                finally:
+                    cr.rollback()
+                    if opt.keep:
+                        print(f"Datos de la prueba conservados con el prefijo {seeded['tag']}")
+                    else:
+                        loadtest._cleanup(seeded)
+            report['seed_seconds'] = seeded['seed_seconds']
+            reports.append(report)
+            self._print_report(report)
+
+        if len(reports) > 1:
+            print("\nEscala:")
+            print(f"{'tickets':>8} {'tickets/min':>12} {'consultas/ticket':>17} {'duración (s)':>13}")
+            for report in reports:
+                print(f"{report['tickets']:>8} {report['tickets_per_minute']:>12} "
+                      f"{report['queries_per_ticket']:>17} {report['wall_seconds']:>13}")
+        if opt.report:
+            with open(opt.report, 'w') as report_file:
+                json.dump(reports, report_file, indent=2, default=str)
+            print(f"Reportes completos guardados en {opt.report}")
+        if opt.check_budgets and any(report['query_budget_exceeded'] for report in reports):
+            sys.exit(1)
+
+    def _print_report(self, report):
+        print(f"\nTickets: {report['processed']}/{report['tickets']}  Duración: {report['wall_seconds']}s  "
+              f"(datos generados en {report['seed_seconds']}s)")
+        print(f"Rendimiento: {report['tickets_per_minute']} tickets/min, "
+              f"{report['queries_per_ticket']} consultas SQL por ticket ({report['queries']} en total)")
+        print("Fases:")
+        for name, phase in report['phases'].items():
+            print(f"  {name:<14} {phase['seconds']:>9.2f}s {phase['queries']:>8} consultas "
+                  f"({phase['queries_per_ticket']} por ticket)")
+        print("Latencia por etapa:")
+        for stage, summary in report['latency'].items():
+            if summary['count']:
+                print(f"  {stage:<14} n={summary['count']:<6} p50={summary['p50_ms']}ms "
+                      f"p95={summary['p95_ms']}ms max={summary['max_ms']}ms")
+        print("Por resultado:")
+        for outcome, summary in sorted(report['outcomes'].items()):
+            print(f"  {outcome:<14} n={summary['count']:<6} p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms "
+                  f"consultas/ticket={summary['queries_per_ticket']} (máx. {summary['max_queries']}, "
+                  f"tope {summary['query_budget'] or '-'})")
+        for outcome, queries in report['query_budget_exceeded'].items():
+            print(f"Máximo de consultas superado en {outcome}: {queries} consultas en un ticket")
+        if report['mismatches']:
+            print(f"Resultados distintos del esperado: {report['mismatches']}")
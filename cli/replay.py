@@ -0,0 +1,91 @@
+import os
+import json
+import logging
+import optparse
+import odoo
+from odoo.cli import Command
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+
+class InvoiceReplay(Command):
+    """Reproducir en dry-run el procesamiento de facturas sobre tickets históricos o PDFs exportados"""
+    name = 'bmi_invoice_replay'
+
+    def run(self, cmdargs):
+        parser = config.parser
+        parser.prog = f'{os.path.basename(parser.prog.split()[0])} {self.name}'
+        group = optparse.OptionGroup(parser, "Replay de facturas")
+        group.add_option("--ticket-ids", dest="ticket_ids", default="",
+                         help="IDs de tickets separados por coma")
+        group.add_option("--stages", dest="stages", default="",
+                         help="Nombres de etapas separados por coma (p. ej. 'Facturas Vinculadas,PDF sin PO#')")
+        group.add_option("--date-from", dest="date_from", help="Fecha de creación mínima (AAAA-MM-DD)")
+        group.add_option("--date-to", dest="date_to", help="Fecha de creación máxima (AAAA-MM-DD)")
+        group.add_option("--limit", dest="limit", type="int", default=0, help="Cantidad máxima de tickets")
+        group.add_option("--pdf-dir", dest="pdf_dir",
+                         help="Directorio con PDFs exportados; si se indica, no se leen tickets")
+        group.add_option("--workers", dest="workers", type="int", default=os.cpu_count() or 1,
+                         help="Procesos para la extracción de PDFs (por defecto, la cantidad de núcleos)")
+        group.add_option("--report", dest="report", help="Archivo donde guardar el reporte completo en JSON")
+        parser.add_option_group(group)
+        opt = config.parse_config(cmdargs)
+
+        dbname = config['db_name']
+        if not dbname:
+            parser.error("Se debe indicar la base de datos con -d")
+
+        with odoo.registry(dbname).cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            replay = env['bmi.invoice.replay']
+            try:
+                if opt.pdf_dir:
+                    paths = sorted(
+                        os.path.join(opt.pdf_dir, name) for name in os.listdir(opt.pdf_dir)
+                        if name.lower().endswith('.pdf')
+                    )
+                    if opt.limit:
+                        paths = paths[:opt.limit]
+                    report = replay.replay_pdf_files(paths, opt.workers)
+                else:
+                    tickets = replay._search_tickets(
+                        ticket_ids=[int(i) for i in opt.ticket_ids.split(',') if i.strip()],
+                        stage_names=[s.strip() for s in opt.stages.split(',') if s.strip()],
+                        date_from=opt.date_from,
+                        date_to=opt.date_to,
+                        limit=opt.limit,
+                    )
+                    report = replay.replay_tickets(tickets, opt.workers)
+            finally:
+                # El replay nunca debe dejar cambios en la base de datos
+                cr.rollback()
+
+        self._print_summary(report)
+        if opt.report:
+            with open(opt.report, 'w') as report_file:
+                json.dump(report, report_file, indent=2, default=str)
+            print(f"Reporte completo guardado en {opt.report}")
+
+    def _print_summary(self, report):
+        print(f"Tickets: {report['tickets']}  PDFs: {report['documents']}  "
+              f"Duración: {report['wall_seconds']}s")
+        print(f"Rendimiento: {report['tickets_per_minute']} tickets/min, "
+              f"{report['documents_per_minute']} PDFs/min")
+        print("Latencia por etapa:")
+        for stage, summary in report['latency'].items():
+            if summary['count']:
+                print(f"  {stage:<12} n={summary['count']:<6} p50={summary['p50_ms']}ms "
+                      f"p95={summary['p95_ms']}ms max={summary['max_ms']}ms")
+        print(f"Niveles de extracción: {report['layout_tiers']}")
+        print(f"Resultados en producción: {report['outcomes']['production']}")
+        print(f"Resultados del replay: {report['outcomes']['replay']}")
+        if report['transitions']:
+            print("Transiciones (producción -> replay):")
+            for transition, count in sorted(report['transitions'].items(), key=lambda item: -item[1]):
+                print(f"  {transition}: {count}")
+        print(f"Tickets con diferencias: {len(report['differences'])}")
+        for row in report['differences'][:50]:
+            print(f"  {row['name']} ({row['ticket']}): " + ', '.join(
+                f"{field} {row['production'][field]!r} -> {row['replay'][field]!r}" for field in row['differences']
+            ))
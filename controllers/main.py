@@ -1,9 +1,32 @@
+import hmac
 from odoo import http
 from odoo.http import request
 
+# Parámetro del sistema con el token que debe enviar el colector de métricas
+METRICS_TOKEN_PARAM = 'bmi_invoice_parser.metrics_token'
+
 
 class InvoiceParserController(http.Controller):
     @http.route("/bmi_invoice_parser/parse", type="http", auth="user")
     def parse_invoice(self, **kwargs):
         # Add your controller logic here
         return "Invoice Parser Controller"
+
+    @http.route("/bmi_invoice_parser/metrics", type="http", auth="none", methods=["GET"], csrf=False)
+    def metrics(self, token=None, **kwargs):
+        """
+        Métricas del procesamiento de facturas en formato de texto de Prometheus.
+        Requiere el token configurado en el parámetro bmi_invoice_parser.metrics_token, enviado como
+        'Authorization: Bearer <token>' o en el parámetro 'token'; sin token configurado el
+        endpoint está deshabilitado.
+        """
+        env = request.env(su=True)
+        expected = env['ir.config_parameter'].get_param(METRICS_TOKEN_PARAM)
+        authorization = request.httprequest.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            token = authorization[len('Bearer '):]
+        if not expected or not token or not hmac.compare_digest(token, expected):
+            return request.make_response("Forbidden", status=403)
+
+        body = env['bmi.invoice.metrics']._render()
+        return request.make_response(body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
@@ -0,0 +1,18 @@
+from .backends import get_backend, backend_available, register_backend, BackendUnavailable
+from .afip_qr import (
+    extract_afip_qr, afip_qr_invoice_data, normalize_cuit, parse_document_number, AFIP_DOCUMENT_CODES,
+)
+from .document import extract_document, extract_documents
+from .pdf_text import (
+    extract_pdf_text, extract_pdf_text_with_method, extract_pdf_text_with_probe, PDFExtractionError, TEXT_ENGINES,
+    DEFAULT_TEXT_ENGINE, LAYOUT_METHODS, PAGE_SEPARATOR,
+)
+from .probe import probe_text_layer
+from .ranking import score_pdf_candidate, rank_pdf_candidates
+from .segments import segment_invoice_pages, split_pages
+from .rule_budget import bound_rule_text, RuleBudget, RULE_MAX_CHARS, RULE_MAX_LINE_CHARS, RULE_TIME_BUDGET_SECONDS
+from .rule_patterns import (
+    PEDIDO_PATTERN, PO_PRIMARY_PATTERNS, PO_SECONDARY_PATTERNS, PO_GENERIC_PATTERN, CUIT_PATTERN,
+    INVOICE_NUMBER_PATTERN, DATE_PATTERNS, TOTAL_PATTERN, IVA_PATTERN, RULE_PATTERNS,
+)
+from .cost import estimate_pdf_cost, estimate_pages_cost, COST_BASE_SECONDS
@@ -0,0 +1,246 @@
+import re
+import json
+import base64
+import logging
+import binascii
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from .backends import get_backend, backend_available
+
+_logger = logging.getLogger(__name__)
+
+# URL del QR de comprobantes electrónicos de AFIP (RG 4291): https://www.afip.gob.ar/fe/qr/?p=<base64 JSON>
+AFIP_QR_URL_PATTERN = re.compile(r'https?://(?:www\.)?afip\.gob\.ar/fe/qr/?\?p=[A-Za-z0-9+/=_%-]+', re.IGNORECASE)
+
+# Indicios en el texto de un comprobante electrónico (CAE, AFIP/ARCA, "Comprobante Autorizado"): solo
+# entonces se renderizan las páginas para buscar el QR como imagen, que es lo más costoso. Las siglas
+# CAE y ARCA se buscan en mayúsculas, para no confundirlas con las palabras "cae" y "arca"
+AFIP_QR_MARKER_PATTERN = re.compile(
+    r'\bC\.?\s?A\.?\s?E\.?(?![A-Za-z])|\bARCA\b|(?i:\bAFIP\b|Comprobante\s+Autorizado)'
+)
+
+# Moneda local en el campo 'moneda' del QR; los importes en otra moneda se convierten con 'ctz'
+AFIP_QR_LOCAL_CURRENCY = 'PES'
+
+# Campos obligatorios del JSON del QR
+AFIP_QR_REQUIRED_KEYS = ('fecha', 'cuit', 'ptoVta', 'tipoCmp', 'nroCmp', 'importe')
+
+# Códigos de tipo de comprobante de AFIP y su nombre según extract_invoice_data
+AFIP_DOCUMENT_TYPES = {
+    1: 'FACTURA A',
+    2: 'NOTA DE DEBITO A',
+    3: 'NOTA DE CREDITO A',
+    6: 'FACTURA B',
+    7: 'NOTA DE DEBITO B',
+    8: 'NOTA DE CREDITO B',
+    11: 'FACTURA C',
+    12: 'NOTA DE DEBITO C',
+    13: 'NOTA DE CREDITO C',
+    51: 'FACTURA M',
+    52: 'NOTA DE DEBITO M',
+    53: 'NOTA DE CREDITO M',
+}
+
+# Código de AFIP de cada tipo de comprobante, según el nombre usado por extract_invoice_data
+AFIP_DOCUMENT_CODES = {name: code for code, name in AFIP_DOCUMENT_TYPES.items()}
+
+# Páginas que se renderizan para buscar el QR como imagen (el QR va al pie de la primera hoja)
+QR_IMAGE_MAX_PAGES = 2
+QR_IMAGE_DPI = 150
+
+
+def extract_afip_qr(pdf_file, text_content=''):
+    """
+    Obtener el contenido del QR de AFIP de un comprobante electrónico.
+    Busca la URL del QR en las anotaciones de enlace del PDF, luego en el texto extraído y,
+    como último recurso, decodificando el QR de la imagen de las primeras páginas. La imagen solo
+    se renderiza si el texto tiene indicios de un comprobante electrónico (AFIP_QR_MARKER_PATTERN),
+    para no agregar ese costo a las facturas que no son electrónicas.
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :param text_content: Texto ya extraído del PDF
+    :return: Diccionario con el JSON del QR, o None si no se encontró un QR válido
+    """
+    sources = (
+        ('anotaciones', lambda: find_qr_urls_in_annotations(pdf_file)),
+        ('texto', lambda: AFIP_QR_URL_PATTERN.findall(text_content or '')),
+        ('imagen', lambda: find_qr_urls_in_images(pdf_file) if has_afip_qr_marker(text_content) else []),
+    )
+    for source, finder in sources:
+        try:
+            urls = finder()
+        except Exception as e:
+            _logger.warning(f"No se pudo buscar el QR de AFIP en {source}: {e}")
+            continue
+        for url in urls:
+            payload = decode_afip_qr_url(url)
+            if payload:
+                _logger.info(f"QR de AFIP encontrado en {source}: {payload}")
+                return payload
+    return None
+
+
+def has_afip_qr_marker(text_content):
+    """
+    :param text_content: Texto extraído del PDF
+    :return: True si el texto tiene indicios de un comprobante electrónico de AFIP
+    """
+    return bool(AFIP_QR_MARKER_PATTERN.search(text_content or ''))
+
+
+def find_qr_urls_in_annotations(pdf_file):
+    """
+    Buscar URLs del QR de AFIP en las anotaciones de enlace (/Link con acción /URI)
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :return: Lista de URLs
+    """
+    pdf_file.seek(0)
+    pdfminer = get_backend('pdfminer')
+    resolve1 = pdfminer.resolve1
+    urls = []
+    for page in pdfminer.PDFPage.get_pages(pdf_file, check_extractable=False):
+        for annot in resolve1(page.annots) or []:
+            annot = resolve1(annot)
+            if not isinstance(annot, dict):
+                continue
+            action = resolve1(annot.get('A'))
+            if not isinstance(action, dict):
+                continue
+            uri = resolve1(action.get('URI'))
+            if isinstance(uri, bytes):
+                uri = uri.decode('latin-1')
+            if isinstance(uri, str) and AFIP_QR_URL_PATTERN.match(uri.strip()):
+                urls.append(uri.strip())
+    return urls
+
+
+def find_qr_urls_in_images(pdf_file):
+    """
+    Decodificar el QR de AFIP renderizando las primeras páginas (requiere pdf2image y pyzbar)
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :return: Lista de URLs
+    """
+    if not backend_available('qr_image'):
+        return []
+    qr_image = get_backend('qr_image')
+    pdf_file.seek(0)
+    images = qr_image.convert_from_bytes(pdf_file.read(), dpi=QR_IMAGE_DPI, last_page=QR_IMAGE_MAX_PAGES)
+    urls = []
+    for image in images:
+        for barcode in qr_image.decode_barcodes(image):
+            data = barcode.data.decode('latin-1').strip()
+            if AFIP_QR_URL_PATTERN.match(data):
+                urls.append(data)
+    return urls
+
+
+def decode_afip_qr_url(url):
+    """
+    Decodificar el parámetro 'p' (base64 de un JSON) de la URL del QR de AFIP
+    :param url: URL del QR
+    :return: Diccionario con el JSON del QR, o None si no es válido
+    """
+    try:
+        values = parse_qs(urlsplit(url).query).get('p')
+        if not values:
+            return None
+        encoded = unquote(values[0]).strip().replace(' ', '+')
+        encoded += '=' * (-len(encoded) % 4)
+        if '-' in encoded or '_' in encoded:
+            raw = base64.urlsafe_b64decode(encoded)
+        else:
+            raw = base64.b64decode(encoded)
+        payload = json.loads(raw.decode('utf-8'))
+    except (ValueError, binascii.Error, UnicodeDecodeError) as e:
+        _logger.info(f"URL de QR de AFIP inválida ({url}): {e}")
+        return None
+
+    if not isinstance(payload, dict) or any(key not in payload for key in AFIP_QR_REQUIRED_KEYS):
+        _logger.info(f"QR de AFIP sin los campos obligatorios: {payload}")
+        return None
+
+    try:
+        int(payload['ptoVta']), int(payload['nroCmp']), int(payload['tipoCmp']), float(payload['importe'])
+    except (TypeError, ValueError):
+        _logger.info(f"QR de AFIP con valores numéricos inválidos: {payload}")
+        return None
+    return payload
+
+
+def normalize_cuit(cuit):
+    """
+    Normalizar un CUIT a solo dígitos (30-12345678-9, 30 12345678 9 y 30123456789 dan lo mismo)
+    :param cuit: CUIT en cualquier formato
+    :return: Dígitos del CUIT (cadena vacía si no tiene)
+    """
+    return ''.join(filter(str.isdigit, str(cuit or '')))
+
+
+def format_cuit(cuit):
+    """
+    Formatear un CUIT como XX-XXXXXXXX-X
+    :param cuit: CUIT en cualquier formato
+    :return: CUIT con guiones, o los dígitos tal cual si no tiene 11 dígitos
+    """
+    digits = normalize_cuit(cuit)
+    if len(digits) != 11:
+        return digits
+    return f"{digits[:2]}-{digits[2:10]}-{digits[10]}"
+
+
+def afip_qr_invoice_data(payload, po_number):
+    """
+    Construir los datos de la factura a partir del QR de AFIP, con el mismo formato que
+    extract_invoice_data. El QR no informa el IVA, por lo que se estima como el 21% incluido
+    en el importe total, igual que cuando el texto no tiene el monto de IVA.
+    Los importes en moneda extranjera ('moneda' distinta de PES) se convierten a pesos con la
+    cotización del comprobante ('ctz'); sin una cotización válida el QR no informa importes
+    (total_amount, iva_amount y base_amount en None) y se deben tomar del texto.
+    :param payload: Diccionario con el JSON del QR
+    :param po_number: Número de PO extraído del PDF
+    :return: Diccionario con datos de la factura, incluida la moneda y la cotización del QR
+    """
+    currency = str(payload.get('moneda') or AFIP_QR_LOCAL_CURRENCY).strip().upper()
+    amount = float(payload['importe'])
+    exchange_rate = 1.0
+    if currency != AFIP_QR_LOCAL_CURRENCY:
+        try:
+            exchange_rate = float(payload.get('ctz'))
+        except (TypeError, ValueError):
+            exchange_rate = None
+        if not exchange_rate or exchange_rate <= 0:
+            _logger.info(f"QR de AFIP en {currency} sin cotización válida ({payload.get('ctz')!r}); "
+                         f"no se usan sus importes")
+            exchange_rate = None
+
+    if exchange_rate is None:
+        total_amount = iva_amount = base_amount = None
+    else:
+        total_amount = round(amount * exchange_rate, 2)
+        base_amount = total_amount / 1.21 if total_amount > 0 else 0.0
+        iva_amount = total_amount - base_amount
+
+    return {
+        'po_number': po_number,
+        'cuit': format_cuit(payload['cuit']),
+        'invoice_number': f"{int(payload['ptoVta']):05d}-{int(payload['nroCmp']):08d}",
+        'invoice_date': str(payload['fecha']),
+        'document_type': AFIP_DOCUMENT_TYPES.get(int(payload['tipoCmp']), ''),
+        'total_amount': total_amount,
+        'iva_amount': iva_amount,
+        'base_amount': base_amount,
+        'currency': currency,
+        'exchange_rate': exchange_rate,
+        'source': 'afip_qr',
+    }
+
+
+def parse_document_number(document_number):
+    """
+    Separar un número de comprobante en punto de venta y número (00002-00001234 -> (2, 1234))
+    :param document_number: Número de comprobante en formato PPPPP-NNNNNNNN
+    :return: Tupla (punto de venta, número), o (None, None) si no tiene ese formato
+    """
+    parts = [''.join(filter(str.isdigit, part)) for part in str(document_number or '').split('-')]
+    if len(parts) != 2 or not all(parts):
+        return None, None
+    return int(parts[0]), int(parts[1])
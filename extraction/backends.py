@@ -0,0 +1,131 @@
+import logging
+from types import SimpleNamespace
+
+_logger = logging.getLogger(__name__)
+
+# Registro de backends de extracción. Cada backend se importa recién la primera vez que se usa,
+# para que los workers de Odoo que nunca procesan un PDF no carguen pdfminer, pdf2image,
+# pytesseract ni pyzbar (ver scripts/measure_import_cost.py).
+_LOADERS = {}
+_BACKENDS = {}
+_UNAVAILABLE = {}
+
+
+class BackendUnavailable(ImportError):
+    """
+    El backend no está instalado en este entorno
+    """
+
+
+def register_backend(name, loader):
+    """
+    Registrar un backend de extracción
+    :param name: Nombre del backend
+    :param loader: Función sin argumentos que importa las dependencias y retorna el backend
+    """
+    _LOADERS[name] = loader
+    _BACKENDS.pop(name, None)
+    _UNAVAILABLE.pop(name, None)
+
+
+def get_backend(name):
+    """
+    Obtener un backend, importándolo en el primer uso
+    :param name: Nombre del backend
+    :return: Objeto con los símbolos del backend
+    :raises BackendUnavailable: si las dependencias del backend no están instaladas
+    """
+    if name in _BACKENDS:
+        return _BACKENDS[name]
+    if name in _UNAVAILABLE:
+        raise BackendUnavailable(_UNAVAILABLE[name])
+    if name not in _LOADERS:
+        raise BackendUnavailable(f"Backend de extracción desconocido: {name}")
+
+    try:
+        backend = _LOADERS[name]()
+    except ImportError as e:
+        _UNAVAILABLE[name] = f"Backend de extracción '{name}' no disponible: {e}"
+        _logger.warning(_UNAVAILABLE[name])
+        raise BackendUnavailable(_UNAVAILABLE[name]) from e
+
+    _logger.debug(f"Backend de extracción '{name}' cargado")
+    _BACKENDS[name] = backend
+    return backend
+
+
+def backend_available(name):
+    """
+    :param name: Nombre del backend
+    :return: True si el backend se puede cargar en este entorno
+    """
+    try:
+        get_backend(name)
+    except BackendUnavailable:
+        return False
+    return True
+
+
+def loaded_backends():
+    """
+    :return: Nombres de los backends ya importados en este proceso
+    """
+    return sorted(_BACKENDS)
+
+
+def _load_pdfminer():
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdftypes import resolve1, PDFStream
+    from pdfminer.psparser import LIT
+    return SimpleNamespace(
+        TextConverter=TextConverter,
+        LAParams=LAParams,
+        PDFResourceManager=PDFResourceManager,
+        PDFPageInterpreter=PDFPageInterpreter,
+        PDFPage=PDFPage,
+        PDFStream=PDFStream,
+        resolve1=resolve1,
+        LIT=LIT,
+    )
+
+
+def _load_ocr():
+    from pdf2image import convert_from_bytes
+    import pytesseract
+    return SimpleNamespace(
+        convert_from_bytes=convert_from_bytes,
+        image_to_string=pytesseract.image_to_string,
+    )
+
+
+def _load_qr_image():
+    from pdf2image import convert_from_bytes
+    from pyzbar.pyzbar import decode
+    return SimpleNamespace(
+        convert_from_bytes=convert_from_bytes,
+        decode_barcodes=decode,
+    )
+
+
+def _load_pypdfium2():
+    import pypdfium2
+    return SimpleNamespace(PdfDocument=pypdfium2.PdfDocument)
+
+
+def _load_pdftotext():
+    import shutil
+    import subprocess
+    binary = shutil.which('pdftotext')
+    if not binary:
+        raise ImportError("no se encontró el ejecutable pdftotext (poppler-utils)")
+    return SimpleNamespace(binary=binary, run=subprocess.run)
+
+
+register_backend('pdfminer', _load_pdfminer)
+register_backend('ocr', _load_ocr)
+register_backend('qr_image', _load_qr_image)
+register_backend('pypdfium2', _load_pypdfium2)
+register_backend('pdftotext', _load_pdftotext)
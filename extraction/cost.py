@@ -0,0 +1,48 @@
+import logging
+from io import BytesIO
+
+from .probe import probe_text_layer, PAGE_TEXT, PAGE_IMAGE
+from .ranking import PAGE_PATTERN, FONT_PATTERN
+
+_logger = logging.getLogger(__name__)
+
+# Costo estimado (en segundos) de procesar un PDF: un costo fijo, uno por tamaño y uno por página,
+# mucho mayor para las páginas sin capa de texto (OCR)
+COST_BASE_SECONDS = 0.2
+COST_PER_MB_SECONDS = 0.5
+COST_PER_TEXT_PAGE_SECONDS = 0.1
+COST_PER_OCR_PAGE_SECONDS = 3.0
+
+
+def estimate_pdf_cost(pdf_bytes):
+    """
+    Estimar cuánto cuesta extraer un PDF a partir del tamaño, la cantidad de páginas y el sondeo
+    de la capa de texto (ver probe_text_layer). Si el sondeo no se puede hacer (PDF dañado o
+    pdfminer no instalado) las páginas se cuentan sobre los bytes y se asume OCR si no hay fuentes.
+    :param pdf_bytes: Contenido del PDF
+    :return: Costo estimado en segundos
+    """
+    pdf_bytes = pdf_bytes or b''
+    try:
+        _kind, page_kinds = probe_text_layer(BytesIO(pdf_bytes))
+    except Exception as e:
+        _logger.debug(f"Sondeo de la capa de texto no disponible para estimar el costo: {e}")
+        pages = len(PAGE_PATTERN.findall(pdf_bytes)) or 1
+        page_kinds = [PAGE_TEXT if FONT_PATTERN.search(pdf_bytes) else PAGE_IMAGE] * pages
+    return estimate_pages_cost(len(pdf_bytes), page_kinds)
+
+
+def estimate_pages_cost(size, page_kinds):
+    """
+    Estimar el costo de un PDF ya sondeado, sin leer su contenido
+    :param size: Tamaño del PDF en bytes
+    :param page_kinds: Clasificación de cada página (ver probe_text_layer)
+    :return: Costo estimado en segundos
+    """
+    ocr_pages = sum(1 for kind in page_kinds if kind == PAGE_IMAGE)
+    text_pages = len(page_kinds) - ocr_pages
+    cost = (COST_BASE_SECONDS
+            + COST_PER_MB_SECONDS * (size or 0) / (1024 * 1024)
+            + COST_PER_TEXT_PAGE_SECONDS * text_pages
+            + COST_PER_OCR_PAGE_SECONDS * ocr_pages)
+    return round(cost, 2)
@@ -0,0 +1,85 @@
+import time
+import logging
+from functools import partial
+from io import BytesIO
+
+from .pdf_text import extract_pdf_text_with_probe
+from .afip_qr import extract_afip_qr
+
+_logger = logging.getLogger(__name__)
+
+
+def extract_document(pdf_bytes, engine=None, layout=True, afip_qr=None, page_kinds=None):
+    """
+    Extraer el texto y el QR de AFIP de un PDF.
+    No usa el ORM ni la base de datos, por lo que se puede ejecutar en procesos separados.
+    :param pdf_bytes: Contenido del PDF
+    :param engine: Motor de extracción de texto (ver TEXT_ENGINES)
+    :param layout: Si es False, pdfminer no hace análisis de layout
+    :param afip_qr: QR de AFIP ya buscado en una pasada anterior (False si no se encontró); con
+                    None se busca
+    :param page_kinds: Sondeo de la capa de texto de una pasada anterior; con None se sondea
+    :return: Diccionario con el texto extraído, el método usado, el JSON del QR de AFIP (o None),
+             el sondeo de la capa de texto (o None) y los segundos empleados
+    """
+    start = time.perf_counter()
+    pdf_file = BytesIO(pdf_bytes)
+    text_content, method, page_kinds = extract_pdf_text_with_probe(pdf_file, engine, layout, page_kinds)
+    if afip_qr is None:
+        afip_qr = extract_afip_qr(pdf_file, text_content)
+    return {
+        'text_content': text_content,
+        'method': method,
+        'afip_qr': afip_qr,
+        'page_kinds': page_kinds,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def extract_documents(items, workers=1, engine=None, layout=True, afip_qrs=None, probes=None):
+    """
+    Extraer varios PDFs, en paralelo en procesos separados cuando workers > 1
+    :param items: Lista de tuplas (clave, contenido del PDF)
+    :param workers: Cantidad de procesos; con 1 se extrae en el proceso actual
+    :param engine: Motor de extracción de texto (ver TEXT_ENGINES)
+    :param layout: Si es False, pdfminer no hace análisis de layout
+    :param afip_qrs: Diccionario {clave: QR de AFIP ya buscado en una pasada anterior}; los PDFs
+                     que no figuran se buscan (ver extract_document)
+    :param probes: Diccionario {clave: sondeo de la capa de texto de una pasada anterior}; los PDFs
+                   que no figuran se sondean
+    :return: Diccionario {clave: resultado de extract_document}
+    """
+    keys = [key for key, _data in items]
+    contents = [data for _key, data in items]
+    qrs = [(afip_qrs or {}).get(key) for key in keys]
+    page_kinds = [(probes or {}).get(key) for key in keys]
+    extract = partial(_extract_document_safe, engine=engine, layout=layout)
+
+    if workers <= 1 or len(items) <= 1:
+        results = map(extract, contents, qrs, page_kinds)
+        return dict(zip(keys, results))
+
+    # Solo el replay extrae en paralelo: el pool de procesos no se importa en los workers de Odoo
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(extract, contents, qrs, page_kinds)
+        return dict(zip(keys, results))
+
+
+def _extract_document_safe(pdf_bytes, afip_qr=None, page_kinds=None, engine=None, layout=True):
+    """
+    extract_document que nunca lanza excepciones, para usar en lotes
+    """
+    start = time.perf_counter()
+    try:
+        return extract_document(pdf_bytes, engine, layout, afip_qr, page_kinds)
+    except Exception as e:
+        _logger.error(f"Error al extraer el PDF: {e}")
+        return {
+            'text_content': '',
+            'method': None,
+            'afip_qr': None,
+            'page_kinds': None,
+            'seconds': time.perf_counter() - start,
+            'error': str(e),
+        }
@@ -0,0 +1,275 @@
+import logging
+from io import StringIO
+
+from .backends import get_backend, backend_available
+from .probe import probe_text_layer, classify_document, DOC_TEXT, DOC_IMAGE, DOC_MIXED, PAGE_TEXT, PAGE_IMAGE
+
+_logger = logging.getLogger(__name__)
+
+
+# Motor de extracción de texto por defecto (ver scripts/benchmark_text_engines.py)
+DEFAULT_TEXT_ENGINE = 'pdfminer'
+
+# Tiempo máximo de pdftotext por documento
+PDFTOTEXT_TIMEOUT = 60
+
+# Métodos de extracción además de los motores de TEXT_ENGINES
+METHOD_MIXED = 'mixed'
+METHOD_OCR = 'ocr'
+
+# Métodos cuyo resultado cambia con el análisis de layout de pdfminer: solo en estos tiene
+# sentido una segunda pasada con layout cuando la primera no alcanza
+LAYOUT_METHODS = ('pdfminer', METHOD_MIXED)
+
+# Separador de páginas en el texto extraído (el mismo que emiten pdfminer y pdftotext), usado
+# para separar las facturas de un PDF que trae varias (ver segments.py)
+PAGE_SEPARATOR = '\f'
+
+
+class PDFExtractionError(Exception):
+    """
+    El PDF no se pudo leer con ningún motor de extracción ni por OCR
+    """
+
+
+def extract_pdf_text(pdf_file, engine=None, layout=True):
+    """
+    Extraer el texto de un PDF enviando cada página directamente al extractor adecuado.
+    Un sondeo previo de la capa de texto decide si el documento va a extracción directa, a OCR,
+    o página por página cuando es mixto. La extracción directa usa el motor indicado y, si falla
+    o no obtiene texto en este documento, pdfminer.
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :param engine: Motor de extracción de texto (una de las claves de TEXT_ENGINES)
+    :param layout: Si es False, pdfminer no hace análisis de layout (más rápido, ver LAYOUT_METHODS)
+    :return: Texto extraído
+    :raises PDFExtractionError: si el PDF no se pudo leer
+    """
+    return extract_pdf_text_with_method(pdf_file, engine, layout)[0]
+
+
+def extract_pdf_text_with_method(pdf_file, engine=None, layout=True):
+    """
+    Igual que extract_pdf_text, indicando además cómo se obtuvo el texto
+    :return: Tupla (texto extraído, método: nombre del motor, METHOD_MIXED o METHOD_OCR)
+    :raises PDFExtractionError: si el PDF no se pudo leer
+    """
+    return extract_pdf_text_with_probe(pdf_file, engine, layout)[:2]
+
+
+def extract_pdf_text_with_probe(pdf_file, engine=None, layout=True, page_kinds=None):
+    """
+    Igual que extract_pdf_text_with_method, devolviendo además el sondeo de la capa de texto para
+    reutilizarlo en otra pasada sobre el mismo PDF
+    :param page_kinds: Clasificación de cada página de un sondeo anterior; con None se sondea
+    :return: Tupla (texto extraído, método, clasificación de cada página o None si el sondeo falló)
+    :raises PDFExtractionError: si el PDF no se pudo leer
+    """
+    if page_kinds is not None:
+        doc_kind = classify_document(page_kinds)
+    else:
+        try:
+            doc_kind, page_kinds = probe_text_layer(pdf_file)
+            _logger.info(f"Sondeo de capa de texto: documento '{doc_kind}', páginas {page_kinds}")
+        except Exception as e:
+            _logger.warning(f"Sondeo de capa de texto falló, se usa la extracción completa: {e}")
+            doc_kind, page_kinds = DOC_TEXT, None
+
+    if doc_kind == DOC_IMAGE:
+        return extract_text_ocr(pdf_file), METHOD_OCR, page_kinds
+
+    if doc_kind == DOC_MIXED:
+        text = extract_text_mixed(pdf_file, page_kinds, layout)
+        if text:
+            return text, METHOD_MIXED, page_kinds
+
+    engines = get_text_engines(engine)
+    errors = []
+    for name in engines:
+        try:
+            text = TEXT_ENGINES[name](pdf_file, layout)
+
+            if text:
+                return text, name, page_kinds
+
+            _logger.warning(f"Extracción directa con {name} falló: No se extrajo texto. "
+                            f"Posible PDF escaneado o protegido.")
+
+        except Exception as e:
+            _logger.warning(f"Extracción directa con {name} falló: {e}")
+            errors.append(e)
+
+    text = extract_text_ocr(pdf_file)
+    # Un PDF que ningún motor puede leer (dañado, con contraseña) y del que el OCR no obtiene
+    # texto es un error, no un PDF sin texto
+    if not text and len(errors) == len(engines):
+        raise PDFExtractionError(f"No se pudo leer el PDF: {errors[-1]}") from errors[-1]
+    return text, METHOD_OCR, page_kinds
+
+
+def get_text_engines(engine=None):
+    """
+    Motores a usar para un documento: el indicado y luego el motor por defecto
+    :param engine: Motor de extracción configurado
+    :return: Lista de nombres de motores, sin repetir
+    """
+    if engine and engine not in TEXT_ENGINES:
+        _logger.warning(f"Motor de extracción de texto desconocido: {engine}. Se usa {DEFAULT_TEXT_ENGINE}.")
+        engine = None
+    engines = [engine or DEFAULT_TEXT_ENGINE]
+    if DEFAULT_TEXT_ENGINE not in engines:
+        engines.append(DEFAULT_TEXT_ENGINE)
+    return engines
+
+
+def extract_text_pdfminer(pdf_file, layout=True):
+    """
+    Extraer el texto de todas las páginas con pdfminer
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :param layout: Si es False no se agrupan caracteres en líneas y bloques (laparams=None): el
+                   texto sale en el orden del content stream
+    :return: Texto extraído
+    """
+    pdf_file.seek(0)
+    pdfminer = get_backend('pdfminer')
+    output_string = StringIO()
+    laparams = pdfminer.LAParams() if layout else None
+
+    with pdfminer.TextConverter(pdfminer.PDFResourceManager(), output_string, codec='utf-8',
+                                laparams=laparams) as converter:
+        interpreter = pdfminer.PDFPageInterpreter(converter.rsrcmgr, converter)
+        for page in pdfminer.PDFPage.get_pages(pdf_file, check_extractable=True):
+            interpreter.process_page(page)
+
+    return output_string.getvalue().strip()
+
+
+def extract_text_pypdfium2(pdf_file, layout=True):
+    """
+    Extraer el texto de todas las páginas con pypdfium2 (PDFium, nativo)
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :param layout: Sin efecto, PDFium siempre ordena el texto
+    :return: Texto extraído
+    """
+    pdfium = get_backend('pypdfium2')
+    pdf_file.seek(0)
+    document = pdfium.PdfDocument(pdf_file.read())
+    pages_text = []
+    try:
+        for pageno in range(len(document)):
+            page = document[pageno]
+            textpage = page.get_textpage()
+            pages_text.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+    finally:
+        document.close()
+
+    return PAGE_SEPARATOR.join(pages_text).strip()
+
+
+def extract_text_pdftotext(pdf_file, layout=True):
+    """
+    Extraer el texto de todas las páginas con pdftotext de poppler (nativo, en un proceso aparte)
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :param layout: Sin efecto, pdftotext siempre ordena el texto
+    :return: Texto extraído
+    """
+    poppler = get_backend('pdftotext')
+    pdf_file.seek(0)
+    result = poppler.run(
+        [poppler.binary, '-enc', 'UTF-8', '-', '-'],
+        input=pdf_file.read(),
+        capture_output=True,
+        timeout=PDFTOTEXT_TIMEOUT,
+        check=True,
+    )
+    return result.stdout.decode('utf-8', errors='replace').strip()
+
+
+def extract_pages_pdfminer(pdf_file, pagenos, layout=True):
+    """
+    Extraer con pdfminer solo las páginas indicadas
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :param pagenos: Conjunto de números de página (base 0)
+    :param layout: Si es False no se hace análisis de layout (ver extract_text_pdfminer)
+    :return: Diccionario {número de página: texto}
+    """
+    pdf_file.seek(0)
+    pdfminer = get_backend('pdfminer')
+    output_string = StringIO()
+    laparams = pdfminer.LAParams() if layout else None
+    pages_text = {}
+    wanted = sorted(pagenos)
+
+    with pdfminer.TextConverter(pdfminer.PDFResourceManager(), output_string, codec='utf-8',
+                                laparams=laparams) as converter:
+        interpreter = pdfminer.PDFPageInterpreter(converter.rsrcmgr, converter)
+        pages = pdfminer.PDFPage.get_pages(pdf_file, pagenos=set(pagenos), check_extractable=True)
+        for pageno, page in zip(wanted, pages):
+            start = output_string.tell()
+            interpreter.process_page(page)
+            pages_text[pageno] = output_string.getvalue()[start:]
+
+    return pages_text
+
+
+def extract_text_ocr(pdf_file, pagenos=None):
+    """
+    Extraer texto por OCR
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :param pagenos: Números de página (base 0) a procesar, o None para todas
+    :return: Texto extraído, o cadena vacía si el OCR no está disponible o falla
+    """
+    if not backend_available('ocr'):
+        _logger.warning("OCR no disponible en este entorno. Skipping OCR.")
+        return ""
+
+    try:
+        ocr = get_backend('ocr')
+        pdf_file.seek(0)
+        pdf_bytes = pdf_file.read()
+        if pagenos is None:
+            images = ocr.convert_from_bytes(pdf_bytes)
+        else:
+            images = []
+            for pageno in sorted(pagenos):
+                images.extend(ocr.convert_from_bytes(pdf_bytes, first_page=pageno + 1, last_page=pageno + 1))
+        text_ocr = PAGE_SEPARATOR.join([ocr.image_to_string(img).strip() for img in images])
+        return text_ocr.strip()
+    except Exception as ocr_error:
+        _logger.error(f"OCR también falló: {ocr_error}")
+
+    return ""
+
+
+def extract_text_mixed(pdf_file, page_kinds, layout=True):
+    """
+    Extraer un documento mixto: páginas con capa de texto por pdfminer e imágenes por OCR.
+    Las páginas que pdfminer no puede leer se envían también a OCR.
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :param page_kinds: Clasificación de cada página obtenida por el sondeo
+    :param layout: Si es False pdfminer no hace análisis de layout (ver extract_text_pdfminer)
+    :return: Texto extraído, respetando el orden de las páginas
+    """
+    text_pages = {pageno for pageno, kind in enumerate(page_kinds) if kind == PAGE_TEXT}
+    image_pages = {pageno for pageno, kind in enumerate(page_kinds) if kind == PAGE_IMAGE}
+
+    pages_text = {}
+    try:
+        pages_text = extract_pages_pdfminer(pdf_file, text_pages, layout)
+    except Exception as e:
+        _logger.warning(f"Extracción directa de páginas con texto falló, se envían a OCR: {e}")
+        image_pages |= text_pages
+
+    for pageno in sorted(image_pages):
+        pages_text[pageno] = extract_text_ocr(pdf_file, {pageno})
+
+    return PAGE_SEPARATOR.join(pages_text[pageno].strip() for pageno in sorted(pages_text)).strip()
+
+
+# Motores de extracción directa de texto disponibles para el parámetro 'engine'
+TEXT_ENGINES = {
+    'pdfminer': extract_text_pdfminer,
+    'pypdfium2': extract_text_pypdfium2,
+    'pdftotext': extract_text_pdftotext,
+}
@@ -0,0 +1,110 @@
+import re
+import logging
+
+from .backends import get_backend
+
+_logger = logging.getLogger(__name__)
+
+# Clasificación de páginas y documentos
+PAGE_TEXT = 'text'
+PAGE_IMAGE = 'image'
+PAGE_EMPTY = 'empty'
+
+DOC_TEXT = 'text'
+DOC_IMAGE = 'image'
+DOC_MIXED = 'mixed'
+
+# Operadores que muestran texto (Tj, TJ, ' y ") precedidos por su operando string o array
+TEXT_OPERATORS_PATTERN = re.compile(rb'[)\]>]\s*(?:Tj|TJ|\'|")')
+# Imágenes en línea dentro del content stream
+INLINE_IMAGE_PATTERN = re.compile(rb'(?<![A-Za-z])BI(?![A-Za-z])')
+
+# Profundidad máxima al recorrer Form XObjects anidados
+MAX_XOBJECT_DEPTH = 3
+
+
+def probe_text_layer(pdf_file):
+    """
+    Sondeo rápido de la capa de texto de un PDF, sin análisis de layout.
+    Revisa las fuentes y los operadores de texto de cada página para decidir
+    si conviene extraerla con pdfminer o con OCR.
+    :param pdf_file: Objeto BytesIO con el contenido del PDF
+    :return: Tupla (clasificación del documento, lista con la clasificación de cada página)
+    """
+    pdf_file.seek(0)
+    pdfminer = get_backend('pdfminer')
+    page_kinds = [probe_page(page) for page in pdfminer.PDFPage.get_pages(pdf_file, check_extractable=False)]
+    return classify_document(page_kinds), page_kinds
+
+
+def probe_page(page):
+    """
+    Clasificar una página según su contenido
+    :param page: objeto PDFPage de pdfminer
+    :return: PAGE_TEXT, PAGE_IMAGE o PAGE_EMPTY
+    """
+    has_text, has_image = _scan_content(page.resources, page.contents, 0)
+    if has_text:
+        return PAGE_TEXT
+    if has_image:
+        return PAGE_IMAGE
+    return PAGE_EMPTY
+
+
+def classify_document(page_kinds):
+    """
+    Clasificar el documento a partir de la clasificación de sus páginas.
+    Las páginas vacías no cuentan; un documento sin páginas con texto se trata como imagen
+    para que siga pasando por OCR.
+    :param page_kinds: Lista con la clasificación de cada página
+    :return: DOC_TEXT, DOC_IMAGE o DOC_MIXED
+    """
+    kinds = {kind for kind in page_kinds if kind != PAGE_EMPTY}
+    if kinds == {PAGE_TEXT}:
+        return DOC_TEXT
+    if PAGE_TEXT in kinds:
+        return DOC_MIXED
+    return DOC_IMAGE
+
+
+def _scan_content(resources, contents, depth):
+    """
+    Buscar texto e imágenes en un content stream y en sus Form XObjects
+    :return: Tupla (tiene texto, tiene imagen)
+    """
+    pdfminer = get_backend('pdfminer')
+    resolve1 = pdfminer.resolve1
+    resources = resolve1(resources) or {}
+    has_fonts = bool(resolve1(resources.get('Font')))
+    has_text = False
+    has_image = False
+
+    for stream in contents or []:
+        stream = resolve1(stream)
+        if not isinstance(stream, pdfminer.PDFStream):
+            continue
+        data = stream.get_data() or b''
+        if has_fonts and not has_text and TEXT_OPERATORS_PATTERN.search(data):
+            has_text = True
+        if not has_image and INLINE_IMAGE_PATTERN.search(data):
+            has_image = True
+        if has_text and has_image:
+            return has_text, has_image
+
+    xobjects = resolve1(resources.get('XObject')) or {}
+    for xobject in xobjects.values():
+        xobject = resolve1(xobject)
+        if not isinstance(xobject, pdfminer.PDFStream):
+            continue
+        subtype = xobject.get('Subtype')
+        if subtype is pdfminer.LIT('Image'):
+            has_image = True
+        elif subtype is pdfminer.LIT('Form') and depth < MAX_XOBJECT_DEPTH:
+            form_text, form_image = _scan_content(xobject.get('Resources') or resources, [xobject],
+                                                  depth + 1)
+            has_text = has_text or form_text
+            has_image = has_image or form_image
+        if has_text and has_image:
+            break
+
+    return has_text, has_image
@@ -0,0 +1,65 @@
+import re
+import unicodedata
+
+# Palabras del nombre de archivo que indican que el PDF es (o no es) la factura
+INVOICE_NAME_PATTERN = re.compile(r'factura|invoice|comprobante|(?<![a-z])(?:fact|fc|fe|cae)(?![a-z])')
+OTHER_NAME_PATTERN = re.compile(
+    r'remito|lista|precio|certificado|cotizacion|presupuesto|recibo|catalogo|orden|constancia|manual|'
+    r'ficha|garantia|nota de pedido'
+)
+
+# Marcadores que se cuentan sobre los bytes del PDF, sin parsearlo. Los PDFs con objetos
+# comprimidos (object streams) pueden no mostrarlos: en ese caso el dato no suma ni resta.
+PAGE_PATTERN = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+FONT_PATTERN = re.compile(rb'/Font(?![a-zA-Z])')
+
+# Límites de tamaño y de páginas de una factura típica
+MIN_INVOICE_BYTES = 2 * 1024
+MAX_INVOICE_BYTES = 5 * 1024 * 1024
+MAX_INVOICE_PAGES = 3
+MANY_PAGES = 10
+
+
+def score_pdf_candidate(filename, pdf_bytes):
+    """
+    Puntaje de probabilidad de que un PDF sea la factura, a partir del nombre de archivo, el tamaño,
+    la cantidad de páginas y la presencia de fuentes (capa de texto). No parsea el PDF.
+    :param filename: Nombre del archivo
+    :param pdf_bytes: Contenido del PDF
+    :return: Entero; mayor es más probable
+    """
+    score = 0
+    name = unicodedata.normalize('NFKD', (filename or '').lower()).encode('ascii', 'ignore').decode()
+    name = re.sub(r'[_\-.]+', ' ', name)
+    if INVOICE_NAME_PATTERN.search(name):
+        score += 3
+    if OTHER_NAME_PATTERN.search(name):
+        score -= 3
+
+    size = len(pdf_bytes or b'')
+    if size < MIN_INVOICE_BYTES:
+        score -= 2
+    elif size > MAX_INVOICE_BYTES:
+        score -= 1
+
+    pages = len(PAGE_PATTERN.findall(pdf_bytes or b''))
+    if 1 <= pages <= MAX_INVOICE_PAGES:
+        score += 1
+    elif pages > MANY_PAGES:
+        score -= 2
+
+    if FONT_PATTERN.search(pdf_bytes or b''):
+        score += 1
+    return score
+
+
+def rank_pdf_candidates(candidates):
+    """
+    Ordenar PDFs de mayor a menor probabilidad de ser la factura; ante igual puntaje se conserva
+    el orden original
+    :param candidates: Lista de tuplas (clave, nombre de archivo, contenido del PDF)
+    :return: Lista de claves ordenadas
+    """
+    scored = [(score_pdf_candidate(filename, pdf_bytes), index, key)
+              for index, (key, filename, pdf_bytes) in enumerate(candidates)]
+    return [key for _score, _index, key in sorted(scored, key=lambda item: (-item[0], item[1]))]
@@ -0,0 +1,87 @@
+import re
+import time
+
+# Presupuesto de la evaluación de reglas por documento. Los patrones con búsquedas perezosas
+# ([^\n]*?) y alternativas tienen un costo que crece con el cuadrado del largo de la línea: el texto
+# de OCR con líneas muy largas puede demorar una ejecución del cron por minutos.
+RULE_MAX_CHARS = 100000
+RULE_MAX_LINE_CHARS = 1000
+RULE_TIME_BUDGET_SECONDS = 5.0
+
+# Distancia máxima hacia atrás desde el límite de línea en la que se busca un espacio para cortar
+LINE_BREAK_LOOKBACK = 100
+
+
+def bound_rule_text(text_content, max_chars=RULE_MAX_CHARS, max_line_chars=RULE_MAX_LINE_CHARS):
+    """
+    Acotar el texto sobre el que se evalúan las reglas: se trunca a max_chars caracteres y las
+    líneas más largas que max_line_chars se cortan, preferentemente en un espacio, para que
+    ninguna búsqueda recorra más de una línea acotada
+    :param text_content: Texto extraído del PDF
+    :param max_chars: Cantidad máxima de caracteres
+    :param max_line_chars: Largo máximo de una línea
+    :return: Tupla (texto acotado, True si el texto se modificó)
+    """
+    text = text_content or ''
+    truncated = len(text) > max_chars
+    if truncated:
+        text = text[:max_chars]
+
+    wrapped = False
+    lines = []
+    for line in text.split('\n'):
+        while len(line) > max_line_chars:
+            cut = line.rfind(' ', max_line_chars - LINE_BREAK_LOOKBACK, max_line_chars)
+            if cut <= 0:
+                cut = max_line_chars
+            lines.append(line[:cut])
+            line = line[cut:].lstrip(' ')
+            wrapped = True
+        lines.append(line)
+    if wrapped:
+        text = '\n'.join(lines)
+    return text, truncated or wrapped
+
+
+class RuleBudget:
+    """
+    Límite de tiempo de la evaluación de reglas de un documento. Las búsquedas se hacen a través
+    de search y finditer: una vez vencido el plazo no encuentran nada y exceeded queda en True,
+    de modo que las reglas terminan sin resultado en lugar de seguir buscando. Una búsqueda ya
+    iniciada no se puede interrumpir; su duración queda acotada por el largo de línea
+    (ver bound_rule_text).
+    """
+
+    def __init__(self, seconds=RULE_TIME_BUDGET_SECONDS):
+        """
+        :param seconds: Segundos disponibles; None para no limitar
+        """
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        self.exceeded = False
+
+    def expired(self):
+        if not self.exceeded and self.deadline is not None and time.monotonic() > self.deadline:
+            self.exceeded = True
+        return self.exceeded
+
+    def search(self, pattern, text, flags=0):
+        """
+        re.search dentro del presupuesto
+        :return: Coincidencia, o None si no hay o el plazo venció
+        """
+        if self.expired():
+            return None
+        return re.search(pattern, text, flags)
+
+    def finditer(self, pattern, text, flags=0):
+        """
+        re.finditer dentro del presupuesto: deja de devolver coincidencias al vencer el plazo
+        """
+        if self.expired():
+            return
+        for match in re.finditer(pattern, text, flags):
+            if self.expired():
+                return
+            yield match
+
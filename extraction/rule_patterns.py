@@ -0,0 +1,77 @@
+import re
+
+# Patrones de las reglas de extracción (extract_po_number y extract_invoice_data). Están fuera del
+# modelo para poder medirlos sin Odoo (ver scripts/stress_rule_patterns.py).
+# Cualquier cambio en este archivo requiere incrementar RULESET_VERSION.
+
+# Referencia específica de "Pedido de compra"
+PEDIDO_PATTERN = r'pedido de compra[^\n]*?#P([0-9]{4,})'
+
+# Patrones principales para números de OC
+PO_PRIMARY_PATTERNS = [
+    # Patrones directos para números de PO - estos tienen prioridad
+    r'(?<!\w)P([0-9]{4,})(?!\w)',  # P seguido de números (P03324)
+    r'(?<!\w)PO([0-9]{4,})(?!\w)',  # PO seguido de números (PO03324)
+    r'(?<!\w)OC([0-9]{4,})(?!\w)',  # PO seguido de números (OC03324)
+    r'(?<!\w)#P([0-9]{4,})(?!\w)',  # #P seguido de números (#P03324)
+    r'(?<!\w)#PO([0-9]{4,})(?!\w)',  # #PO seguido de números (#PO03324)
+]
+
+# Patrones secundarios (se utilizan si los primarios no encuentran nada)
+PO_SECONDARY_PATTERNS = [
+    # Patrones con palabras clave que podrían ayudar a identificar OCs
+    r'(?:CORRESPONDE)[:\s]*(?:P|#P)?([0-9]{4,})',
+    r'(?:CORRESPONDE)[:\s]*([A-Z][0-9]{4,})',
+
+    # Patrones en inglés - asegurando que incluyan números
+    r'(?:P\.O\.|PO|Purchase Order)[:\s#]*([A-Z0-9]*[0-9]+[A-Z0-9]*)',
+    r'(?:P|#P|#PO)[:\s#]*([0-9]{4,})',
+
+    # Patrones en español (OC = Orden de Compra)
+    r'(?:OC|OC#|OCN|OCN#)[:\s#]*([A-Z0-9]*[0-9]+[A-Z0-9]*)',
+    r'(?:O\.C\.|O\.C\.#)[:\s#]*([A-Z0-9]*[0-9]+[A-Z0-9]*)',
+
+    # Palabras clave adicionales que podrían preceder a un número de OC
+    r'(?:REFERENCIA|REF|REF\.|REFERENCIA:|REF:|REF\.:|NRO\.?)[:\s#]*([A-Z0-9]*[0-9]+[A-Z0-9]*)',
+
+    # Buscar patrones con números cerca de palabras clave
+    r'(?:orden de compra|orden|purchase|compra|pedido)[^\n]*?([A-Z]*[0-9]{4,}[A-Z0-9-]*)',
+
+    # Patrones específicos con "Pedido de compra"
+    r'pedido de compra[:\s#]*([A-Z]*[0-9]{4,}[A-Z0-9-]*)',
+    r'pedido de compra[^\n]*?#P([0-9]{4,})',
+    r'pedido de compra[^\n]*?#([0-9]{4,})',
+    r'pedido\s*de\s*compra[^\n]*?#P([0-9]{4,})',
+]
+
+# Última pasada: cualquier combinación P + números que parezca ser una OC
+PO_GENERIC_PATTERN = r'P[0-9]{4,}'
+
+# Datos de la factura
+CUIT_PATTERN = r'(?:CUIT|cuit)[:\s]*(\d{2}-\d{8}-\d{1})'
+# Entre la palabra clave y el valor se admiten hasta 300 caracteres sin dígitos (incluidos saltos de
+# línea): sin ese límite la búsqueda recorre el resto del texto desde cada palabra clave
+INVOICE_NUMBER_PATTERN = r'(?:FACTURA|FACTURA\s+[ABC]|FACTURA\s+ELECTRONICA)[^0-9]{0,300}([0-9]{4,5}-[0-9]{8})'
+DATE_PATTERNS = [
+    r'(?:FECHA|DATE)[^\d]{0,300}(\d{2}[/-]\d{2}[/-]\d{4})',  # e.g., FECHA 15/03/2025
+    r'\b(\d{2}[/-]\d{2}[/-]\d{4})\b'  # standalone date
+]
+TOTAL_PATTERN = r'(?:Total|TOTAL)[:\s]*\$?\s*([\d.,]+)'
+IVA_PATTERN = r'(?:IVA|iva|I\.V\.A\.)[:\s]*\$?\s*([\d.,]+)'
+
+# Patrones con nombre y flags de re, en el orden en que se evalúan
+RULE_PATTERNS = (
+    [('pedido', PEDIDO_PATTERN, re.IGNORECASE)]
+    + [(f'po_primary_{index}', pattern, re.IGNORECASE) for index, pattern in enumerate(PO_PRIMARY_PATTERNS)]
+    + [(f'po_secondary_{index}', pattern, re.IGNORECASE) for index, pattern in enumerate(PO_SECONDARY_PATTERNS)]
+    + [
+        ('po_generic', PO_GENERIC_PATTERN, re.IGNORECASE),
+        ('cuit', CUIT_PATTERN, 0),
+        ('invoice_number', INVOICE_NUMBER_PATTERN, re.IGNORECASE),
+    ]
+    + [(f'date_{index}', pattern, re.IGNORECASE) for index, pattern in enumerate(DATE_PATTERNS)]
+    + [
+        ('total', TOTAL_PATTERN, 0),
+        ('iva', IVA_PATTERN, 0),
+    ]
+)
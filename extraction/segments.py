@@ -0,0 +1,84 @@
+import re
+
+from .afip_qr import normalize_cuit
+from .pdf_text import PAGE_SEPARATOR
+from .rule_budget import bound_rule_text
+
+# Encabezado de comprobante al comienzo de una factura
+DOCUMENT_HEADER_PATTERN = re.compile(r'FACTURA|NOTA\s+DE\s+D[EÉ]BITO', re.IGNORECASE)
+# Número de comprobante: "FACTURA A 00001-00001234" o, en el formato de AFIP,
+# "Punto de Venta: 00001 Comp. Nro: 00001234"
+DOCUMENT_NUMBER_PATTERNS = (
+    re.compile(r'(?:FACTURA|NOTA\s+DE\s+D[EÉ]BITO)[^0-9]*([0-9]{4,5})\s*-\s*([0-9]{8})', re.IGNORECASE),
+    re.compile(r'Punto\s+de\s+Venta\s*:?\s*([0-9]{4,5})\s+Comp\.?\s*N(?:ro|°|º)?\.?\s*:?\s*([0-9]{8})',
+               re.IGNORECASE),
+)
+# Primer CUIT de la página: el del emisor
+CUIT_PATTERN = re.compile(r'CUIT[:\s]*(\d{2}-?\d{8}-?\d)', re.IGNORECASE)
+
+
+def split_pages(text_content):
+    """
+    :param text_content: Texto extraído del PDF
+    :return: Lista con el texto de cada página
+    """
+    return (text_content or '').split(PAGE_SEPARATOR)
+
+
+def page_document_key(page_text):
+    """
+    Identificar la factura que empieza o continúa en una página
+    :param page_text: Texto de la página
+    :return: Tupla (CUIT del emisor, punto de venta, número), o None si la página no tiene
+             encabezado y número de comprobante (continuación de la factura anterior)
+    """
+    if not DOCUMENT_HEADER_PATTERN.search(page_text):
+        return None
+    for pattern in DOCUMENT_NUMBER_PATTERNS:
+        match = pattern.search(page_text)
+        if match:
+            cuit_match = CUIT_PATTERN.search(page_text)
+            cuit = normalize_cuit(cuit_match.group(1)) if cuit_match else ''
+            return cuit, int(match.group(1)), int(match.group(2))
+    return None
+
+
+def segment_invoice_pages(text_content):
+    """
+    Separar un PDF que trae varias facturas (una por página o por rango de páginas) a partir del
+    texto de cada página. Una página con encabezado y un número de comprobante nuevo (CUIT, punto de
+    venta y número) empieza una factura; las páginas sin número continúan la factura anterior y las
+    copias (ORIGINAL, DUPLICADO, TRIPLICADO) se agrupan con la factura de su mismo número.
+    Recibe el texto completo: los patrones se evalúan sobre cada página acotada con bound_rule_text,
+    pero los segmentos conservan el texto completo de sus páginas.
+    :param text_content: Texto extraído del PDF, con las páginas separadas por PAGE_SEPARATOR
+    :return: Lista de segmentos {'key', 'pages' (números de página, base 1), 'text'} si el PDF trae
+             más de una factura; lista vacía si trae una sola
+    """
+    segments = []
+    by_key = {}
+    for pageno, page_text in enumerate(split_pages(text_content), 1):
+        key = page_document_key(bound_rule_text(page_text)[0])
+        if key is not None and key in by_key:
+            segment = by_key[key]
+        elif key is not None and segments and segments[-1]['key'] is None:
+            # Páginas iniciales sin número (p. ej. una carta): pertenecen a la primera factura
+            segment = segments[-1]
+            segment['key'] = key
+            by_key[key] = segment
+        elif key is not None or not segments:
+            segment = {'key': key, 'pages': [], 'texts': []}
+            segments.append(segment)
+            if key is not None:
+                by_key[key] = segment
+        else:
+            segment = segments[-1]
+        segment['pages'].append(pageno)
+        segment['texts'].append(page_text)
+
+    if len(by_key) < 2:
+        return []
+    return [
+        {'key': segment['key'], 'pages': segment['pages'], 'text': PAGE_SEPARATOR.join(segment['texts'])}
+        for segment in segments
+    ]
@@ -2,6 +2,17 @@ import logging
 
 _logger = logging.getLogger(__name__)
 
+# Stages created on install: (name, sequence, XML ID name). The quarantine stage gets an
+# explicit XML ID name because PARSER_STAGES looks it up as stage_pdf_cuarentena.
+PARSER_HOOK_STAGES = [
+    ('Facturas Nuevas', 1, 'stage_facturas_nuevas'),
+    ('Tickets sin PDF', 2, 'stage_tickets_sin_pdf'),
+    ('PDF sin PO#', 3, 'stage_pdf_sin_po#'),
+    ('PO# Inexistente', 4, 'stage_po#_inexistente'),
+    ('PDF en Cuarentena', 7, 'stage_pdf_cuarentena'),
+]
+
+
 def post_init_hook(cr, registry):
     """
     Post-init hook to ensure required helpdesk stages exist.
@@ -11,15 +22,20 @@ def post_init_hook(cr, registry):
 
     env = api.Environment(cr, SUPERUSER_ID, {})
 
+    ensure_parser_stages(env)
+
+    # Fingerprint the vendor bills that existed before installation, so the duplicate check
+    # in create_draft_invoice also finds them (upgrades do it in the 16.0.1.0.35 migration)
+    env['bmi.invoice.fingerprint']._sync_all()
+
+
+def ensure_parser_stages(env):
+    """
+    Create the stages of PARSER_HOOK_STAGES that are missing and give each one its XML ID.
+    Also used by the 16.0.1.0.55 migration, which adds the quarantine stage to existing databases.
+    """
     # Create or update required stages
-    stages = [
-        ('Facturas Nuevas', 1),
-        ('Tickets sin PDF', 2),
-        ('PDF sin PO#', 3),
-        ('PO# Inexistente', 4)
-    ]
-
-    for name, seq in stages:
+    for name, seq, _xml_name in PARSER_HOOK_STAGES:
         stage = env['helpdesk.stage'].search([('name', '=', name)], limit=1)
         if not stage:
             _logger.info(f"Creating helpdesk stage: {name}")
@@ -31,17 +47,17 @@ def post_init_hook(cr, registry):
             _logger.info(f"Helpdesk stage already exists: {name}")
 
     # Create XML IDs for these stages
-    for name, _ in stages:
+    for name, _, xml_name in PARSER_HOOK_STAGES:
         stage = env['helpdesk.stage'].search([('name', '=', name)], limit=1)
         if stage:
-            xml_id = f"bmi_invoice_parser.stage_{'_'.join(name.lower().split())}"
+            xml_id = f"bmi_invoice_parser.{xml_name}"
             if not env['ir.model.data'].search([
                 ('model', '=', 'helpdesk.stage'),
                 ('res_id', '=', stage.id),
                 ('module', '=', 'bmi_invoice_parser')
             ]):
                 env['ir.model.data'].create({
-                    'name': f"stage_{'_'.join(name.lower().split())}",
+                    'name': xml_name,
                     'model': 'helpdesk.stage',
                     'res_id': stage.id,
                     'module': 'bmi_invoice_parser',
@@ -0,0 +1,20 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    El cron de facturas está en un bloque noupdate: actualizar su código para que use la reserva
+    de tickets entre workers
+    """
+    cr.execute("""
+        UPDATE ir_act_server
+           SET code = 'model._cron_procesar_facturas()'
+         WHERE id = (SELECT a.id
+                       FROM ir_act_server a
+                       JOIN ir_cron c ON c.ir_actions_server_id = a.id
+                       JOIN ir_model_data d ON d.model = 'ir.cron' AND d.res_id = c.id
+                      WHERE d.module = 'bmi_invoice_parser' AND d.name = 'ir_cron_process_invoices')
+    """)
+    _logger.info(f"Código del cron de facturas actualizado ({cr.rowcount} registros)")
@@ -0,0 +1,12 @@
+import logging
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Completar la tabla de huellas con las facturas de proveedor existentes
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['bmi.invoice.fingerprint']._sync_all()
@@ -0,0 +1,17 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Crear y completar por SQL la clave de CUIT normalizada de los contactos, para que Odoo no
+    recalcule el campo contacto por contacto al actualizar el módulo
+    """
+    cr.execute("ALTER TABLE res_partner ADD COLUMN IF NOT EXISTS x_cuit_key varchar")
+    cr.execute("""
+        UPDATE res_partner
+           SET x_cuit_key = NULLIF(regexp_replace(vat, '[^0-9]', '', 'g'), '')
+         WHERE vat IS NOT NULL
+    """)
+    _logger.info(f"Clave de CUIT normalizada completada ({cr.rowcount} contactos)")
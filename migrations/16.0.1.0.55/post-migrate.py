@@ -0,0 +1,14 @@
+import logging
+from odoo import api, SUPERUSER_ID
+from odoo.addons.bmi_invoice_parser.hooks.hooks import ensure_parser_stages
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Crear la etapa 'PDF en Cuarentena' con su XML ID en las bases instaladas antes de que el
+    hook de instalación la incluyera
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    ensure_parser_stages(env)
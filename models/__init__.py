@@ -1 +1,11 @@
 from . import invoice_parser
+from . import invoice_extraction_result
+from . import invoice_batch
+from . import invoice_replay
+from . import invoice_fingerprint
+from . import account_move
+from . import res_partner
+from . import ir_attachment
+from . import invoice_backfill
+from . import invoice_metrics
+from . import invoice_loadtest
@@ -0,0 +1,19 @@
+from odoo import models, api
+
+from .invoice_fingerprint import FINGERPRINT_TRIGGER_FIELDS
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        moves = super().create(vals_list)
+        self.env['bmi.invoice.fingerprint'].sudo()._sync_moves(moves.filtered(lambda m: m.move_type == 'in_invoice'))
+        return moves
+
+    def write(self, vals):
+        result = super().write(vals)
+        if FINGERPRINT_TRIGGER_FIELDS.intersection(vals):
+            self.env['bmi.invoice.fingerprint'].sudo()._sync_moves(self)
+        return result
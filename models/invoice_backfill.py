@@ -0,0 +1,286 @@
+import time
+import logging
+from collections import Counter
+from datetime import timedelta
+from odoo import models, fields, api
+
+from .invoice_parser import OUTCOMES, OUTCOME_OMITIDO, CLAIM_BATCH_SIZE, CLAIM_LEASE_MINUTES
+from .parser_run import ParserRun
+
+_logger = logging.getLogger(__name__)
+
+# Tickets por tramo: cada tramo es la unidad de reparto entre workers y de checkpoint
+BACKFILL_CHUNK_SIZE = 200
+
+# Reserva de un tramo; se renueva con cada ticket, así que solo vence si el worker se cae
+BACKFILL_CHUNK_LEASE_MINUTES = 10
+
+
+class InvoiceBackfill(models.Model):
+    _name = 'bmi.invoice.backfill'
+    _description = 'Reprocesamiento masivo de tickets de facturas'
+    _order = 'id desc'
+
+    name = fields.Char(string='Reprocesamiento', required=True)
+    date_from = fields.Datetime(string='Creados desde')
+    date_to = fields.Datetime(string='Creados hasta')
+    stage_ids = fields.Many2many('helpdesk.stage', string='Etapas')
+    include_invoiced = fields.Boolean(string='Incluir tickets con factura')
+    rate = fields.Integer(string='Tickets por minuto', help='Límite de tickets por minuto entre todos los workers; '
+                                                             '0 para no limitar')
+    state = fields.Selection([
+        ('running', 'En proceso'),
+        ('done', 'Terminado'),
+    ], string='Estado', default='running', required=True, index=True)
+    total_count = fields.Integer(string='Tickets')
+    chunk_ids = fields.One2many('bmi.invoice.backfill.chunk', 'backfill_id', string='Tramos')
+    date_start = fields.Datetime(string='Inicio', default=fields.Datetime.now)
+    date_end = fields.Datetime(string='Fin')
+
+    @api.model
+    def _create_backfill(self, date_from=None, date_to=None, stage_names=None, include_invoiced=False,
+                         chunk_size=BACKFILL_CHUNK_SIZE, rate=0):
+        """
+        Crear un reprocesamiento con los tickets que cumplen los filtros, repartidos en tramos
+        :param date_from: Fecha de creación mínima
+        :param date_to: Fecha de creación máxima
+        :param stage_names: Lista de nombres de etapas
+        :param include_invoiced: Si es False se omiten los tickets que ya tienen factura vinculada
+        :param chunk_size: Tickets por tramo
+        :param rate: Límite de tickets por minuto (0 para no limitar)
+        :return: registro bmi.invoice.backfill
+        """
+        stages = self.env['helpdesk.stage'].search([('name', 'in', stage_names)]) if stage_names else \
+            self.env['helpdesk.stage']
+        domain = []
+        if date_from:
+            domain.append(('create_date', '>=', date_from))
+        if date_to:
+            domain.append(('create_date', '<=', date_to))
+        if stage_names:
+            domain.append(('stage_id', 'in', stages.ids))
+        if not include_invoiced:
+            domain.append(('x_invoice_id', '=', False))
+        ticket_ids = self.env['helpdesk.ticket'].search(domain, order='id').ids
+
+        backfill = self.create({
+            'name': f"Reprocesamiento de {len(ticket_ids)} tickets",
+            'date_from': date_from or False,
+            'date_to': date_to or False,
+            'stage_ids': [(6, 0, stages.ids)],
+            'include_invoiced': include_invoiced,
+            'rate': rate,
+            'total_count': len(ticket_ids),
+        })
+        self.env['bmi.invoice.backfill.chunk'].create([
+            {
+                'backfill_id': backfill.id,
+                'sequence': index // chunk_size,
+                'ticket_ids': ticket_ids[index:index + chunk_size],
+            }
+            for index in range(0, len(ticket_ids), chunk_size)
+        ])
+        if not ticket_ids:
+            backfill.write({'state': 'done', 'date_end': fields.Datetime.now()})
+        _logger.info(f"Reprocesamiento {backfill.id} creado con {len(ticket_ids)} tickets en "
+                     f"{len(backfill.chunk_ids)} tramos")
+        return backfill
+
+    def _run_worker(self, workers=1):
+        """
+        Procesar tramos del reprocesamiento hasta que no quede ninguno disponible. Varios workers
+        (procesos o servidores) pueden ejecutarlo en paralelo: cada uno reserva tramos distintos.
+        Cada tramo terminado queda confirmado (checkpoint), por lo que un reprocesamiento
+        interrumpido continúa desde los tramos pendientes.
+        :param workers: Cantidad de workers en paralelo, para repartir el límite de tickets por minuto
+        :return: Cantidad de tickets procesados por este worker
+        """
+        self.ensure_one()
+        ticket_model = self.env['helpdesk.ticket']
+        stages = ticket_model._get_parser_stages()
+        partners_by_cuit = {}
+        # Segundos mínimos entre tickets de este worker para respetar el límite global
+        interval = 60.0 * workers / self.rate if self.rate else 0.0
+        processed = 0
+
+        while True:
+            chunk = self._claim_chunk()
+            if not chunk:
+                break
+            processed += chunk._process(stages, partners_by_cuit, interval)
+
+        self._check_done()
+        return processed
+
+    def _claim_chunk(self):
+        """
+        Reservar el próximo tramo pendiente (o con la reserva vencida) con FOR UPDATE SKIP LOCKED
+        :return: registro bmi.invoice.backfill.chunk (vacío si no quedan tramos disponibles)
+        """
+        self.ensure_one()
+        now = fields.Datetime.now()
+        self.env['bmi.invoice.backfill.chunk'].flush_model()
+        self.env.cr.execute("""
+            UPDATE bmi_invoice_backfill_chunk
+               SET state = 'running', lease_until = %s
+             WHERE id = (SELECT id
+                           FROM bmi_invoice_backfill_chunk
+                          WHERE backfill_id = %s
+                            AND (state = 'pending' OR (state = 'running' AND lease_until < %s))
+                       ORDER BY sequence, id
+                          LIMIT 1
+                            FOR UPDATE SKIP LOCKED)
+         RETURNING id
+        """, [now + timedelta(minutes=BACKFILL_CHUNK_LEASE_MINUTES), self.id, now])
+        row = self.env.cr.fetchone()
+        self.env.cr.commit()
+        self.env['bmi.invoice.backfill.chunk'].invalidate_model(['state', 'lease_until'])
+        return self.env['bmi.invoice.backfill.chunk'].browse(row[0] if row else [])
+
+    def _check_done(self):
+        """
+        Marcar el reprocesamiento como terminado si todos sus tramos terminaron
+        """
+        self.ensure_one()
+        self.env['bmi.invoice.backfill.chunk'].flush_model()
+        self.env.cr.execute("""
+            UPDATE bmi_invoice_backfill
+               SET state = 'done', date_end = %s
+             WHERE id = %s AND state = 'running'
+               AND NOT EXISTS (SELECT 1 FROM bmi_invoice_backfill_chunk
+                                WHERE backfill_id = %s AND state != 'done')
+        """, [fields.Datetime.now(), self.id, self.id])
+        self.env.cr.commit()
+        self.invalidate_recordset(['state', 'date_end'])
+
+    def _get_progress(self):
+        """
+        Avance del reprocesamiento
+        :return: Diccionario con estado, tickets totales y procesados, tramos terminados y
+                 cantidad de tickets por resultado
+        """
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT count(*) FILTER (WHERE state = 'done'), count(*), COALESCE(sum(processed_count), 0)
+              FROM bmi_invoice_backfill_chunk
+             WHERE backfill_id = %s
+        """, [self.id])
+        chunks_done, chunks_total, processed = self.env.cr.fetchone()
+        outcomes = Counter()
+        for chunk in self.chunk_ids.filtered(lambda c: c.state != 'pending'):
+            outcomes.update((chunk.outcomes or {}).values())
+        labels = dict(OUTCOMES)
+        return {
+            'state': self.state,
+            'total': self.total_count,
+            'processed': processed,
+            'chunks_done': chunks_done,
+            'chunks_total': chunks_total,
+            'outcomes': {labels.get(outcome, outcome): count for outcome, count in outcomes.items()},
+        }
+
+
+class InvoiceBackfillChunk(models.Model):
+    _name = 'bmi.invoice.backfill.chunk'
+    _description = 'Tramo de un reprocesamiento de tickets'
+    _order = 'backfill_id, sequence, id'
+
+    backfill_id = fields.Many2one('bmi.invoice.backfill', string='Reprocesamiento', required=True,
+                                  ondelete='cascade', index=True)
+    sequence = fields.Integer(string='Secuencia')
+    ticket_ids = fields.Json(string='IDs de tickets')
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('running', 'En proceso'),
+        ('done', 'Terminado'),
+    ], string='Estado', default='pending', required=True, index=True)
+    lease_until = fields.Datetime(string='Reservado hasta')
+    outcomes = fields.Json(string='Resultados por ticket', help='Diccionario {ID de ticket: resultado}')
+    processed_count = fields.Integer(string='Procesados')
+    seconds = fields.Float(string='Duración (s)')
+    date_done = fields.Datetime(string='Terminado')
+
+    def _process(self, stages, partners_by_cuit, interval=0.0):
+        """
+        Procesar los tickets del tramo que todavía no tienen resultado, reservándolos en tandas
+        como el cron y registrando el resultado de cada ticket, de modo que un tramo retomado no
+        vuelva a procesar los tickets ya confirmados.
+        Los tickets que tenía reservados otro proceso y los que no se pudieron actualizar al aplicar
+        los cambios agrupados quedan sin resultado: el tramo no se da por terminado, sino que
+        queda reservado hasta que venza la reserva de esos tickets y se retoma entonces.
+        :param stages: Diccionario de etapas obtenido con _get_parser_stages
+        :param partners_by_cuit: Caché de proveedores por CUIT del worker
+        :param interval: Segundos mínimos entre tickets (límite de tickets por minuto)
+        :return: Cantidad de tickets procesados
+        """
+        self.ensure_one()
+        ticket_model = self.env['helpdesk.ticket']
+        outcomes = dict(self.outcomes or {})
+        pending_ids = [ticket_id for ticket_id in self.ticket_ids or [] if str(ticket_id) not in outcomes]
+        start = time.monotonic()
+        next_ticket_at = start
+        retry_ids = []
+
+        for index in range(0, len(pending_ids), CLAIM_BATCH_SIZE):
+            batch_ids = pending_ids[index:index + CLAIM_BATCH_SIZE]
+            tickets, token = ticket_model._claim_tickets([('id', 'in', batch_ids)], len(batch_ids),
+                                                         CLAIM_LEASE_MINUTES)
+            documents = ticket_model._extract_claimed_documents(tickets) if tickets else {}
+            existing_ids = set(ticket_model.browse(batch_ids).exists().ids)
+            # Los tickets con cambios postergados registran su resultado cuando se aplican
+            pending = ParserRun()
+            deferred = {}
+            for ticket_id in batch_ids:
+                ticket = tickets.filtered(lambda t: t.id == ticket_id)
+                if ticket:
+                    time.sleep(max(0.0, next_ticket_at - time.monotonic()))
+                    next_ticket_at = time.monotonic() + interval
+                    outcome = ticket_model._procesar_ticket_reservado(ticket, stages, token, partners_by_cuit,
+                                                                      documents, pending=pending)
+                else:
+                    outcome = OUTCOME_OMITIDO
+                if ticket_id in pending.changes:
+                    deferred[str(ticket_id)] = outcome
+                elif outcome == OUTCOME_OMITIDO and ticket_id in existing_ids:
+                    # Reservado por el cron u otro proceso: se reintenta al retomar el tramo
+                    retry_ids.append(ticket_id)
+                else:
+                    # Procesado, o eliminado (omitido definitivamente)
+                    outcomes[str(ticket_id)] = outcome
+                self.write({
+                    'outcomes': outcomes,
+                    'processed_count': len(outcomes),
+                    'lease_until': fields.Datetime.now() + timedelta(minutes=BACKFILL_CHUNK_LEASE_MINUTES),
+                })
+                self.env.cr.commit()
+            if deferred:
+                if ticket_model._apply_pending_changes(pending):
+                    outcomes.update(deferred)
+                else:
+                    retry_ids.extend(int(ticket_id) for ticket_id in deferred)
+                self.write({'outcomes': outcomes, 'processed_count': len(outcomes)})
+                self.env.cr.commit()
+
+        if retry_ids:
+            # Checkpoint parcial: el tramo se retoma cuando vencen las reservas de esos tickets
+            self.write({
+                'lease_until': fields.Datetime.now() + timedelta(minutes=CLAIM_LEASE_MINUTES),
+                'seconds': self.seconds + time.monotonic() - start,
+            })
+            self.env.cr.commit()
+            _logger.info(f"Reprocesamiento {self.backfill_id.id}: tramo {self.sequence} con {len(retry_ids)} "
+                         f"tickets sin procesar (reservados por otro proceso o con error al aplicar los "
+                         f"cambios); se retoma en {CLAIM_LEASE_MINUTES} minutos")
+            return len(pending_ids) - len(retry_ids)
+
+        # Checkpoint del tramo
+        self.write({
+            'state': 'done',
+            'lease_until': False,
+            'seconds': self.seconds + time.monotonic() - start,
+            'date_done': fields.Datetime.now(),
+        })
+        self.env.cr.commit()
+        _logger.info(f"Reprocesamiento {self.backfill_id.id}: tramo {self.sequence} terminado, "
+                     f"{len(pending_ids)} tickets en {time.monotonic() - start:.1f}s")
+        return len(pending_ids)
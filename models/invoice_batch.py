@@ -0,0 +1,172 @@
+import logging
+from odoo import models, fields, api
+
+from .invoice_parser import OUTCOMES, OUTCOME_OMITIDO, OUTCOME_ERROR, CLAIM_BATCH_SIZE
+from .parser_run import ParserRun
+
+_logger = logging.getLogger(__name__)
+
+# Tipo de notificación del bus con el avance de los lotes
+BATCH_NOTIFICATION_TYPE = 'bmi_invoice_parser/batch_progress'
+
+
+class InvoiceBatch(models.Model):
+    _name = 'bmi.invoice.batch'
+    _description = 'Lote de procesamiento de facturas'
+    _order = 'id desc'
+
+    name = fields.Char(string='Lote', required=True, default='Procesamiento de facturas')
+    user_id = fields.Many2one('res.users', string='Solicitado por', default=lambda self: self.env.user,
+                              required=True)
+    ticket_ids = fields.Many2many('helpdesk.ticket', string='Tickets')
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('running', 'En proceso'),
+        ('done', 'Terminado'),
+    ], string='Estado', default='pending', required=True, index=True)
+    total_count = fields.Integer(string='Tickets')
+    processed_count = fields.Integer(string='Procesados')
+    outcomes = fields.Json(string='Resultados por ticket')
+    date_start = fields.Datetime(string='Inicio')
+    date_end = fields.Datetime(string='Fin')
+
+    @api.model
+    def _enqueue(self, tickets):
+        """
+        Crear un lote con los tickets y disparar el cron de procesamiento en segundo plano
+        :param tickets: conjunto de registros helpdesk.ticket
+        :return: registro bmi.invoice.batch
+        """
+        batch = self.create({
+            'name': f"Procesamiento de {len(tickets)} tickets",
+            'ticket_ids': [(6, 0, tickets.ids)],
+            'total_count': len(tickets),
+            'outcomes': [],
+        })
+        cron = self.env.ref('bmi_invoice_parser.ir_cron_process_invoice_batches', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        else:
+            _logger.warning("No se encontró el cron de procesamiento de lotes. El lote quedará pendiente.")
+        _logger.info(f"Lote {batch.id} encolado con {len(tickets)} tickets")
+        return batch
+
+    @api.model
+    def _cron_process_batches(self):
+        """
+        Procesar los lotes pendientes, en orden de creación
+        """
+        for batch in self.search([('state', 'in', ('pending', 'running'))], order='id'):
+            batch._process()
+
+    def _process(self):
+        """
+        Procesar los tickets del lote, confirmando la transacción después de cada ticket para
+        que el avance y los resultados lleguen al usuario por el bus.
+        Los cambios de los tickets que no vinculan facturas se aplican agrupados cada
+        CLAIM_BATCH_SIZE tickets, y su resultado se registra recién entonces.
+        Un lote interrumpido continúa desde el primer ticket sin resultado.
+        """
+        self.ensure_one()
+        ticket_model = self.env['helpdesk.ticket']
+        self.write({
+            'state': 'running',
+            'date_start': self.date_start or fields.Datetime.now(),
+        })
+        self.env.cr.commit()
+
+        stages = ticket_model._get_parser_stages()
+        facturas_nuevas_stage = ticket_model._get_facturas_nuevas_stage()
+        done_ids = {line['ticket_id'] for line in self.outcomes or []}
+        partners_by_cuit = {}
+        pending = ParserRun()
+        deferred = []
+
+        for ticket in self.ticket_ids.filtered(lambda t: t.id not in done_ids):
+            # Otro proceso pudo haber movido el ticket mientras el lote esperaba, o el cron puede
+            # tenerlo reservado: solo se procesa si se logra reservarlo en 'Facturas Nuevas'
+            domain = [('id', '=', ticket.id)]
+            if facturas_nuevas_stage:
+                domain.append(('stage_id', '=', facturas_nuevas_stage.id))
+            claimed, token = ticket_model._claim_tickets(domain, 1)
+            if claimed:
+                documents = ticket_model._extract_claimed_documents(claimed)
+                outcome = ticket_model._procesar_ticket_reservado(ticket, stages, token, partners_by_cuit, documents,
+                                                                  pending=pending)
+            else:
+                outcome = OUTCOME_OMITIDO
+            if ticket.id in pending.changes:
+                deferred.append((ticket, outcome))
+                if len(deferred) >= CLAIM_BATCH_SIZE:
+                    self._apply_deferred(pending, deferred)
+                    pending, deferred = ParserRun(), []
+                continue
+            self._record_outcome(ticket, outcome)
+            self.env.cr.commit()
+        self._apply_deferred(pending, deferred)
+
+        self.write({
+            'state': 'done',
+            'date_end': fields.Datetime.now(),
+        })
+        self._notify_progress()
+        self.env.cr.commit()
+
+    def _apply_deferred(self, pending, deferred):
+        """
+        Aplicar los cambios postergados de los tickets y registrar su resultado
+        :param pending: ParserRun con los cambios postergados (ver _procesar_ticket_reservado)
+        :param deferred: Lista de tuplas (ticket, resultado)
+        """
+        if not deferred:
+            return
+        applied = self.env['helpdesk.ticket']._apply_pending_changes(pending)
+        for ticket, outcome in deferred:
+            self._record_outcome(ticket, outcome if applied else OUTCOME_ERROR)
+        self.env.cr.commit()
+
+    def _record_outcome(self, ticket, outcome):
+        """
+        Registrar el resultado de un ticket y notificar el avance
+        :param ticket: registro helpdesk.ticket
+        :param outcome: Resultado del procesamiento (una de las claves de OUTCOMES)
+        """
+        self.ensure_one()
+        outcomes = list(self.outcomes or [])
+        outcomes.append({'ticket_id': ticket.id, 'ticket_name': ticket.name, 'outcome': outcome})
+        self.write({
+            'outcomes': outcomes,
+            'processed_count': len(outcomes),
+        })
+        self._notify_progress(outcomes[-1])
+
+    def _get_outcome_summary(self):
+        """
+        Cantidad de tickets por resultado
+        :return: Diccionario {etiqueta del resultado: cantidad}
+        """
+        self.ensure_one()
+        labels = dict(OUTCOMES)
+        summary = {}
+        for line in self.outcomes or []:
+            label = labels.get(line['outcome'], line['outcome'])
+            summary[label] = summary.get(label, 0) + 1
+        return summary
+
+    def _notify_progress(self, line=None):
+        """
+        Enviar el avance del lote al usuario que lo solicitó
+        :param line: Resultado del último ticket procesado
+        """
+        self.ensure_one()
+        payload = {
+            'batch_id': self.id,
+            'state': self.state,
+            'processed': self.processed_count,
+            'total': self.total_count,
+        }
+        if line:
+            payload.update(line, outcome_label=dict(OUTCOMES).get(line['outcome'], line['outcome']))
+        if self.state == 'done':
+            payload['summary'] = self._get_outcome_summary()
+        self.env['bus.bus']._sendone(self.user_id.partner_id, BATCH_NOTIFICATION_TYPE, payload)
@@ -0,0 +1,509 @@
+import time
+import base64
+import logging
+from datetime import timedelta
+from io import BytesIO
+from odoo import models, fields, api
+
+from ..extraction import (
+    extract_documents, segment_invoice_pages, RuleBudget, LAYOUT_METHODS,
+    PDFExtractionError,
+)
+from .invoice_parser import RULESET_VERSION, EXTRACTION_DONE, EXTRACTION_FAILED, EXTRACTION_QUARANTINED
+from .parser_run import PARSER_RUN_CONTEXT_KEY
+
+_logger = logging.getLogger(__name__)
+
+# Reintentos de PDFs que fallan en la extracción: espera inicial (se duplica en cada intento) y
+# cantidad máxima de intentos antes de poner el adjunto en cuarentena
+EXTRACTION_RETRY_BASE_MINUTES = 15
+EXTRACTION_MAX_ATTEMPTS = 4
+
+# Niveles de extracción: primero una pasada de pdfminer sin análisis de layout y, solo si las reglas
+# no encuentran la PO o alguno de TIER_REQUIRED_FIELDS, una segunda pasada con layout completo
+TIER_FAST = 'fast'
+TIER_LAYOUT = 'layout'
+TIER_UNRESOLVED = 'unresolved'
+TIER_DIRECT = 'direct'
+TIER_REQUIRED_FIELDS = ('cuit', 'total_amount')
+
+# Resultados de versiones de reglas anteriores que se reevalúan por llamada (ver _reevaluate_outdated)
+REEVALUATION_BATCH_SIZE = 500
+
+
+class InvoiceExtractionResult(models.Model):
+    _name = 'bmi.invoice.extraction.result'
+    _description = 'Resultado de extracción de PDF de factura'
+    _order = 'id desc'
+    _rec_name = 'attachment_id'
+
+    ticket_id = fields.Many2one('helpdesk.ticket', string='Ticket', required=True, ondelete='cascade', index=True)
+    attachment_id = fields.Many2one('ir.attachment', string='Adjunto', required=True, ondelete='cascade',
+                                    index=True)
+    checksum = fields.Char(string='Checksum del PDF', help='Checksum del adjunto cuando se extrajo el texto')
+    text_content = fields.Text(string='Texto extraído', prefetch=False)
+    rule_version = fields.Char(string='Versión de reglas', index=True)
+    pedido_po = fields.Char(string="Referencia 'Pedido de compra'")
+    po_number = fields.Char(string='Número OC')
+    po_candidates = fields.Json(string='Candidatos de PO')
+    document_type = fields.Char(string='Tipo de documento')
+    invoice_data = fields.Json(string='Datos de la factura')
+    afip_qr = fields.Json(string='QR de AFIP')
+    segments = fields.Json(string='Facturas del PDF',
+                           help='Si el PDF trae varias facturas, las páginas y los datos extraídos de cada una')
+    rule_errors = fields.Text(string='Errores de reglas')
+    extraction_date = fields.Datetime(string='Fecha de extracción')
+    evaluation_date = fields.Datetime(string='Fecha de evaluación de reglas')
+    state = fields.Selection([
+        (EXTRACTION_DONE, 'Extraído'),
+        (EXTRACTION_FAILED, 'Reintento pendiente'),
+        (EXTRACTION_QUARANTINED, 'En cuarentena'),
+    ], string='Estado', default=EXTRACTION_DONE, required=True, index=True)
+    failure_count = fields.Integer(string='Intentos fallidos')
+    last_error = fields.Text(string='Último error')
+    next_attempt_date = fields.Datetime(string='Próximo intento')
+    extraction_method = fields.Char(string='Método de extracción')
+    page_kinds = fields.Json(string='Sondeo de la capa de texto',
+                             help='Clasificación de cada página (texto, imagen, vacía) obtenida al extraer el PDF; '
+                                  'se reutiliza en la pasada con layout y para estimar el costo del adjunto')
+    extraction_seconds = fields.Float(string='Duración de la extracción (s)',
+                                      help='Segundos de extracción del PDF, sumando ambas pasadas si hubo dos')
+    layout_tier = fields.Selection([
+        (TIER_FAST, 'Sin layout'),
+        (TIER_LAYOUT, 'Con layout'),
+        (TIER_UNRESOLVED, 'Sin resolver'),
+        (TIER_DIRECT, 'Sin niveles (OCR / motor nativo)'),
+    ], string='Nivel de extracción', index=True,
+        help='Pasada de extracción que resolvió el documento: sin análisis de layout, con layout completo, '
+             'ninguna de las dos, o un método en el que el layout no aplica')
+
+    _sql_constraints = [
+        ('attachment_uniq', 'unique(attachment_id)', 'Ya existe un resultado de extracción para este adjunto.'),
+    ]
+
+    @api.model
+    def _get_for_attachment(self, ticket, attachment):
+        """
+        Obtener el resultado vigente de un adjunto.
+        El PDF solo se parsea si no hay texto almacenado o si el adjunto cambió; si solo cambió
+        la versión de reglas, se reevalúan las reglas sobre el texto guardado.
+        Si la ejecución en curso ya trae el PDF extraído, se usa ese texto; en dry-run el resultado
+        no se guarda (se devuelve un registro en memoria).
+        Un PDF que no se puede leer no se vuelve a parsear hasta su próximo intento (espera
+        exponencial) y, agotados los intentos, queda en cuarentena: el resultado devuelto tiene
+        estado 'failed' o 'quarantined'.
+        :param ticket: registro helpdesk.ticket
+        :param attachment: registro ir.attachment
+        :return: registro bmi.invoice.extraction.result
+        """
+        run = self.env.context.get(PARSER_RUN_CONTEXT_KEY)
+        document = run.get_document(attachment.id) if run is not None else None
+        # Los adjuntos en memoria (replay de PDFs exportados) no tienen resultado almacenado
+        result = self.search([('attachment_id', '=', attachment.id)], limit=1) if attachment.id else self.browse()
+        same_pdf = bool(result) and result.checksum == attachment.checksum
+
+        if run is not None and run.dry_run:
+            if document is None and same_pdf and result.state == EXTRACTION_DONE:
+                document = {'text_content': result.text_content, 'afip_qr': result.afip_qr,
+                            'page_kinds': result.page_kinds or None}
+                # Con el texto de la pasada rápida, _extract_vals repite la pasada con layout si no alcanza
+                if result.layout_tier == TIER_FAST:
+                    document['method'] = result.extraction_method
+            vals = self._extract_vals(ticket, attachment, document, result if same_pdf else self.browse())
+            return self.new(vals)
+
+        if document is None and same_pdf:
+            if result.state == EXTRACTION_QUARANTINED or (
+                    result.state == EXTRACTION_FAILED and result.next_attempt_date > fields.Datetime.now()):
+                return result
+            if result.state == EXTRACTION_DONE:
+                if result.rule_version != RULESET_VERSION:
+                    result._reevaluate_rules()
+                # Texto de la pasada rápida que con las reglas vigentes ya no alcanza: se vuelve a
+                # extraer con los dos niveles, en el procesamiento y no en la reevaluación
+                if not result._needs_layout_pass():
+                    return result
+
+        vals = self._extract_vals(ticket, attachment, document, result if same_pdf else self.browse())
+        if result:
+            result.write(vals)
+        else:
+            result = self.create(vals)
+        return result
+
+    @api.model
+    def _extract_vals(self, ticket, attachment, document, previous):
+        """
+        Extraer el adjunto (si la ejecución no lo trae ya extraído) y preparar los valores del
+        resultado, registrando el fallo si el PDF no se pudo leer
+        :param ticket: registro helpdesk.ticket
+        :param attachment: registro ir.attachment
+        :param document: Diccionario con el PDF ya extraído, o None
+        :param previous: Resultado anterior del mismo PDF (vacío si no hay), para contar los intentos
+        :return: Diccionario de valores
+        """
+        error = document.get('error') if document else None
+        if document is None:
+            try:
+                document = self._extract_attachment(attachment, layout=False)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+        if error:
+            _logger.warning(f"No se pudo extraer el adjunto {attachment.name}: {error}")
+            return self._prepare_failure_vals(ticket, attachment, error, previous.failure_count)
+
+        vals = self._prepare_extraction_vals(ticket, attachment, document)
+        seconds = document.get('seconds') or 0.0
+        tier = TIER_DIRECT
+        if document.get('method') in LAYOUT_METHODS:
+            tier = TIER_FAST
+            if not self._is_resolved(vals):
+                # La pasada rápida no alcanzó: repetir solo el texto con análisis de layout completo
+                try:
+                    # Si la extracción se hizo fuera de la transacción, la pasada con layout ya viene hecha
+                    if 'layout_document' in document:
+                        layout_document = document['layout_document']
+                        if layout_document.get('error'):
+                            raise PDFExtractionError(layout_document['error'])
+                    else:
+                        layout_document = self._extract_attachment(attachment, layout=True,
+                                                                   afip_qr=document.get('afip_qr') or False,
+                                                                   page_kinds=document.get('page_kinds'))
+                    vals = self._prepare_extraction_vals(ticket, attachment, layout_document)
+                    seconds += layout_document.get('seconds') or 0.0
+                    document = layout_document
+                    tier = TIER_LAYOUT if self._is_resolved(vals) else TIER_UNRESOLVED
+                except Exception as e:
+                    _logger.warning(f"Pasada con layout del adjunto {attachment.name} falló, "
+                                    f"se conserva la pasada rápida: {e}")
+                    tier = TIER_UNRESOLVED
+        _logger.info(f"Adjunto {attachment.name} extraído con {document.get('method')}, nivel '{tier}'")
+        run = self.env.context.get(PARSER_RUN_CONTEXT_KEY)
+        if run is not None:
+            run.record_layout_tier(tier)
+
+        vals.update({
+            'state': EXTRACTION_DONE,
+            'failure_count': 0,
+            'last_error': False,
+            'next_attempt_date': False,
+            'extraction_method': document.get('method') or False,
+            'extraction_seconds': seconds,
+            'layout_tier': tier,
+        })
+        return vals
+
+    @api.model
+    def _get_pending_attachments(self, attachments):
+        """
+        Adjuntos que hay que parsear: sin resultado, con un PDF distinto al extraído o con un
+        reintento de extracción vencido. Los extraídos, en espera o en cuarentena no se parsean.
+        :param attachments: Lista de registros ir.attachment
+        :return: Lista de registros ir.attachment
+        """
+        results = self.search([('attachment_id', 'in', [attachment.id for attachment in attachments])])
+        result_by_attachment = {result.attachment_id.id: result for result in results}
+        now = fields.Datetime.now()
+        pending = []
+        for attachment in attachments:
+            result = result_by_attachment.get(attachment.id)
+            if not result or result.checksum != attachment.checksum or result._needs_layout_pass() or (
+                    result.state == EXTRACTION_FAILED and result.next_attempt_date <= now):
+                pending.append(attachment)
+        return pending
+
+    @api.model
+    def _extract_documents(self, items, workers=1, engine=None):
+        """
+        Extraer PDFs con los dos niveles de extracción (pasada rápida y, si las reglas no resuelven
+        el documento, pasada con layout), sin usar la base de datos: se ejecuta sin transacción
+        abierta y el resultado se aplica después con la ejecución (ParserRun.documents).
+        :param items: Lista de tuplas (clave, contenido del PDF)
+        :param workers: Procesos para cada pasada
+        :param engine: Motor de extracción de texto (ver TEXT_ENGINES)
+        :return: Diccionario {clave: documento extraído}; los que necesitaron la pasada con layout
+                 la traen en 'layout_document'
+        """
+        documents = extract_documents(items, workers, engine, layout=False)
+        unresolved = [
+            (key, content) for key, content in items
+            if not documents[key].get('error') and documents[key].get('method') in LAYOUT_METHODS
+            and not self._is_resolved(self._prepare_rule_vals(documents[key]['text_content'],
+                                                              documents[key]['afip_qr']))
+        ]
+        # La pasada con layout también se reparte entre los procesos; el QR y el sondeo de la capa de
+        # texto ya se hicieron en la rápida
+        layout_documents = extract_documents(
+            unresolved, workers, engine, layout=True,
+            afip_qrs={key: documents[key]['afip_qr'] or False for key, _content in unresolved},
+            probes={key: documents[key]['page_kinds'] for key, _content in unresolved},
+        )
+        for key, layout_document in layout_documents.items():
+            documents[key]['layout_document'] = layout_document
+        return documents
+
+    @api.model
+    def _is_resolved(self, vals):
+        """
+        Indica si las reglas encontraron en el texto la PO y los campos obligatorios
+        :param vals: Valores preparados por _prepare_extraction_vals
+        :return: Booleano
+        """
+        invoice_data = vals.get('invoice_data') or {}
+        return bool(vals.get('pedido_po') or vals.get('po_number')) and \
+            all(invoice_data.get(field) for field in TIER_REQUIRED_FIELDS)
+
+    @api.model
+    def _get_tier_metrics(self, domain=None):
+        """
+        Cuántos documentos resolvió cada nivel de extracción
+        :param domain: Dominio adicional (p. ej. por fecha de extracción)
+        :return: Diccionario {nivel: {'count': cantidad, 'ratio': proporción del total}}
+        """
+        groups = self.read_group(
+            [('state', '=', EXTRACTION_DONE)] + (domain or []),
+            ['layout_tier'], ['layout_tier'],
+        )
+        total = sum(group['layout_tier_count'] for group in groups)
+        return {
+            group['layout_tier'] or 'sin_dato': {
+                'count': group['layout_tier_count'],
+                'ratio': round(group['layout_tier_count'] / total, 4) if total else 0.0,
+            }
+            for group in groups
+        }
+
+    @api.model
+    def _prepare_failure_vals(self, ticket, attachment, error, failure_count=0):
+        """
+        Preparar los valores de un intento de extracción fallido: el próximo intento se espera
+        EXTRACTION_RETRY_BASE_MINUTES * 2^(intentos - 1) minutos y, al llegar a
+        EXTRACTION_MAX_ATTEMPTS, el adjunto pasa a cuarentena
+        :param ticket: registro helpdesk.ticket
+        :param attachment: registro ir.attachment
+        :param error: Descripción del error
+        :param failure_count: Intentos fallidos anteriores
+        :return: Diccionario de valores
+        """
+        failure_count += 1
+        now = fields.Datetime.now()
+        vals = {
+            'ticket_id': ticket.id,
+            'attachment_id': attachment.id,
+            'checksum': attachment.checksum,
+            'text_content': False,
+            'afip_qr': False,
+            'pedido_po': False,
+            'po_number': False,
+            'po_candidates': False,
+            'document_type': False,
+            'invoice_data': False,
+            'rule_errors': False,
+            'segments': False,
+            'extraction_date': now,
+            'failure_count': failure_count,
+            'last_error': error,
+        }
+        if failure_count >= EXTRACTION_MAX_ATTEMPTS:
+            vals.update(state=EXTRACTION_QUARANTINED, next_attempt_date=False)
+        else:
+            delay = timedelta(minutes=EXTRACTION_RETRY_BASE_MINUTES * 2 ** (failure_count - 1))
+            vals.update(state=EXTRACTION_FAILED, next_attempt_date=now + delay)
+        return vals
+
+    def action_reintentar_extraccion(self):
+        """
+        Liberar adjuntos en cuarentena o en espera: se reinician los intentos y sus tickets vuelven
+        a 'Facturas Nuevas' para ser reprocesados
+        :return: Acción de notificación con el resumen
+        """
+        pending = self.filtered(lambda r: r.state != EXTRACTION_DONE)
+        pending.write({
+            'state': EXTRACTION_FAILED,
+            'failure_count': 0,
+            'next_attempt_date': fields.Datetime.now(),
+        })
+
+        ticket_model = self.env['helpdesk.ticket']
+        facturas_nuevas_stage = ticket_model._get_facturas_nuevas_stage()
+        tickets = pending.ticket_id
+        if tickets and facturas_nuevas_stage:
+            tickets.write({
+                'stage_id': facturas_nuevas_stage.id,
+                'x_parser_lease_token': False,
+                'x_parser_lease_until': False,
+                'x_parser_cost': 0,
+            })
+            for ticket in tickets:
+                ticket.message_post(body="Ticket devuelto a 'Facturas Nuevas' - Se liberaron sus PDFs "
+                                         "para reintentar la extracción")
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Reintentar extracción',
+                'message': f'{len(pending)} adjuntos liberados; {len(tickets)} tickets devueltos a "Facturas Nuevas".',
+                'sticky': False,
+                'type': 'info',
+            }
+        }
+
+    @api.model
+    def _extract_attachment(self, attachment, layout=True, afip_qr=None, page_kinds=None):
+        """
+        Extraer el texto y el QR de AFIP de un adjunto PDF
+        :param attachment: registro ir.attachment
+        :param layout: Si es False, pdfminer no hace análisis de layout
+        :param afip_qr: QR de AFIP ya buscado en una pasada anterior (False si no se encontró); con
+                        None se busca
+        :param page_kinds: Sondeo de la capa de texto de una pasada anterior; con None se sondea
+        :return: Diccionario con el texto extraído, el método usado, el JSON del QR de AFIP, el
+                 sondeo de la capa de texto y los segundos empleados
+        """
+        start = time.perf_counter()
+        ticket_model = self.env['helpdesk.ticket']
+        pdf_file = BytesIO(attachment.raw or base64.b64decode(attachment.datas or b''))
+        text_content, method, page_kinds = ticket_model._convert_pdf_to_text_with_probe(pdf_file, layout,
+                                                                                        page_kinds)
+        if afip_qr is None:
+            afip_qr = ticket_model.extract_afip_qr(pdf_file, text_content)
+        return {
+            'text_content': text_content,
+            'method': method,
+            'afip_qr': afip_qr,
+            'page_kinds': page_kinds,
+            'seconds': time.perf_counter() - start,
+        }
+
+    @api.model
+    def _prepare_extraction_vals(self, ticket, attachment, document):
+        """
+        Preparar los valores de un resultado a partir del PDF extraído
+        :param ticket: registro helpdesk.ticket
+        :param attachment: registro ir.attachment
+        :param document: Diccionario con el texto extraído y el JSON del QR de AFIP
+        :return: Diccionario de valores
+        """
+        text_content = document.get('text_content') or ''
+        afip_qr = document.get('afip_qr')
+        vals = {
+            'ticket_id': ticket.id,
+            'attachment_id': attachment.id,
+            'checksum': attachment.checksum,
+            'text_content': text_content,
+            'afip_qr': afip_qr or False,
+            'page_kinds': document.get('page_kinds') or False,
+            'extraction_date': fields.Datetime.now(),
+        }
+        vals.update(self._prepare_rule_vals(text_content, afip_qr))
+        return vals
+
+    @api.model
+    def _prepare_rule_vals(self, text_content, afip_qr=None):
+        """
+        Evaluar las reglas de extracción y preparar los valores a almacenar
+        :param text_content: Texto extraído del PDF
+        :param afip_qr: Diccionario con el JSON del QR de AFIP, si se encontró
+        :return: Diccionario de valores
+        """
+        # Un solo tiempo máximo para el documento, incluidas sus facturas si trae varias
+        budget = RuleBudget()
+        rules = self.env['helpdesk.ticket']._evaluate_extraction_rules(text_content or '', afip_qr, budget=budget)
+        return {
+            'rule_version': RULESET_VERSION,
+            'pedido_po': rules['pedido_po'] or False,
+            'po_number': rules['po_number'] or False,
+            'po_candidates': rules['po_candidates'],
+            'document_type': rules['invoice_data'].get('document_type') or False,
+            'invoice_data': rules['invoice_data'],
+            'rule_errors': '\n'.join(rules['errors']) or False,
+            'segments': self._prepare_segments(text_content, afip_qr, budget=budget) or False,
+            'evaluation_date': fields.Datetime.now(),
+        }
+
+    @api.model
+    def _prepare_segments(self, text_content, afip_qr=None, budget=None):
+        """
+        Evaluar las reglas sobre cada factura de un PDF que trae varias (ver segment_invoice_pages).
+        El QR de AFIP corresponde a una sola de las facturas: se usa solo en la de su mismo número.
+        La separación recibe el texto completo, para no perder las facturas que empiezan después del
+        límite de bound_rule_text; el texto de cada factura se acota al evaluar sus reglas.
+        :param text_content: Texto extraído del PDF
+        :param afip_qr: Diccionario con el JSON del QR de AFIP, si se encontró
+        :param budget: Tiempo máximo del documento (RuleBudget), compartido entre sus facturas
+        :return: Lista de segmentos {'pages', 'pedido_po', 'po_number', 'po_candidates',
+                 'invoice_data', 'rule_errors'}; vacía si el PDF trae una sola factura
+        """
+        qr_key = (int(afip_qr.get('ptoVta') or 0), int(afip_qr.get('nroCmp') or 0)) if afip_qr else None
+        segments = []
+        budget = budget if budget is not None else RuleBudget()
+        for segment in segment_invoice_pages(text_content):
+            segment_qr = afip_qr if qr_key and segment['key'] and segment['key'][1:] == qr_key else None
+            rules = self.env['helpdesk.ticket']._evaluate_extraction_rules(segment['text'], segment_qr,
+                                                                           budget=budget)
+            segments.append({
+                'pages': segment['pages'],
+                'pedido_po': rules['pedido_po'] or False,
+                'po_number': rules['po_number'] or False,
+                'po_candidates': rules['po_candidates'],
+                'invoice_data': rules['invoice_data'],
+                'rule_errors': '\n'.join(rules['errors']) or False,
+            })
+        return segments
+
+    def _reevaluate_rules(self):
+        """
+        Reevaluar las reglas sobre el texto almacenado, sin volver a parsear el PDF. Si el texto es
+        el de la pasada rápida y con las reglas vigentes no alcanza, la pasada con layout queda para
+        el próximo procesamiento del ticket (ver _needs_layout_pass).
+        :return: Registros cuyo número de PO cambió
+        """
+        changed = self.browse()
+        # Los PDFs que no se pudieron leer no tienen texto sobre el cual evaluar reglas
+        for result in self.filtered(lambda r: r.state == EXTRACTION_DONE):
+            previous_po = (result.pedido_po, result.po_number)
+            result.write(self._prepare_rule_vals(result.text_content, result.afip_qr))
+            if (result.pedido_po, result.po_number) != previous_po:
+                changed |= result
+        _logger.info(f"Reglas reevaluadas (versión {RULESET_VERSION}) para {len(self)} resultados, "
+                     f"{len(changed)} con cambios en el número de PO")
+        return changed
+
+    def _needs_layout_pass(self):
+        """
+        Indica si el texto almacenado es el de la pasada rápida y las reglas vigentes ya no resuelven
+        el documento con él (por ejemplo, después de reevaluarlas): en el procesamiento se vuelve a
+        extraer con la pasada con layout, como si fuera la primera extracción (ver _extract_vals)
+        :return: Booleano
+        """
+        self.ensure_one()
+        return self.state == EXTRACTION_DONE and self.layout_tier == TIER_FAST and not self._is_resolved({
+            'pedido_po': self.pedido_po,
+            'po_number': self.po_number,
+            'invoice_data': self.invoice_data,
+        })
+
+    @api.model
+    def _reevaluate_outdated(self, limit=REEVALUATION_BATCH_SIZE):
+        """
+        Reevaluar los resultados generados con una versión de reglas anterior
+        :param limit: Cantidad máxima de resultados a reevaluar (None, sin límite)
+        :return: Registros cuyo número de PO cambió
+        """
+        outdated = self.search([
+            ('rule_version', '!=', RULESET_VERSION),
+            ('state', '=', EXTRACTION_DONE),
+        ], limit=limit)
+        return outdated._reevaluate_rules()
+
+    def _get_invoice_data(self, po_number):
+        """
+        Datos de la factura almacenados, con el número de PO usado para la búsqueda
+        :param po_number: Número de PO a registrar en los datos
+        :return: Diccionario con datos de la factura
+        """
+        self.ensure_one()
+        invoice_data = dict(self.invoice_data or {})
+        invoice_data['po_number'] = po_number
+        return invoice_data
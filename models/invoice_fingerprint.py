@@ -0,0 +1,201 @@
+import logging
+from psycopg2.errors import UniqueViolation
+from odoo import models, fields, api
+
+from ..extraction import normalize_cuit, parse_document_number, AFIP_DOCUMENT_CODES
+
+_logger = logging.getLogger(__name__)
+
+# Diferencia máxima de importe (en pesos) para considerar que dos facturas del mismo CUIT son la
+# misma: absorbe el redondeo del IVA y de los totales leídos del PDF
+FINGERPRINT_AMOUNT_TOLERANCE = 0.05
+
+# Facturas de proveedor sincronizadas por tanda al completar la tabla
+FINGERPRINT_SYNC_BATCH = 1000
+
+# Campos de account.move que cambian la huella
+FINGERPRINT_TRIGGER_FIELDS = {
+    'move_type', 'state', 'partner_id', 'line_ids', 'invoice_line_ids', 'amount_total',
+    'l10n_latam_document_type_id', 'l10n_latam_document_number',
+}
+
+
+class InvoiceFingerprint(models.Model):
+    _name = 'bmi.invoice.fingerprint'
+    _description = 'Huella de factura de proveedor'
+    _rec_name = 'move_id'
+
+    move_id = fields.Many2one('account.move', string='Factura', required=True, ondelete='cascade', index=True)
+    cuit = fields.Char(string='CUIT (solo dígitos)', required=True)
+    document_code = fields.Integer(string='Tipo de comprobante (código AFIP)')
+    point_of_sale = fields.Integer(string='Punto de venta')
+    document_number = fields.Integer(string='Número de comprobante')
+    amount_cents = fields.Integer(string='Importe total (centavos)', required=True)
+
+    _sql_constraints = [
+        ('move_uniq', 'unique(move_id)', 'Ya existe una huella para esta factura.'),
+    ]
+
+    def init(self):
+        # Un comprobante (CUIT, tipo, punto de venta y número) identifica una única factura; el
+        # segundo índice resuelve la búsqueda por CUIT e importe con tolerancia como un rango
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS bmi_invoice_fingerprint_document_uniq
+                ON bmi_invoice_fingerprint (cuit, document_code, point_of_sale, document_number)
+             WHERE document_number IS NOT NULL
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS bmi_invoice_fingerprint_cuit_amount_idx
+                ON bmi_invoice_fingerprint (cuit, amount_cents)
+        """)
+
+    @api.model
+    def _prepare_key(self, cuit, document_type, invoice_number, amount):
+        """
+        Normalizar los datos de una factura a la forma almacenada en la huella
+        :param cuit: CUIT en cualquier formato
+        :param document_type: Código AFIP del tipo de comprobante, o nombre ('FACTURA A', ...)
+        :param invoice_number: Número de comprobante PPPPP-NNNNNNNN
+        :param amount: Importe total
+        :return: Diccionario con cuit, document_code, point_of_sale, document_number y amount_cents
+        """
+        if isinstance(document_type, str) and not document_type.isdigit():
+            document_code = AFIP_DOCUMENT_CODES.get(document_type.strip().upper())
+        else:
+            document_code = int(document_type) if document_type else None
+        point_of_sale, document_number = parse_document_number(invoice_number)
+        return {
+            'cuit': normalize_cuit(cuit),
+            'document_code': document_code,
+            'point_of_sale': point_of_sale,
+            'document_number': document_number,
+            'amount_cents': round(float(amount or 0.0) * 100),
+        }
+
+    @api.model
+    def _find_duplicate(self, cuit, document_type, invoice_number, amount, exclude_move_ids=()):
+        """
+        Buscar una factura existente con el mismo comprobante (CUIT, tipo, punto de venta y número),
+        en una sola consulta por índice. Un tipo desconocido en cualquiera de las dos (por ejemplo,
+        un texto sin la leyenda "FACTURA A/B/C") coincide con cualquier tipo. Solo si alguna de las dos facturas no tiene número de
+        comprobante se compara por CUIT e importe (con tolerancia de FINGERPRINT_AMOUNT_TOLERANCE):
+        dos comprobantes con números distintos nunca son duplicados, aunque tengan el mismo importe
+        (por ejemplo, un abono mensual)
+        :param cuit: CUIT en cualquier formato
+        :param document_type: Código AFIP o nombre del tipo de comprobante
+        :param invoice_number: Número de comprobante PPPPP-NNNNNNNN
+        :param amount: Importe total
+        :param exclude_move_ids: Facturas a ignorar
+        :return: Tupla (registro account.move o vacío, Booleano indicando si coincide el comprobante)
+        """
+        key = self._prepare_key(cuit, document_type, invoice_number, amount)
+        if not key['cuit']:
+            return self.env['account.move'], False
+
+        tolerance = round(FINGERPRINT_AMOUNT_TOLERANCE * 100)
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT move_id,
+                   COALESCE((document_code = %(document_code)s OR document_code IS NULL
+                             OR %(document_code)s IS NULL)
+                            AND point_of_sale = %(point_of_sale)s
+                            AND document_number = %(document_number)s, FALSE) AS same_document
+              FROM bmi_invoice_fingerprint
+             WHERE cuit = %(cuit)s
+               AND NOT (move_id = ANY(%(exclude)s))
+               AND ((document_number = %(document_number)s
+                     AND point_of_sale = %(point_of_sale)s
+                     AND (document_code = %(document_code)s OR document_code IS NULL
+                          OR %(document_code)s IS NULL))
+                    OR (amount_cents BETWEEN %(amount_min)s AND %(amount_max)s
+                        AND (document_number IS NULL OR %(document_number)s IS NULL)))
+          ORDER BY same_document DESC, abs(amount_cents - %(amount_cents)s), move_id
+             LIMIT 1
+        """, dict(
+            key,
+            exclude=list(exclude_move_ids),
+            amount_min=key['amount_cents'] - tolerance,
+            amount_max=key['amount_cents'] + tolerance,
+        ))
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.env['account.move'], False
+        return self.env['account.move'].browse(row[0]), row[1]
+
+    @api.model
+    def _prepare_move_key(self, move):
+        """
+        Huella de una factura de proveedor
+        :param move: registro account.move
+        :return: Diccionario de valores, o None si la factura no debe tener huella
+        """
+        if move.move_type != 'in_invoice' or move.state == 'cancel':
+            return None
+        cuit = move.commercial_partner_id.x_cuit_key
+        if not cuit:
+            return None
+        document_type = invoice_number = None
+        if 'l10n_latam_document_type_id' in move._fields:
+            document_type = move.l10n_latam_document_type_id.code
+            invoice_number = move.l10n_latam_document_number
+        return self._prepare_key(cuit, document_type, invoice_number, move.amount_total)
+
+    @api.model
+    def _sync_moves(self, moves):
+        """
+        Actualizar las huellas de las facturas indicadas: se crean o actualizan las de facturas de
+        proveedor vigentes y se eliminan las de facturas canceladas o que dejaron de serlo.
+        Si otra factura ya tiene el mismo comprobante, la factura queda sin número en la huella
+        (se sigue detectando por CUIT e importe) y no se bloquea su registro.
+        :param moves: registros account.move
+        """
+        stale_ids = []
+        for move in moves.exists():
+            key = self._prepare_move_key(move)
+            if key is None:
+                stale_ids.append(move.id)
+                continue
+            try:
+                with self.env.cr.savepoint(flush=False):
+                    self._upsert(move.id, key)
+            except UniqueViolation:
+                _logger.warning(f"La factura {move.name} ({move.id}) tiene el mismo comprobante que otra "
+                                f"factura del CUIT {key['cuit']}; se registra su huella sin número")
+                self._upsert(move.id, dict(key, point_of_sale=None, document_number=None))
+
+        if stale_ids:
+            self.env.cr.execute("DELETE FROM bmi_invoice_fingerprint WHERE move_id IN %s", [tuple(stale_ids)])
+        self.invalidate_model()
+
+    @api.model
+    def _upsert(self, move_id, key):
+        self.env.cr.execute("""
+            INSERT INTO bmi_invoice_fingerprint
+                   (move_id, cuit, document_code, point_of_sale, document_number, amount_cents,
+                    create_uid, create_date, write_uid, write_date)
+            VALUES (%(move_id)s, %(cuit)s, %(document_code)s, %(point_of_sale)s, %(document_number)s,
+                    %(amount_cents)s, %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC')
+            ON CONFLICT (move_id) DO UPDATE
+               SET cuit = EXCLUDED.cuit,
+                   document_code = EXCLUDED.document_code,
+                   point_of_sale = EXCLUDED.point_of_sale,
+                   document_number = EXCLUDED.document_number,
+                   amount_cents = EXCLUDED.amount_cents,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+        """, dict(key, move_id=move_id, uid=self.env.uid))
+
+    @api.model
+    def _sync_all(self):
+        """
+        Completar las huellas de todas las facturas de proveedor (al instalar o actualizar el módulo)
+        """
+        move_ids = self.env['account.move'].search([
+            ('move_type', '=', 'in_invoice'),
+            ('state', '!=', 'cancel'),
+        ], order='id').ids
+        for index in range(0, len(move_ids), FINGERPRINT_SYNC_BATCH):
+            moves = self.env['account.move'].browse(move_ids[index:index + FINGERPRINT_SYNC_BATCH])
+            self._sync_moves(moves)
+            moves.invalidate_recordset()
+        _logger.info(f"Huellas de facturas sincronizadas: {len(move_ids)} facturas de proveedor")
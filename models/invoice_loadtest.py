@@ -0,0 +1,402 @@
+import time
+import random
+import logging
+from collections import Counter, defaultdict
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+
+from .invoice_parser import (
+    OUTCOME_SIN_PDF, OUTCOME_SIN_PO, OUTCOME_PO_INEXISTENTE, OUTCOME_VINCULADA, OUTCOME_DUPLICADA,
+    CLAIM_BATCH_SIZE, CLAIM_LEASE_MINUTES, QUERY_BUDGETS,
+)
+from .parser_run import ParserRun
+
+_logger = logging.getLogger(__name__)
+
+# Prefijo de los registros creados por la prueba de carga (proveedores, productos, OCs, tickets)
+LOADTEST_PREFIX = 'LOADTEST'
+
+# Proporción de tickets de cada resultado esperado
+LOADTEST_MIX = {
+    OUTCOME_VINCULADA: 0.6,
+    OUTCOME_SIN_PO: 0.1,
+    OUTCOME_PO_INEXISTENTE: 0.1,
+    OUTCOME_DUPLICADA: 0.1,
+    OUTCOME_SIN_PDF: 0.1,
+}
+
+# Proveedores y facturas de proveedor existentes (ajenas a los tickets) por defecto
+LOADTEST_SUPPLIERS = 50
+LOADTEST_EXISTING_BILLS = 1000
+
+# Rango de los números de OC de la prueba: 8 dígitos, para que la búsqueda por números
+# (ilike) no encuentre otra OC que contenga el mismo número
+LOADTEST_PO_RANGE = (90000000, 99999999)
+
+# Pesos del dígito verificador del CUIT
+CUIT_WEIGHTS = (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+
+
+class InvoiceLoadTest(models.AbstractModel):
+    _name = 'bmi.invoice.loadtest'
+    _description = 'Prueba de carga del procesamiento de facturas'
+
+    @api.model
+    def _seed(self, count, suppliers=LOADTEST_SUPPLIERS, existing_bills=LOADTEST_EXISTING_BILLS, seed=0):
+        """
+        Crear los datos de la prueba: proveedores con CUIT, OCs, facturas de proveedor existentes y
+        tickets en 'Facturas Nuevas' con un PDF de factura adjunto, repartidos según LOADTEST_MIX.
+        Los datos se confirman: el procesamiento reserva los tickets y confirma cada uno.
+        :param count: Cantidad de tickets
+        :param suppliers: Cantidad de proveedores
+        :param existing_bills: Facturas de proveedor existentes ajenas a los tickets
+        :param seed: Semilla del generador aleatorio
+        :return: Diccionario con la etiqueta de la prueba, los IDs creados y el resultado esperado por ticket
+        """
+        rng = random.Random(seed)
+        ticket_model = self.env['helpdesk.ticket']
+        domain = ticket_model._get_facturas_nuevas_domain()
+        if domain is None:
+            raise UserError("No existe la etapa 'Facturas Nuevas'")
+        # Los tickets se crean con los valores del dominio del cron (etapa y, si existe, equipo)
+        ticket_vals = {field: value for field, _operator, value in domain}
+        tag = f"{LOADTEST_PREFIX}-{fields.Datetime.now():%Y%m%d%H%M%S}"
+        start = time.perf_counter()
+
+        partners = self._seed_partners(tag, suppliers, rng)
+        product = self.env['product.product'].create({
+            'name': f"{tag} Servicio",
+            'type': 'service',
+            'purchase_ok': True,
+        })
+        self._ensure_analytic_account(tag)
+
+        outcomes = rng.choices(list(LOADTEST_MIX), weights=list(LOADTEST_MIX.values()), k=count)
+        po_numbers = self._free_po_numbers(count, rng)
+        documents, order_vals, bill_vals = [], [], []
+        for index, outcome in enumerate(outcomes):
+            partner, cuit = partners[index % len(partners)]
+            total = 1000 + index
+            document = {
+                'outcome': outcome,
+                'partner': partner,
+                'cuit': cuit,
+                'po_name': f"P{po_numbers[index]}",
+                'number': f"00001-{index + 1:08d}",
+                'total': total,
+                'iva': round(total * 21 / 121, 2),
+            }
+            documents.append(document)
+            if outcome in (OUTCOME_VINCULADA, OUTCOME_DUPLICADA):
+                order_vals.append({
+                    'name': document['po_name'],
+                    'partner_id': partner.id,
+                    'order_line': [(0, 0, {
+                        'product_id': product.id,
+                        'name': product.name,
+                        'product_qty': 1,
+                        'price_unit': total - document['iva'],
+                    })],
+                })
+            if outcome == OUTCOME_DUPLICADA:
+                bill_vals.append(self._prepare_bill_vals(partner, product, document['po_name'], total))
+
+        for index in range(existing_bills):
+            partner, _cuit = partners[rng.randrange(len(partners))]
+            # Montos fuera del rango de los tickets para no generar duplicados por CUIT y monto
+            bill_vals.append(self._prepare_bill_vals(partner, product, f"{tag}-{index}", 500000 + index))
+
+        orders = self.env['purchase.order'].create(order_vals)
+        bills = self.env['account.move'].create(bill_vals)
+
+        tickets = ticket_model.with_context(mail_create_nosubscribe=True).create([
+            dict(ticket_vals, name=f"{tag} Factura {document['number']}") for document in documents
+        ])
+        self.env['ir.attachment'].create([
+            {
+                'name': f"Factura {document['number']}.pdf",
+                'res_model': 'helpdesk.ticket',
+                'res_id': ticket.id,
+                'mimetype': 'application/pdf',
+                'raw': self._build_invoice_pdf(self._invoice_lines(document)),
+            }
+            for ticket, document in zip(tickets, documents) if document['outcome'] != OUTCOME_SIN_PDF
+        ])
+        self.env.cr.commit()
+
+        seed_seconds = time.perf_counter() - start
+        _logger.info(f"Prueba de carga {tag}: {count} tickets, {len(orders)} OCs y {len(bills)} facturas "
+                     f"existentes creados en {seed_seconds:.1f}s")
+        return {
+            'tag': tag,
+            'seed_seconds': round(seed_seconds, 3),
+            'ticket_ids': tickets.ids,
+            'expected': {ticket.id: document['outcome'] for ticket, document in zip(tickets, documents)},
+            'partner_ids': [partner.id for partner, _cuit in partners],
+            'product_id': product.id,
+            'order_ids': orders.ids,
+        }
+
+    @api.model
+    def _seed_partners(self, tag, count, rng):
+        """
+        :return: Lista de tuplas (registro res.partner, CUIT con guiones)
+        """
+        country = self.env.ref('base.ar', raise_if_not_found=False)
+        cuit_type = self.env.ref('l10n_ar.it_cuit', raise_if_not_found=False)
+        cuits = []
+        while len(cuits) < count:
+            cuit = self._make_cuit(rng.randrange(10000000, 99999999))
+            if cuit and cuit not in cuits:
+                cuits.append(cuit)
+        vals_list = []
+        for index, cuit in enumerate(cuits):
+            vals = {
+                'name': f"{tag} Proveedor {index + 1}",
+                'is_company': True,
+                'supplier_rank': 1,
+                'vat': cuit.replace('-', ''),
+            }
+            if country:
+                vals['country_id'] = country.id
+            if cuit_type:
+                vals['l10n_latam_identification_type_id'] = cuit_type.id
+            vals_list.append(vals)
+        return list(zip(self.env['res.partner'].create(vals_list), cuits))
+
+    @api.model
+    def _make_cuit(self, number):
+        """
+        :param number: Número de 8 dígitos
+        :return: CUIT de persona jurídica (30-XXXXXXXX-D) con dígito verificador válido, o None si
+                 el número no admite uno
+        """
+        digits = f"30{number:08d}"
+        check = 11 - sum(int(digit) * weight for digit, weight in zip(digits, CUIT_WEIGHTS)) % 11
+        if check == 10:
+            return None
+        return f"{digits[:2]}-{digits[2:]}-{0 if check == 11 else check}"
+
+    @api.model
+    def _free_po_numbers(self, count, rng):
+        """
+        Números de OC del rango de la prueba que no existen en la base de datos
+        :return: Lista de números
+        """
+        numbers = set()
+        while len(numbers) < count:
+            candidates = {rng.randint(*LOADTEST_PO_RANGE) for _index in range(count - len(numbers))} - numbers
+            self.env.cr.execute("SELECT name FROM purchase_order WHERE name IN %s",
+                                [tuple(f"P{number}" for number in candidates)])
+            existing = {row[0] for row in self.env.cr.fetchall()}
+            numbers.update(number for number in candidates if f"P{number}" not in existing)
+        return sorted(numbers)[:count]
+
+    @api.model
+    def _ensure_analytic_account(self, tag):
+        """
+        La factura en borrador requiere una cuenta analítica: se crea una si no hay ninguna
+        """
+        if self.env['account.analytic.account'].search_count([], limit=1):
+            return
+        plan = self.env['account.analytic.plan'].create({'name': tag})
+        self.env['account.analytic.account'].create({'name': tag, 'plan_id': plan.id})
+
+    @api.model
+    def _prepare_bill_vals(self, partner, product, ref, total):
+        return {
+            'move_type': 'in_invoice',
+            'partner_id': partner.id,
+            'ref': ref,
+            'invoice_date': fields.Date.today(),
+            'invoice_line_ids': [(0, 0, {
+                'product_id': product.id,
+                'name': product.name,
+                'quantity': 1,
+                'price_unit': total,
+            })],
+        }
+
+    @api.model
+    def _invoice_lines(self, document):
+        """
+        Texto de la factura de un ticket según el resultado esperado. Los PDFs sin PO no contienen
+        ninguna palabra clave de las reglas de PO (orden, compra, pedido, referencia, OC).
+        :param document: Datos del documento generados en _seed
+        :return: Lista de líneas
+        """
+        lines = [
+            f"FACTURA A {document['number']}",
+            document['partner'].name,
+            f"CUIT: {document['cuit']}",
+            f"Fecha: {fields.Date.today():%d/%m/%Y}",
+        ]
+        if document['outcome'] != OUTCOME_SIN_PO:
+            lines.append(f"Orden de compra: {document['po_name']}")
+        lines += [
+            'Servicios profesionales',
+            f"IVA: $ {document['iva']:.2f}".replace('.', ','),
+            f"Total: $ {document['total']:.2f}".replace('.', ','),
+        ]
+        return lines
+
+    @api.model
+    def _build_invoice_pdf(self, lines):
+        """
+        PDF mínimo de una página con capa de texto (Helvetica), una línea por renglón
+        :param lines: Lista de líneas de texto (ASCII o Latin-1)
+        :return: Contenido del PDF
+        """
+        text = ' '.join(
+            # Cada renglón termina en espacio: sin análisis de layout los renglones quedan en una línea
+            '({}) Tj 0 -16 Td'.format((line + ' ').replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)'))
+            for line in lines
+        )
+        stream = f"BT /F1 11 Tf 50 780 Td {text} ET".encode('latin-1', 'replace')
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+            b"/Resources << /Font << /F1 5 0 R >> >> >>",
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        ]
+        pdf = b"%PDF-1.4\n"
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(pdf))
+            pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+        xref = len(pdf)
+        pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        pdf += b''.join(b"%010d 00000 n \n" % offset for offset in offsets)
+        pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+        return pdf
+
+    @api.model
+    def _run(self, ticket_ids, expected=None, batch_size=CLAIM_BATCH_SIZE):
+        """
+        Procesar los tickets con el mismo circuito que el cron (reserva en tandas, extracción fuera
+        de la transacción, una transacción por ticket y las escrituras agrupadas de la tanda)
+        midiendo tiempo y consultas SQL por fase
+        :param ticket_ids: IDs de los tickets
+        :param expected: Diccionario {ID de ticket: resultado esperado}
+        :param batch_size: Tickets por reserva
+        :return: Diccionario con el reporte (ver _build_report)
+        """
+        ticket_model = self.env['helpdesk.ticket']
+        cr = self.env.cr
+        stages = ticket_model._get_parser_stages()
+        partners_by_cuit = {}
+        phases = defaultdict(lambda: {'seconds': 0.0, 'queries': 0})
+        timings = {}
+        per_outcome = defaultdict(lambda: {'seconds': [], 'queries': []})
+        outcomes = {}
+
+        def measure(phase, function, *args, **kwargs):
+            queries, start = cr.sql_log_count, time.perf_counter()
+            result = function(*args, **kwargs)
+            phases[phase]['seconds'] += time.perf_counter() - start
+            phases[phase]['queries'] += cr.sql_log_count - queries
+            return result, time.perf_counter() - start, cr.sql_log_count - queries
+
+        wall_start = time.perf_counter()
+        for index in range(0, len(ticket_ids), batch_size):
+            batch_ids = ticket_ids[index:index + batch_size]
+            (tickets, token), _seconds, _queries = measure(
+                'reserva', ticket_model._claim_tickets, [('id', 'in', batch_ids)], len(batch_ids),
+                CLAIM_LEASE_MINUTES,
+            )
+            documents = {}
+            if tickets:
+                documents, _seconds, _queries = measure('extraccion', ticket_model._extract_claimed_documents,
+                                                        tickets)
+            pending = ParserRun()
+            for ticket in tickets:
+                outcome, seconds, queries = measure(
+                    'procesamiento', ticket_model._procesar_ticket_reservado, ticket, stages, token,
+                    partners_by_cuit, documents, timings, pending,
+                )
+                outcomes[ticket.id] = outcome
+                per_outcome[outcome]['seconds'].append(seconds)
+                per_outcome[outcome]['queries'].append(queries)
+            # Escrituras agrupadas de la tanda (ver _apply_pending_changes)
+            measure('escritura', ticket_model._apply_pending_changes, pending)
+        wall_seconds = time.perf_counter() - wall_start
+
+        return self._build_report(ticket_ids, outcomes, expected or {}, phases, timings, per_outcome,
+                                  wall_seconds)
+
+    @api.model
+    def _build_report(self, ticket_ids, outcomes, expected, phases, timings, per_outcome, wall_seconds):
+        """
+        :return: Diccionario con rendimiento, tiempo y consultas por fase, latencia por etapa,
+                 consultas por ticket según el resultado, resultados que superaron su máximo de
+                 consultas (QUERY_BUDGETS) y tickets con un resultado distinto del esperado
+        """
+        summarize = self.env['bmi.invoice.replay']._summarize_timings
+        processed = len(outcomes)
+        queries = sum(phase['queries'] for phase in phases.values())
+        mismatches = Counter(
+            f"{expected[ticket_id]} -> {outcome}" for ticket_id, outcome in outcomes.items()
+            if ticket_id in expected and expected[ticket_id] != outcome
+        )
+        return {
+            'tickets': len(ticket_ids),
+            'processed': processed,
+            'wall_seconds': round(wall_seconds, 3),
+            'tickets_per_minute': round(processed * 60 / wall_seconds, 1) if wall_seconds else 0.0,
+            'queries': queries,
+            'queries_per_ticket': round(queries / processed, 1) if processed else 0.0,
+            'phases': {
+                name: {
+                    'seconds': round(phase['seconds'], 3),
+                    'queries': phase['queries'],
+                    'queries_per_ticket': round(phase['queries'] / processed, 1) if processed else 0.0,
+                }
+                for name, phase in phases.items()
+            },
+            'latency': {stage: summarize(values) for stage, values in timings.items()},
+            'outcomes': {
+                outcome: dict(summarize(values['seconds']),
+                              queries_per_ticket=round(sum(values['queries']) / len(values['queries']), 1),
+                              max_queries=max(values['queries']),
+                              query_budget=QUERY_BUDGETS.get(outcome))
+                for outcome, values in per_outcome.items()
+            },
+            'query_budget_exceeded': {
+                outcome: max(values['queries']) for outcome, values in per_outcome.items()
+                if outcome in QUERY_BUDGETS and max(values['queries']) > QUERY_BUDGETS[outcome]
+            },
+            'mismatches': dict(mismatches),
+        }
+
+    @api.model
+    def _cleanup(self, seeded):
+        """
+        Eliminar los datos creados por _seed y por el procesamiento (facturas, adjuntos copiados)
+        :param seeded: Diccionario devuelto por _seed
+        """
+        moves = self.env['account.move'].search([('partner_id', 'in', seeded['partner_ids'])])
+        tickets = self.env['helpdesk.ticket'].browse(seeded['ticket_ids']).exists()
+        self.env['ir.attachment'].search([
+            '|',
+            '&', ('res_model', '=', 'helpdesk.ticket'), ('res_id', 'in', tickets.ids),
+            '&', ('res_model', '=', 'account.move'), ('res_id', 'in', moves.ids),
+        ]).unlink()
+        moves.filtered(lambda move: move.state != 'draft').button_draft()
+        moves.with_context(force_delete=True).unlink()
+        tickets.unlink()
+        orders = self.env['purchase.order'].browse(seeded['order_ids']).exists()
+        orders.button_cancel()
+        orders.unlink()
+        self.env['product.product'].browse(seeded['product_id']).exists().unlink()
+        partners = self.env['res.partner'].browse(seeded['partner_ids']).exists()
+        try:
+            with self.env.cr.savepoint():
+                partners.unlink()
+        except Exception as e:
+            # Referenciados por otros registros (p. ej. mensajes): se archivan
+            _logger.info(f"Proveedores de la prueba archivados en lugar de eliminados: {e}")
+            partners.write({'active': False})
+        self.env.cr.commit()
+        _logger.info(f"Prueba de carga {seeded['tag']}: datos eliminados")
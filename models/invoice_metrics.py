@@ -0,0 +1,147 @@
+import logging
+from odoo import models, fields, api
+
+from .invoice_parser import (
+    OUTCOME_SIN_PDF, OUTCOME_SIN_PO, OUTCOME_PO_INEXISTENTE, OUTCOME_VINCULADA, OUTCOME_DUPLICADA,
+    OUTCOME_CUARENTENA, EXTRACTION_DONE,
+)
+
+_logger = logging.getLogger(__name__)
+
+# Límites (en segundos) de los buckets del histograma de latencia de extracción
+EXTRACTION_SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Métodos de extracción que usan OCR en al menos una página
+OCR_METHODS = ('ocr', 'mixed')
+
+# Resultados expuestos como conteo de tickets por etapa
+STAGE_OUTCOMES = (
+    OUTCOME_SIN_PDF, OUTCOME_SIN_PO, OUTCOME_PO_INEXISTENTE, OUTCOME_VINCULADA, OUTCOME_DUPLICADA,
+    OUTCOME_CUARENTENA,
+)
+
+
+class InvoiceMetrics(models.AbstractModel):
+    _name = 'bmi.invoice.metrics'
+    _description = 'Métricas del procesamiento de facturas'
+
+    @api.model
+    def _render(self):
+        """
+        Métricas del procesamiento en el formato de texto de Prometheus. Se calculan sobre la base
+        de datos, por lo que reflejan todos los workers y servidores, y son todas gauges: los
+        resultados de extracción se reemplazan al volver a extraer y se eliminan con sus tickets,
+        por lo que sus conteos pueden bajar. Solo leen la base de datos.
+        :return: Texto en formato de exposición de Prometheus
+        """
+        lines = []
+        self._render_documents(lines)
+        self._render_extraction_latency(lines)
+        self._render_stages(lines)
+        self._render_queue(lines)
+        return '\n'.join(lines) + '\n'
+
+    @api.model
+    def _render_documents(self, lines):
+        self.env['bmi.invoice.extraction.result'].flush_model()
+        self.env.cr.execute("""
+            SELECT COALESCE(extraction_method, ''), state, count(*)
+              FROM bmi_invoice_extraction_result
+          GROUP BY 1, 2
+          ORDER BY 1, 2
+        """)
+        rows = self.env.cr.fetchall()
+        self._add_metric(lines, 'bmi_invoice_documents', 'gauge',
+                         'Resultados de extracción almacenados por método de extracción y estado',
+                         [({'method': method or 'none', 'state': state}, count) for method, state, count in rows])
+        self._add_metric(lines, 'bmi_invoice_ocr_documents', 'gauge',
+                         'Resultados de extracción almacenados con OCR en al menos una página',
+                         [({'method': method}, count) for method, state, count in rows
+                          if method in OCR_METHODS and state == EXTRACTION_DONE])
+
+    @api.model
+    def _render_extraction_latency(self, lines):
+        buckets = ', '.join(
+            f"count(*) FILTER (WHERE extraction_seconds <= {bound})" for bound in EXTRACTION_SECONDS_BUCKETS
+        )
+        self.env.cr.execute(f"""
+            SELECT extraction_method, {buckets}, count(*), COALESCE(sum(extraction_seconds), 0)
+              FROM bmi_invoice_extraction_result
+             WHERE state = %s AND extraction_method IS NOT NULL AND extraction_seconds IS NOT NULL
+          GROUP BY extraction_method
+          ORDER BY extraction_method
+        """, [EXTRACTION_DONE])
+        # Distribución de la duración de la última extracción almacenada de cada adjunto, no de cada
+        # extracción realizada: por eso se expone como gauges y no como histograma
+        rows = self.env.cr.fetchall()
+        buckets, sums = [], []
+        for row in rows:
+            method, counts, total, seconds = row[0], row[1:-2], row[-2], row[-1]
+            for bound, count in zip(EXTRACTION_SECONDS_BUCKETS, counts):
+                buckets.append(({'method': method, 'le': bound}, count))
+            buckets.append(({'method': method, 'le': '+Inf'}, total))
+            sums.append(({'method': method}, seconds))
+        self._add_metric(lines, 'bmi_invoice_stored_extractions_by_seconds', 'gauge',
+                         'Resultados de extracción almacenados cuya extracción duró como máximo le segundos',
+                         buckets)
+        self._add_metric(lines, 'bmi_invoice_stored_extraction_seconds_sum', 'gauge',
+                         'Suma de la duración de las extracciones almacenadas por método', sums)
+
+    @api.model
+    def _render_stages(self, lines):
+        # _find_parser_stages no crea etapas: las métricas solo leen
+        stages = self.env['helpdesk.ticket']._find_parser_stages()
+        stage_ids = [stages[outcome].id for outcome in STAGE_OUTCOMES if stages.get(outcome)]
+        groups = self.env['helpdesk.ticket'].read_group(
+            [('stage_id', 'in', stage_ids)], ['stage_id'], ['stage_id'],
+        )
+        count_by_stage = {group['stage_id'][0]: group['stage_id_count'] for group in groups}
+        self._add_metric(lines, 'bmi_invoice_tickets', 'gauge',
+                         'Tickets en cada etapa de resultado del procesamiento', [
+                             ({'outcome': outcome, 'stage': stages[outcome].name},
+                              count_by_stage.get(stages[outcome].id, 0))
+                             for outcome in STAGE_OUTCOMES if stages.get(outcome)
+                         ])
+
+    @api.model
+    def _render_queue(self, lines):
+        ticket_model = self.env['helpdesk.ticket']
+        domain = ticket_model._get_facturas_nuevas_domain()
+        depth, oldest_age, leased = 0, 0.0, 0
+        if domain is not None:
+            now = fields.Datetime.now()
+            depth = ticket_model.search_count(domain)
+            oldest = ticket_model.search(domain, order='create_date, id', limit=1)
+            oldest_age = (now - oldest.create_date).total_seconds() if oldest else 0.0
+            leased = ticket_model.search_count(domain + [('x_parser_lease_until', '>', now)])
+        self._add_metric(lines, 'bmi_invoice_queue_depth', 'gauge', "Tickets en 'Facturas Nuevas'",
+                         [({}, depth)])
+        self._add_metric(lines, 'bmi_invoice_queue_oldest_age_seconds', 'gauge',
+                         "Antigüedad del ticket más viejo en 'Facturas Nuevas'", [({}, round(oldest_age, 1))])
+        self._add_metric(lines, 'bmi_invoice_queue_leased', 'gauge',
+                         "Tickets de 'Facturas Nuevas' reservados por un worker", [({}, leased)])
+
+    @api.model
+    def _add_metric(self, lines, name, metric_type, help_text, samples):
+        """
+        Agregar una métrica con sus muestras
+        :param lines: Lista de líneas de salida
+        :param name: Nombre de la métrica
+        :param metric_type: Tipo de Prometheus (counter, gauge)
+        :param help_text: Descripción
+        :param samples: Lista de tuplas (diccionario de etiquetas, valor)
+        """
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{self._labels(labels)} {value}")
+
+    @api.model
+    def _labels(self, labels):
+        if not labels:
+            return ''
+        escaped = (
+            f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for key, value in labels.items()
+        )
+        return '{' + ','.join(escaped) + '}'
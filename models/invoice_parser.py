@@ -1,201 +1,880 @@
 import base64
 import re
+import time
+import uuid
 import logging
-from io import BytesIO
-from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
-from pdfminer.converter import TextConverter
-from pdfminer.layout import LAParams
-from pdfminer.pdfpage import PDFPage
-from io import StringIO
+from collections import defaultdict
+from datetime import timedelta
 from odoo import models, fields, api
 from odoo.exceptions import UserError
-from io import StringIO
+
+from ..extraction import (
+    extract_pdf_text_with_method, extract_pdf_text_with_probe, extract_afip_qr, afip_qr_invoice_data,
+    normalize_cuit, rank_pdf_candidates, bound_rule_text, RuleBudget, COST_BASE_SECONDS, DEFAULT_TEXT_ENGINE,
+    PEDIDO_PATTERN, PO_PRIMARY_PATTERNS, PO_SECONDARY_PATTERNS, PO_GENERIC_PATTERN, CUIT_PATTERN,
+    INVOICE_NUMBER_PATTERN, DATE_PATTERNS, TOTAL_PATTERN, IVA_PATTERN,
+)
+from .parser_run import ParserRun, PARSER_RUN_CONTEXT_KEY
 
 _logger = logging.getLogger(__name__)
 
-try:
-    from pdf2image import convert_from_bytes
-    import pytesseract
-    OCR_AVAILABLE = True
-except ImportError:
-    OCR_AVAILABLE = False
+# Versión del conjunto de reglas de extracción (patrones de PO, CUIT, montos, tipo de documento).
+# Incrementar cada vez que cambie extract_po_number, extract_invoice_data o extraction/rule_patterns.py: los
+# resultados almacenados con otra versión se reevalúan sobre el texto guardado, sin volver a parsear el PDF.
+# Versión 3: separación de PDFs con varias facturas (segment_invoice_pages).
+# Versión 4: texto acotado en tamaño y largo de línea, y tiempo máximo por documento (bound_rule_text).
+# Versión 5: importes del QR de AFIP en moneda extranjera convertidos a pesos con la cotización.
+# Versión 6: PDFs con varias facturas separados sobre el texto completo, con un tiempo máximo por documento.
+RULESET_VERSION = '6'
+
+# Estados del resultado de extracción de un adjunto
+EXTRACTION_DONE = 'done'
+EXTRACTION_FAILED = 'failed'
+EXTRACTION_QUARANTINED = 'quarantined'
+
+# Resultados posibles del procesamiento de un ticket
+OUTCOME_SIN_PDF = 'sin_pdf'
+OUTCOME_SIN_PO = 'sin_po'
+OUTCOME_PO_INEXISTENTE = 'po_inexistente'
+OUTCOME_VINCULADA = 'vinculada'
+OUTCOME_DUPLICADA = 'duplicada'
+OUTCOME_CUARENTENA = 'cuarentena'
+OUTCOME_REINTENTO = 'reintento'
+OUTCOME_OMITIDO = 'omitido'
+OUTCOME_ERROR = 'error'
+
+# Etapa de cada resultado: (XML ID, nombre y secuencia con la que se crea si no existe; None si no se crea)
+PARSER_STAGES = {
+    OUTCOME_SIN_PDF: ('bmi_invoice_parser.stage_tickets_sin_pdf', 'Tickets sin PDF', 2),
+    OUTCOME_SIN_PO: ('bmi_invoice_parser.stage_pdf_sin_po', 'PDF sin PO#', 3),
+    OUTCOME_PO_INEXISTENTE: ('bmi_invoice_parser.stage_po_inexistente', 'PO# Inexistente', 4),
+    OUTCOME_VINCULADA: ('bmi_invoice_parser.stage_fact_vinculada', 'Facturas Vinculadas', 5),
+    OUTCOME_DUPLICADA: (None, 'Facturas Duplicadas', None),
+    OUTCOME_CUARENTENA: ('bmi_invoice_parser.stage_pdf_cuarentena', 'PDF en Cuarentena', 7),
+}
+
+OUTCOMES = [
+    (OUTCOME_SIN_PDF, 'Tickets sin PDF'),
+    (OUTCOME_SIN_PO, 'PDF sin PO#'),
+    (OUTCOME_PO_INEXISTENTE, 'PO# Inexistente'),
+    (OUTCOME_VINCULADA, 'Factura Vinculada'),
+    (OUTCOME_DUPLICADA, 'Factura Duplicada'),
+    (OUTCOME_CUARENTENA, 'PDF en Cuarentena'),
+    (OUTCOME_REINTENTO, 'Reintento pendiente'),
+    (OUTCOME_OMITIDO, 'Omitido'),
+    (OUTCOME_ERROR, 'Error'),
+]
+
+# Reserva de tickets entre workers: tickets por reserva, duración de la reserva y tiempo máximo
+# de una ejecución del cron (debe ser menor que la duración de la reserva)
+CLAIM_BATCH_SIZE = 10
+CLAIM_LEASE_MINUTES = 15
+CRON_TIME_BUDGET_SECONDS = 10 * 60
+
+# Campos que vinculan facturas al ticket: la escritura de un ticket que los incluye se confirma en la
+# misma transacción que crea o vincula la factura, nunca se posterga al final de la tanda
+TICKET_INVOICE_FIELDS = {'x_invoice_id', 'x_invoice_ids'}
+
+# Prioridad de la cola: se reservan primero los tickets de menor costo estimado (ver
+# estimate_pdf_cost), descontando el tiempo de espera para que los PDFs grandes no queden
+# postergados indefinidamente: cada minuto de espera descuenta 3 segundos del costo.
+# Los tickets todavía sin estimar se ordenan con un costo intermedio.
+PRIORITY_AGING_FACTOR = 0.05
+PRIORITY_DEFAULT_COST = 5.0
+COST_ESTIMATE_BATCH_SIZE = 50
+
+# Carril rápido: un cron que solo reserva tickets de costo estimado bajo (una factura electrónica
+# de pocas páginas), para que no esperen detrás de PDFs escaneados con OCR
+FAST_LANE_MAX_COST = 2.0
+FAST_LANE_TIME_BUDGET_SECONDS = 2 * 60
+
+# Máximo de consultas SQL de la transacción de un ticket (ver _procesar_ticket_reservado) según
+# el resultado, incluida la liberación de la reserva. Son topes con margen sobre lo medido con
+# bmi_invoice_loadtest: no dependen de la cantidad de tickets, facturas u OCs de la base de datos.
+# Superarlos deja una advertencia en el log y hace fallar tests/test_query_budgets.py y
+# bmi_invoice_loadtest --check-budgets.
+QUERY_BUDGETS = {
+    OUTCOME_SIN_PDF: 40,
+    OUTCOME_SIN_PO: 80,
+    OUTCOME_PO_INEXISTENTE: 100,
+    OUTCOME_DUPLICADA: 120,
+    OUTCOME_VINCULADA: 250,
+    OUTCOME_CUARENTENA: 60,
+    OUTCOME_REINTENTO: 40,
+}
 
 class InvoiceParser(models.Model):
     _inherit = 'helpdesk.ticket'
 
     x_invoice_id = fields.Many2one('account.move', string='Factura')
+    x_invoice_ids = fields.Many2many('account.move', 'bmi_helpdesk_ticket_invoice_rel', 'ticket_id', 'move_id',
+                                     string='Facturas del PDF', copy=False,
+                                     help='Facturas creadas a partir de un PDF que trae varias facturas')
     x_po_number = fields.Char(string='Número OC')
     x_cuit = fields.Char(string='CUIT')
     x_total_amount = fields.Float(string='Monto Total')
     x_iva_amount = fields.Float(string='Monto IVA')
+    x_extraction_result_ids = fields.One2many('bmi.invoice.extraction.result', 'ticket_id',
+                                              string='Resultados de extracción')
+    x_parser_lease_token = fields.Char(string='Reserva de procesamiento', copy=False)
+    x_parser_lease_until = fields.Datetime(string='Reserva vigente hasta', copy=False, index=True)
+    x_parser_cost = fields.Float(string='Costo estimado de procesamiento (s)', copy=False,
+                                 help='Estimado a partir del tamaño, las páginas y la capa de texto de los PDFs '
+                                      'pendientes; 0 si todavía no se estimó')
 
     def procesar_facturas(self):
         """
-        Procesa facturas para tickets con estado 'Facturas nuevas'
-        Este método trabaja en conjuntos de registros y se llama directamente desde el registro
-        :return: Booleano indicando éxito
+        Encolar en segundo plano (ver bmi.invoice.batch) el procesamiento de los tickets
+        seleccionados que están en 'Facturas Nuevas' o, sin registros, de toda la etapa. El lote
+        reserva cada ticket igual que el cron, por lo que un ticket que procesa otro proceso no se
+        procesa dos veces, y la petición no confirma transacciones.
+        :return: Acción de notificación con los tickets encolados y los omitidos
         """
         if not self:
-            # Obtener la etapa 'Facturas Nuevas'
-            facturas_nuevas_stage = self.env.ref('bmi_invoice_parser.stage_facturas_nuevas', raise_if_not_found=False)
-            if not facturas_nuevas_stage:
-                facturas_nuevas_stage = self.env['helpdesk.stage'].search([
-                    ('name', 'ilike', 'Facturas Nuevas')
-                ], limit=1)
+            queued = self.action_enqueue_procesar_facturas()['total']
+            skipped = self.browse()
+        else:
+            facturas_nuevas_stage = self._get_facturas_nuevas_stage()
+            tickets = self.filtered(lambda t: facturas_nuevas_stage and t.stage_id == facturas_nuevas_stage)
+            skipped = self - tickets
+            if tickets:
+                self.env['bmi.invoice.batch']._enqueue(tickets)
+            queued = len(tickets)
+
+        lines = [f"{queued} tickets encolados para procesar en segundo plano."]
+        if skipped:
+            lines.append(f"Se omiten por no estar en 'Facturas Nuevas': {', '.join(skipped.mapped('display_name'))}.")
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Procesar Facturas Nuevas',
+                'message': ' '.join(lines),
+                'sticky': False,
+                'type': 'info' if queued else 'warning',
+            }
+        }
 
-                if not facturas_nuevas_stage:
-                    _logger.error("No se encontró la etapa 'Facturas Nuevas'. No se pueden procesar tickets.")
-                    return False
+    @api.model
+    def _get_facturas_nuevas_domain(self):
+        """
+        Dominio de los tickets pendientes de procesar: etapa 'Facturas Nuevas' y, si está
+        configurado, equipo 'Pago a Proveedores'
+        :return: Dominio de búsqueda, o None si no existe la etapa
+        """
+        # Obtener la etapa 'Facturas Nuevas'
+        facturas_nuevas_stage = self._get_facturas_nuevas_stage()
+        if not facturas_nuevas_stage:
+            _logger.error("No se encontró la etapa 'Facturas Nuevas'. No se pueden procesar tickets.")
+            return None
+
+        # Intentar buscar por equipo si está configurado
+        pago_proveedores_team = self.env['helpdesk.team'].search([
+            '|',
+            ('alias_name', '=', 'proveedores'),
+            ('name', 'ilike', 'Pago a Proveedores')
+        ], limit=1)
+
+        # Construir dominio de búsqueda de tickets
+        domain = [('stage_id', '=', facturas_nuevas_stage.id)]
+        if pago_proveedores_team:
+            domain.append(('team_id', '=', pago_proveedores_team.id))
+        return domain
+
+    @api.model
+    def action_enqueue_procesar_facturas(self):
+        """
+        Encolar en segundo plano el procesamiento de todos los tickets en 'Facturas Nuevas'.
+        Retorna de inmediato; el avance se informa al usuario por el bus.
+        :return: Diccionario con el ID del lote y la cantidad de tickets encolados
+        """
+        domain = self._get_facturas_nuevas_domain()
+        tickets = self.search(domain) if domain is not None else self.browse()
+        if not tickets:
+            return {'batch_id': False, 'total': 0}
 
-            # Intentar buscar por equipo si está configurado
-            pago_proveedores_team = self.env['helpdesk.team'].search([
-                '|',
-                ('alias_name', '=', 'proveedores'),
-                ('name', 'ilike', 'Pago a Proveedores')
+        batch = self.env['bmi.invoice.batch']._enqueue(tickets)
+        return {'batch_id': batch.id, 'total': len(tickets)}
+
+    @api.model
+    def _get_facturas_nuevas_stage(self):
+        """
+        Obtener la etapa 'Facturas Nuevas', primero por XML ID y luego por nombre
+        :return: registro helpdesk.stage (vacío si no existe)
+        """
+        facturas_nuevas_stage = self.env.ref('bmi_invoice_parser.stage_facturas_nuevas', raise_if_not_found=False)
+        if not facturas_nuevas_stage:
+            facturas_nuevas_stage = self.env['helpdesk.stage'].search([
+                ('name', 'ilike', 'Facturas Nuevas')
             ], limit=1)
+        return facturas_nuevas_stage
 
-            # Construir dominio de búsqueda de tickets
-            domain = [('stage_id', '=', facturas_nuevas_stage.id)]
-            if pago_proveedores_team:
-                domain.append(('team_id', '=', pago_proveedores_team.id))
+    @api.model
+    def _get_po_name_variants(self, po_number):
+        """
+        Variantes del nombre de una OC a partir de un número de PO almacenado (P03324, #P03324, PO03324, 03324...)
+        :param po_number: Número de PO
+        :return: Conjunto de variantes en mayúsculas
+        """
+        po_number = (po_number or '').strip().upper()
+        core = re.sub(r'^#?(?:PO|P)?', '', po_number)
+        cores = {core}
+        if core.isdigit():
+            cores.add(core.zfill(5))
+
+        variants = {po_number}
+        for number in cores:
+            variants.update({number, f"P{number}", f"#P{number}", f"PO{number}", f"#PO{number}"})
+        return {v for v in variants if v}
+
+    def action_verificar_po_manualmente(self):
+        """
+        Verificar en bloque los números de PO almacenados contra las órdenes de compra.
+        Todas las variantes de todos los tickets se resuelven en una sola consulta; los tickets
+        con OC encontrada vuelven a 'Facturas Nuevas' y se encolan para procesar en segundo plano.
+        :return: Acción de notificación con el resumen
+        """
+        tickets_with_po = self.filtered('x_po_number')
+        variants_by_ticket = {ticket: self._get_po_name_variants(ticket.x_po_number) for ticket in tickets_with_po}
+        all_variants = set().union(*variants_by_ticket.values()) if variants_by_ticket else set()
+
+        # Una sola consulta para todas las variantes (equivalente a '=ilike' sin comodines)
+        purchase_orders = {}
+        if all_variants:
+            self.env['purchase.order'].flush_model(['name'])
+            self.env.cr.execute(
+                "SELECT id, UPPER(name) FROM purchase_order WHERE UPPER(name) IN %s ORDER BY id",
+                [tuple(all_variants)]
+            )
+            for po_id, po_name in self.env.cr.fetchall():
+                purchase_orders.setdefault(po_name, po_id)
+
+        matched = self.browse()
+        not_found = self.browse()
+        ticket_purchase_orders = {}
+        for ticket, variants in variants_by_ticket.items():
+            po_ids = [purchase_orders[v] for v in variants if v in purchase_orders]
+            if po_ids:
+                matched |= ticket
+                ticket_purchase_orders[ticket] = self.env['purchase.order'].browse(min(po_ids))
+            else:
+                not_found |= ticket
+
+        message_type = 'info'
+        if matched:
+            facturas_nuevas_stage = self._get_facturas_nuevas_stage()
+            if facturas_nuevas_stage:
+                matched.write({'stage_id': facturas_nuevas_stage.id})
+                for ticket, purchase_order in ticket_purchase_orders.items():
+                    ticket.message_post(body=f"""
+<strong>Verificación manual exitosa</strong><br/>
+<p>Se encontró la OC <strong>{purchase_order.name}</strong> en el sistema. Ticket movido a 'Facturas Nuevas' para reprocesar.</p>
+""")
+                self.env['bmi.invoice.batch']._enqueue(matched)
+                message_type = 'success'
+            else:
+                message_type = 'warning'
+
+        lines = [f'{len(self)} tickets verificados.']
+        if matched:
+            if message_type == 'success':
+                lines.append(f'{len(matched)} con OC encontrada, encolados para reprocesar.')
+            else:
+                lines.append(f'{len(matched)} con OC encontrada, pero no se encontró el estado "Facturas Nuevas".')
+        if not_found:
+            lines.append(f'{len(not_found)} sin OC coincidente en el sistema.')
+        if len(self) > len(tickets_with_po):
+            lines.append(f'{len(self) - len(tickets_with_po)} sin número de OC registrado.')
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Verificación de PO#',
+                'message': ' '.join(lines),
+                'sticky': False,
+                'type': message_type,
+            }
+        }
 
-            tickets = self.search(domain)
+    def action_reevaluar_reglas(self):
+        """
+        Reevaluar las reglas de extracción sobre el texto almacenado, sin volver a parsear los PDFs.
+        Sin registros seleccionados se reevalúan los resultados de versiones anteriores, de a
+        REEVALUATION_BATCH_SIZE por llamada. Los tickets en 'PDF sin PO#' en los que ahora se encuentra un número de PO vuelven a
+        'Facturas Nuevas' para ser reprocesados.
+        :return: Acción de notificación con el resumen
+        """
+        results_model = self.env['bmi.invoice.extraction.result']
+        remaining = 0
+        if self:
+            changed = self.x_extraction_result_ids._reevaluate_rules()
         else:
-            tickets = self
+            changed = results_model._reevaluate_outdated()
+            remaining = results_model.search_count([
+                ('rule_version', '!=', RULESET_VERSION),
+                ('state', '=', EXTRACTION_DONE),
+            ])
 
-        return self._procesar_tickets(tickets)
+        # Solo vuelven a la cola los tickets en 'PDF sin PO#' (por XML ID o por nombre): si la etapa
+        # no existe no se devuelve ninguno, para no reprocesar tickets ya vinculados o duplicados
+        sin_po_stage = self._find_parser_stages()[OUTCOME_SIN_PO]
+        facturas_nuevas_stage = self._get_facturas_nuevas_stage()
+        requeued = self.browse()
+        if sin_po_stage:
+            requeued = changed.filtered(lambda r: r.pedido_po or r.po_number).ticket_id.filtered(
+                lambda t: t.stage_id == sin_po_stage
+            )
+        if requeued and facturas_nuevas_stage:
+            requeued.write({'stage_id': facturas_nuevas_stage.id})
+            for ticket in requeued:
+                ticket.message_post(
+                    body="Ticket devuelto a 'Facturas Nuevas' - Las reglas de extracción actualizadas "
+                         "encontraron un número de PO en el texto almacenado del PDF"
+                )
+        else:
+            requeued = self.browse()
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Reevaluación de reglas',
+                'message': f'{len(changed)} resultados con cambios en el número de PO; '
+                           f'{len(requeued)} tickets devueltos a "Facturas Nuevas".'
+                           + (f' Quedan {remaining} resultados por reevaluar.' if remaining else ''),
+                'sticky': False,
+                'type': 'info',
+            }
+        }
 
-    def _procesar_tickets(self, tickets):
+    @api.model
+    def _cron_procesar_facturas(self, batch_size=CLAIM_BATCH_SIZE, lease_minutes=CLAIM_LEASE_MINUTES,
+                                time_budget=CRON_TIME_BUDGET_SECONDS, max_cost=None):
         """
-        Procesa un conjunto de tickets
-        :param tickets: conjunto de registros helpdesk.ticket
-        :return: Booleano indicando éxito
+        Procesar los tickets en 'Facturas Nuevas' reservándolos en tandas.
+        Varias ejecuciones en paralelo (copias del cron, otros workers u otros servidores) reservan
+        tandas disjuntas; la reserva de un worker caído vence y los tickets vuelven a estar disponibles.
+        Los tickets se reservan por prioridad: menor costo estimado primero, con envejecimiento
+        (ver _claim_tickets).
+        Cada tanda se procesa en tres fases (ver _extract_claimed_documents): lectura de los PDFs,
+        extracción sin transacción abierta y una transacción corta de escritura por ticket.
+        :param batch_size: Tickets por reserva
+        :param lease_minutes: Duración de la reserva
+        :param time_budget: Segundos tras los cuales no se reservan más tickets
+        :param max_cost: Costo estimado máximo de los tickets a reservar (carril rápido); sin límite si es None
+        :return: Cantidad de tickets procesados
         """
-        if not tickets:
-            _logger.info("No hay tickets para procesar")
-            return False
-
-        _logger.info(f"Procesando {len(tickets)} tickets")
+        domain = self._get_facturas_nuevas_domain()
+        if domain is None:
+            return 0
+        claim_domain = domain
+        if max_cost is not None:
+            claim_domain = domain + [('x_parser_cost', '>', 0), ('x_parser_cost', '<=', max_cost)]
+
+        stages = self._get_parser_stages()
+        partners_by_cuit = {}
+        deadline = time.monotonic() + time_budget
+        processed = 0
+        while time.monotonic() < deadline:
+            self._estimate_parser_costs(domain)
+            tickets, token = self._claim_tickets(claim_domain, batch_size, lease_minutes, prioritize=True)
+            if not tickets:
+                break
+            documents = self._extract_claimed_documents(tickets)
+            pending = ParserRun()
+            for ticket in tickets:
+                self._procesar_ticket_reservado(ticket, stages, token, partners_by_cuit, documents,
+                                                pending=pending)
+                processed += 1
+            self._apply_pending_changes(pending)
+
+        _logger.info(f"Cron de facturas{' (carril rápido)' if max_cost is not None else ''}: "
+                     f"{processed} tickets procesados")
+        return processed
+
+    @api.model
+    def _cron_procesar_facturas_rapidas(self):
+        """
+        Carril rápido: procesar solo los tickets de costo estimado bajo (ver FAST_LANE_MAX_COST)
+        :return: Cantidad de tickets procesados
+        """
+        return self._cron_procesar_facturas(time_budget=FAST_LANE_TIME_BUDGET_SECONDS, max_cost=FAST_LANE_MAX_COST)
 
-        # Obtener IDs de etapas para cambios de estado - usar los XML IDs de nuestro módulo
-        sin_pdf_stage = self.env.ref('bmi_invoice_parser.stage_tickets_sin_pdf', raise_if_not_found=False)
-        if not sin_pdf_stage:
-            sin_pdf_stage = self.env['helpdesk.stage'].search([
-                ('name', '=', 'Tickets sin PDF')
-            ], limit=1)
-            if not sin_pdf_stage:
-                sin_pdf_stage = self.env['helpdesk.stage'].create({
-                    'name': 'Tickets sin PDF',
-                    'sequence': 2,
+    @api.model
+    def _estimate_parser_costs(self, domain, limit=COST_ESTIMATE_BATCH_SIZE):
+        """
+        Estimar el costo de procesamiento de los tickets de la cola que todavía no lo tienen: la suma
+        de los costos de los PDFs que habrá que parsear (los ya extraídos no cuentan). El costo de
+        cada PDF se estima una sola vez y queda en el adjunto (ver ir.attachment._get_parser_cost),
+        por lo que en cada reserva no se leen los PDFs ya estimados.
+        :param domain: Dominio de la cola
+        :param limit: Cantidad máxima de tickets a estimar
+        :return: Cantidad de tickets estimados
+        """
+        tickets = self.search(domain + [('x_parser_cost', '=', 0)], order='id', limit=limit)
+        extraction_model = self.env['bmi.invoice.extraction.result']
+        max_pdfs = self._get_max_pdfs_per_ticket()
+        for ticket in tickets:
+            # Sin ordenar los PDFs (el orden lee su contenido): con más PDFs que el máximo se cuentan
+            # los más costosos, como cota superior
+            attachments = extraction_model._get_pending_attachments(self._search_ticket_pdf_attachments(ticket))
+            costs = sorted((attachment._get_parser_cost() for attachment in attachments), reverse=True)
+            ticket.x_parser_cost = COST_BASE_SECONDS + sum(costs[:max_pdfs or None])
+        if tickets:
+            self.env.cr.commit()
+        return len(tickets)
+
+    @api.model
+    def _claim_tickets(self, domain, limit, lease_minutes=CLAIM_LEASE_MINUTES, prioritize=False):
+        """
+        Reservar tickets sin reserva vigente con FOR UPDATE SKIP LOCKED: los tickets que otra
+        transacción está reservando se saltean en lugar de esperar. La reserva se confirma de
+        inmediato para que sea visible a los demás workers.
+        :param domain: Dominio de los tickets a reservar
+        :param limit: Cantidad máxima de tickets
+        :param lease_minutes: Duración de la reserva
+        :param prioritize: Si es True se reservan primero los de menor costo estimado, descontando
+                           la espera (PRIORITY_AGING_FACTOR); si no, por ID
+        :return: Tupla (tickets reservados, token de la reserva)
+        """
+        now = fields.Datetime.now()
+        token = uuid.uuid4().hex
+        query = self._where_calc(domain + [
+            '|', ('x_parser_lease_until', '=', False), ('x_parser_lease_until', '<', now),
+        ])
+        if prioritize:
+            query.order = (
+                f'COALESCE(NULLIF("helpdesk_ticket"."x_parser_cost", 0), {PRIORITY_DEFAULT_COST}) '
+                f'- EXTRACT(EPOCH FROM (now() AT TIME ZONE \'UTC\' - "helpdesk_ticket"."create_date")) '
+                f'* {PRIORITY_AGING_FACTOR}, "helpdesk_ticket"."id"'
+            )
+        else:
+            query.order = '"helpdesk_ticket"."id"'
+        query.limit = limit
+        subquery, params = query.select('"helpdesk_ticket"."id"')
+
+        self.flush_model(['stage_id', 'team_id', 'x_parser_cost', 'x_parser_lease_token', 'x_parser_lease_until'])
+        self.env.cr.execute(f"""
+            UPDATE helpdesk_ticket
+               SET x_parser_lease_token = %s, x_parser_lease_until = %s
+             WHERE id IN ({subquery} FOR UPDATE SKIP LOCKED)
+         RETURNING id
+        """, [token, now + timedelta(minutes=lease_minutes)] + list(params))
+        ticket_ids = sorted(row[0] for row in self.env.cr.fetchall())
+        self.env.cr.commit()
+        self.invalidate_model(['x_parser_lease_token', 'x_parser_lease_until'])
+        return self.browse(ticket_ids), token
+
+    @api.model
+    def _extract_claimed_documents(self, tickets):
+        """
+        Extraer los PDFs pendientes de una tanda de tickets reservados fuera de la transacción:
+        los adjuntos se leen en una transacción corta que se cierra antes de parsear, de modo que
+        el parseo (pdfminer, OCR) no mantiene bloqueos ni un snapshot abierto mientras dura.
+        Los PDFs ya extraídos, en espera de reintento o en cuarentena no se leen.
+        :param tickets: registros helpdesk.ticket reservados
+        :return: Diccionario {ID de adjunto: documento extraído} para ParserRun.documents
+        """
+        # Fase 1: leer IDs y contenido de los adjuntos
+        engine = self._get_text_engine()
+        attachments = [attachment for ticket in tickets for attachment in self._get_ticket_pdf_attachments(ticket)]
+        pending = self.env['bmi.invoice.extraction.result']._get_pending_attachments(attachments)
+        items = [(attachment.id, attachment.raw or base64.b64decode(attachment.datas or b''))
+                 for attachment in pending]
+        self.env.cr.commit()
+
+        # Fase 2: parsear sin transacción abierta (no se accede a la base de datos)
+        start = time.perf_counter()
+        documents = self.env['bmi.invoice.extraction.result']._extract_documents(items, engine=engine)
+        _logger.info(f"Extraídos {len(items)} PDFs de {len(tickets)} tickets fuera de la transacción "
+                     f"en {time.perf_counter() - start:.1f}s")
+        return documents
+
+    @api.model
+    def _procesar_ticket_reservado(self, ticket, stages, token, partners_by_cuit=None, documents=None,
+                                   timings=None, pending=None):
+        """
+        Procesar un ticket reservado y liberar la reserva con la misma escritura que aplica sus cambios.
+        Si el procesamiento falla la reserva se mantiene hasta vencer, para no reintentar el
+        ticket de inmediato; si un PDF espera un reintento de extracción, la reserva se extiende
+        hasta ese intento.
+        Con pending, los cambios de los tickets que no vinculan facturas (TICKET_INVOICE_FIELDS) y
+        sus mensajes se postergan a esa ejecución, para aplicarlos agrupados al final de la tanda
+        (ver _apply_pending_changes); mientras tanto el ticket sigue reservado.
+        :param ticket: registro helpdesk.ticket reservado
+        :param stages: Diccionario de etapas obtenido con _get_parser_stages
+        :param token: Token de la reserva
+        :param partners_by_cuit: Caché de proveedores por CUIT compartida entre los tickets de la pasada
+        :param documents: PDFs ya extraídos fuera de la transacción (ver _extract_claimed_documents)
+        :param timings: Diccionario {etapa: [segundos]} donde acumular la latencia de cada etapa
+        :param pending: ParserRun de la tanda donde postergar los cambios del ticket
+        :return: Resultado del procesamiento (una de las claves de OUTCOMES)
+        """
+        ticket.invalidate_recordset(['x_parser_lease_token'])
+        if ticket.x_parser_lease_token != token:
+            return OUTCOME_OMITIDO
+        queries = self.env.cr.sql_log_count
+        try:
+            run = ParserRun(documents=documents, partners_by_cuit=partners_by_cuit)
+            outcome = self.with_context(**{PARSER_RUN_CONTEXT_KEY: run})._procesar_ticket(ticket, stages)
+            # Con OUTCOME_REINTENTO la reserva ya se extendió hasta el próximo intento de extracción
+            if outcome != OUTCOME_REINTENTO:
+                # Si el ticket sigue en la cola, su costo se vuelve a estimar sobre los PDFs aún pendientes
+                run.record_write(ticket.id, {
+                    'x_parser_lease_token': False, 'x_parser_lease_until': False, 'x_parser_cost': 0,
                 })
+            changes = run.changes[ticket.id]
+            if pending is not None and not TICKET_INVOICE_FIELDS & set(changes):
+                pending.record_write(ticket.id, changes)
+                pending.record_lease(ticket.id, token)
+                for body in run.messages.get(ticket.id, []):
+                    pending.record_message(ticket.id, body)
+            else:
+                self._apply_parser_changes(run)
+            self.env.cr.commit()
+            self._check_query_budget(ticket, outcome, self.env.cr.sql_log_count - queries)
+            if timings is not None:
+                for stage, values in run.timings.items():
+                    timings.setdefault(stage, []).extend(values)
+        except Exception as e:
+            self.env.cr.rollback()
+            _logger.exception(f"Error al procesar el ticket {ticket.id}: {e}")
+            outcome = OUTCOME_ERROR
+        return outcome
 
-        sin_po_stage = self.env.ref('bmi_invoice_parser.stage_pdf_sin_po', raise_if_not_found=False)
+    @api.model
+    def _check_query_budget(self, ticket, outcome, queries):
+        """
+        Verificar la cantidad de consultas SQL del procesamiento de un ticket contra QUERY_BUDGETS
+        :param ticket: registro helpdesk.ticket
+        :param outcome: Resultado del procesamiento
+        :param queries: Cantidad de consultas
+        :return: True si se superó el máximo del resultado
+        """
+        budget = QUERY_BUDGETS.get(outcome)
+        if budget is None or queries <= budget:
+            return False
+        _logger.warning(f"Ticket {ticket.id} ({outcome}): {queries} consultas SQL, más que el máximo de {budget}")
+        return True
 
-        if not sin_po_stage:
-            sin_po_stage = self.env['helpdesk.stage'].search([
-                ('name', '=', 'PDF sin PO#')
-            ], limit=1)
-            if not sin_po_stage:
-                sin_po_stage = self.env['helpdesk.stage'].create({
-                    'name': 'PDF sin PO#',
-                    'sequence': 3,
-                })
+    @api.model
+    def _apply_parser_changes(self, run):
+        """
+        Aplicar los cambios acumulados en una ejecución, agrupando los tickets por etapa de destino:
+        los valores comunes a todos los tickets de la etapa (la etapa y, típicamente, la liberación
+        de la reserva) se escriben con una sola escritura agrupada, y los propios de cada ticket
+        (PO#, CUIT, importes) con una escritura por ticket, antes de la agrupada. Después se
+        publican los mensajes de cada ticket. En dry-run no se aplica nada.
+        :param run: ParserRun con los cambios y mensajes por ticket
+        """
+        if run.dry_run:
+            return
+        by_stage = defaultdict(list)
+        for ticket_id, vals in run.changes.items():
+            if vals:
+                by_stage[vals.get('stage_id')].append(ticket_id)
+        for ticket_ids in by_stage.values():
+            changes = [run.changes[ticket_id] for ticket_id in ticket_ids]
+            shared = {
+                field: value for field, value in changes[0].items()
+                if all(field in vals and vals[field] == value for vals in changes[1:])
+            }
+            for ticket_id, vals in zip(ticket_ids, changes):
+                extras = {field: value for field, value in vals.items() if field not in shared}
+                if extras:
+                    self.browse(ticket_id).write(extras)
+            if shared:
+                self.browse(ticket_ids).write(shared)
+        for ticket_id, bodies in run.messages.items():
+            ticket = self.browse(ticket_id)
+            for body in bodies:
+                ticket.message_post(body=body)
+
+    @api.model
+    def _apply_pending_changes(self, pending):
+        """
+        Aplicar y confirmar los cambios postergados de una tanda (ver _procesar_ticket_reservado).
+        Solo se aplican a los tickets que siguen reservados con la reserva con la que se postergaron:
+        si la tanda tardó más que la reserva y otro proceso volvió a reservar un ticket, sus cambios
+        se descartan y el ticket queda para ese proceso. Si fallan, los tickets conservan la reserva
+        hasta que vence y se vuelven a procesar.
+        :param pending: ParserRun de la tanda
+        :return: True si los cambios se aplicaron
+        """
+        if not pending.changes:
+            return True
+        try:
+            if pending.lease_tokens:
+                # Bloquear los tickets para que nadie los reserve entre la verificación y la escritura
+                self.flush_model(['x_parser_lease_token'])
+                self.env.cr.execute(
+                    "SELECT id, x_parser_lease_token FROM helpdesk_ticket WHERE id IN %s FOR UPDATE",
+                    [tuple(pending.lease_tokens)],
+                )
+                held = {ticket_id for ticket_id, token in self.env.cr.fetchall()
+                        if token == pending.lease_tokens[ticket_id]}
+                lost = [ticket_id for ticket_id in pending.lease_tokens if ticket_id not in held]
+                if lost:
+                    _logger.warning(f"Se descartan los cambios postergados de los tickets {sorted(lost)}: "
+                                    f"su reserva venció y la tomó otro proceso")
+                    for ticket_id in lost:
+                        pending.discard_ticket(ticket_id)
+            self._apply_parser_changes(pending)
+            self.env.cr.commit()
+        except Exception as e:
+            self.env.cr.rollback()
+            _logger.exception(f"Error al aplicar los cambios de los tickets {sorted(pending.changes)}: {e}")
+            return False
+        return True
 
-        invoice_linked = self.env.ref('bmi_invoice_parser.stage_fact_vinculada', raise_if_not_found=False)
-        if not invoice_linked:
-            invoice_linked = self.env['helpdesk.stage'].search([
-                ('name', '=', 'Facturas Vinculadas')
-            ], limit=1)
-            if not invoice_linked:
-                invoice_linked = self.env['helpdesk.stage'].create({
-                    'name': 'Facturas Vinculadas',
-                    'sequence': 5,
+    @api.model
+    def _find_parser_stages(self):
+        """
+        Buscar las etapas usadas por el procesamiento, por XML ID y luego por nombre, sin crear
+        las que falten (por ejemplo, para las métricas)
+        :return: Diccionario {resultado: registro helpdesk.stage, vacío si no existe}
+        """
+        stages = {}
+        for outcome, (xml_id, name, _sequence) in PARSER_STAGES.items():
+            stage = self.env.ref(xml_id, raise_if_not_found=False) if xml_id else None
+            if not stage:
+                stage = self.env['helpdesk.stage'].search([('name', '=', name)], limit=1)
+            stages[outcome] = stage
+        return stages
+
+    @api.model
+    def _get_parser_stages(self):
+        """
+        Obtener las etapas usadas por el procesamiento, creando las que falten
+        :return: Diccionario {resultado: registro helpdesk.stage}
+        """
+        stages = self._find_parser_stages()
+        for outcome, (_xml_id, name, sequence) in PARSER_STAGES.items():
+            # 'Facturas Duplicadas' no se crea: si no existe, las duplicadas no cambian de etapa
+            if not stages[outcome] and sequence is not None:
+                stages[outcome] = self.env['helpdesk.stage'].create({
+                    'name': name,
+                    'sequence': sequence,
                 })
+        return stages
 
+    def _procesar_ticket(self, ticket, stages):
+        """
+        Procesa un ticket: busca sus PDFs, los procesa y mueve el ticket a la etapa correspondiente
+        :param ticket: registro helpdesk.ticket
+        :param stages: Diccionario de etapas obtenido con _get_parser_stages
+        :return: Resultado del procesamiento (una de las claves de OUTCOMES)
+        """
+        run = self._parser_run()
+        if run is None:
+            run = ParserRun()
+            outcome = self.with_context(**{PARSER_RUN_CONTEXT_KEY: run})._procesar_ticket(ticket, stages)
+            self._apply_parser_changes(run)
+            return outcome
 
-        po_inexistente_stage = self.env.ref('bmi_invoice_parser.stage_po_inexistente', raise_if_not_found=False)
-        if not po_inexistente_stage:
-            po_inexistente_stage = self.env['helpdesk.stage'].search([
-                ('name', '=', 'PO# Inexistente')
-            ], limit=1)
-            if not po_inexistente_stage:
-                po_inexistente_stage = self.env['helpdesk.stage'].create({
-                    'name': 'PO# Inexistente',
-                    'sequence': 4,
-                })
+        run.begin_ticket()
+        # ticket.message_post(body="Iniciando procesamiento automático del ticket.")
 
-        for ticket in tickets:
-            # ticket.message_post(body="Iniciando procesamiento automático del ticket.")
-
-            has_pdf = False
-            pdf_attachments = []
-
-            # Verificar PDFs en los mensajes del chatter
-            for message in ticket.message_ids:
-                message_attachments = self.env['ir.attachment'].search([
-                    ('res_model', '=', 'mail.message'),
-                    ('res_id', '=', message.id),
-                    ('mimetype', '=', 'application/pdf')
-                ])
-
-                if message_attachments:
-                    has_pdf = True
-                    pdf_attachments.extend(message_attachments)
-
-            # También verificar PDFs adjuntos directamente al ticket
-            ticket_attachments = self.env['ir.attachment'].search([
-                ('res_model', '=', 'helpdesk.ticket'),
-                ('res_id', '=', ticket.id),
-                ('mimetype', '=', 'application/pdf')
-            ])
+        pdf_attachments = self._get_ticket_pdf_attachments(ticket)
+        run.lap('adjuntos')
 
-            if ticket_attachments:
-                has_pdf = True
-                pdf_attachments.extend(ticket_attachments)
+        outcome = self._procesar_adjuntos(ticket, pdf_attachments, stages)
+        run.record_outcome(ticket.id, outcome)
+        return outcome
+
+    def _get_ticket_pdf_attachments(self, ticket):
+        """
+        Obtener los PDFs de un ticket (adjuntos de los mensajes del chatter y adjuntos directos),
+        ordenados de mayor a menor probabilidad de ser la factura y limitados a la cantidad máxima
+        configurada (ver _get_max_pdfs_per_ticket)
+        :param ticket: registro helpdesk.ticket
+        :return: Lista de registros ir.attachment
+        """
+        pdf_attachments = self._rank_pdf_attachments(self._search_ticket_pdf_attachments(ticket))
+        max_pdfs = self._get_max_pdfs_per_ticket()
+        if max_pdfs and len(pdf_attachments) > max_pdfs:
+            _logger.info(f"Ticket {ticket.id}: se procesan {max_pdfs} de {len(pdf_attachments)} PDFs "
+                         f"(omitidos: {', '.join(a.name for a in pdf_attachments[max_pdfs:])})")
+            pdf_attachments = pdf_attachments[:max_pdfs]
+        return pdf_attachments
+
+    def _search_ticket_pdf_attachments(self, ticket):
+        """
+        Buscar los PDFs de un ticket en su orden original, sin leer su contenido
+        :param ticket: registro helpdesk.ticket
+        :return: Lista de registros ir.attachment
+        """
+        # Una sola búsqueda para los adjuntos de todos los mensajes y los del ticket
+        attachments = self.env['ir.attachment'].search([
+            ('mimetype', '=', 'application/pdf'),
+            '|',
+            '&', ('res_model', '=', 'mail.message'), ('res_id', 'in', ticket.message_ids.ids),
+            '&', ('res_model', '=', 'helpdesk.ticket'), ('res_id', '=', ticket.id),
+        ])
+        # Orden original: mensajes del chatter en su orden y después los adjuntos directos
+        message_order = {message_id: index for index, message_id in enumerate(ticket.message_ids.ids)}
+        return list(attachments.sorted(lambda a: (
+            a.res_model != 'mail.message', message_order.get(a.res_id, 0), a.id,
+        )))
+
+    @api.model
+    def _rank_pdf_attachments(self, attachments):
+        """
+        Ordenar los PDFs de un ticket para parsear primero el que con más probabilidad es la
+        factura (nombre de archivo, tamaño, páginas y capa de texto; ver score_pdf_candidate).
+        Solo se leen los bytes del adjunto, sin parsear el PDF.
+        :param attachments: Lista de registros ir.attachment
+        :return: Lista de registros ir.attachment ordenada
+        """
+        if len(attachments) <= 1:
+            return attachments
+        by_id = {attachment.id: attachment for attachment in attachments}
+        ranked_ids = rank_pdf_candidates([(attachment.id, attachment.name, attachment.raw or b'')
+                                          for attachment in attachments])
+        return [by_id[attachment_id] for attachment_id in ranked_ids]
+
+    @api.model
+    def _get_max_pdfs_per_ticket(self):
+        """
+        :return: Cantidad máxima de PDFs a parsear por ticket (0 sin límite), del parámetro del
+                 sistema bmi_invoice_parser.max_pdfs_per_ticket
+        """
+        value = self.env['ir.config_parameter'].sudo().get_param('bmi_invoice_parser.max_pdfs_per_ticket', '0')
+        try:
+            return max(int(value), 0)
+        except ValueError:
+            _logger.warning(f"Valor inválido para bmi_invoice_parser.max_pdfs_per_ticket: {value!r}")
+            return 0
 
-            if not has_pdf:
-                # Si no se encuentran adjuntos PDF, cambiar el estado a 'Tickets sin PDF'
-                ticket.write({
-                    'stage_id': sin_pdf_stage.id
+    def _procesar_adjuntos(self, ticket, pdf_attachments, stages):
+        """
+        Procesa los PDFs de un ticket hasta que uno de ellos determine el resultado
+        :param ticket: registro helpdesk.ticket
+        :param pdf_attachments: Lista de registros ir.attachment
+        :param stages: Diccionario de etapas obtenido con _get_parser_stages
+        :return: Resultado del procesamiento (una de las claves de OUTCOMES)
+        """
+        run = self._parser_run()
+        sin_pdf_stage = stages[OUTCOME_SIN_PDF]
+        sin_po_stage = stages[OUTCOME_SIN_PO]
+        invoice_linked = stages[OUTCOME_VINCULADA]
+        po_inexistente_stage = stages[OUTCOME_PO_INEXISTENTE]
+
+        if not pdf_attachments:
+            # Si no se encuentran adjuntos PDF, cambiar el estado a 'Tickets sin PDF'
+            self._parser_write(ticket, {
+                'stage_id': sin_pdf_stage.id
+            })
+            # Registrar el cambio en el chatter
+            self._parser_post(
+                ticket,
+                body="Ticket movido a 'Tickets sin PDF' - No se encontraron adjuntos PDF en los mensajes"
+            )
+            return OUTCOME_SIN_PDF
+
+        # ticket.message_post(body=f"Se encontraron {len(pdf_attachments)} archivos PDF adjuntos para procesar")
+        # Procesar cada adjunto PDF
+        for attachment in pdf_attachments:
+            result, is_po_inexistente, invoice_created = self.process_invoice_pdf(ticket, attachment,
+                                                                                  sin_po_stage,
+                                                                                  po_inexistente_stage)
+            if invoice_created:
+                # Una factura duplicada ya dejó el ticket en 'Facturas Duplicadas'
+                if run is not None and run.outcomes.get(ticket.id) == OUTCOME_DUPLICADA:
+                    return OUTCOME_DUPLICADA
+                self._parser_write(ticket, {
+                    'stage_id': invoice_linked.id
                 })
-                # Registrar el cambio en el chatter
-                ticket.message_post(
-                    body="Ticket movido a 'Tickets sin PDF' - No se encontraron adjuntos PDF en los mensajes"
-                )
-            else:
-                # ticket.message_post(body=f"Se encontraron {len(pdf_attachments)} archivos PDF adjuntos para procesar")
-                # Procesar cada adjunto PDF
-                po_found = False
-                po_inexistente = False
-                invoice_created = False
-
-                for attachment in pdf_attachments:
-                    result, is_po_inexistente, invoice_created  = self.process_invoice_pdf(ticket, attachment,
-                                                                                           sin_po_stage,
-                                                                                           po_inexistente_stage)
-                    if invoice_created:
-                        po_found = True
-                        ticket.write({
-                            'stage_id': invoice_linked.id
-                        })
-                        break
-                    elif result:
-                        po_found = True
-                        break
-                    elif is_po_inexistente:
-                        po_inexistente = True
-                        break
+                return OUTCOME_VINCULADA
+            elif result:
+                return OUTCOME_VINCULADA
+            elif is_po_inexistente:
+                return OUTCOME_PO_INEXISTENTE
+
+        # Si algún PDF no se pudo leer, el ticket espera el próximo intento o, agotados los
+        # intentos, pasa a la cola de cuarentena en lugar de 'PDF sin PO#'
+        failures = run.extraction_failures.get(ticket.id) if run is not None else None
+        if failures:
+            retry_dates = [next_attempt for state, next_attempt in failures if next_attempt]
+            if retry_dates:
+                run.record_write(ticket.id, {'x_parser_lease_until': min(retry_dates)})
+                return OUTCOME_REINTENTO
+            self._parser_write(ticket, {
+                'stage_id': stages[OUTCOME_CUARENTENA].id
+            })
+            self._parser_post(
+                ticket,
+                body="Ticket movido a 'PDF en Cuarentena' - Se agotaron los reintentos de extracción del PDF"
+            )
+            return OUTCOME_CUARENTENA
+
+        # Si no se encontró PO y no se marcó como PO# inexistente, mover a 'PDF sin PO#'
+        self._parser_write(ticket, {
+            'stage_id': sin_po_stage.id
+        })
+        self._parser_post(
+            ticket,
+            body="Ticket movido a 'PDF sin PO#' - No se encontró PO válida en ningún PDF"
+        )
+        return OUTCOME_SIN_PO
 
-                # Si no se encontró PO y no se marcó como PO# inexistente, mover a 'PDF sin PO#'
-                if not po_found and not po_inexistente and not invoice_created:
-                    ticket.write({
-                        'stage_id': sin_po_stage.id
-                    })
-                    ticket.message_post(
-                        body="Ticket movido a 'PDF sin PO#' - No se encontró PO válida en ningún PDF"
-                    )
+    def _parser_run(self):
+        """
+        :return: Ejecución en curso (ParserRun) propagada por contexto, o None
+        """
+        return self.env.context.get(PARSER_RUN_CONTEXT_KEY)
 
-        return True
+    def _get_partner_by_cuit(self, cuit):
+        """
+        Buscar el proveedor de un CUIT por su clave normalizada (solo dígitos), con caché por ejecución
+        :param cuit: CUIT en cualquier formato
+        :return: registro res.partner (entidad comercial) o vacío si no hay ninguno
+        """
+        key = normalize_cuit(cuit)
+        if not key:
+            return self.env['res.partner']
+        run = self._parser_run()
+        cache = run.partners_by_cuit if run is not None else {}
+        if key not in cache:
+            partner = self.env['res.partner'].search([('x_cuit_key', '=', key)], order='id', limit=1)
+            cache[key] = partner.commercial_partner_id.id
+        return self.env['res.partner'].browse(cache[key])
+
+    def _parser_write(self, ticket, vals):
+        """
+        Escribir en un ticket durante el procesamiento. Dentro de una ejecución solo se registra el
+        cambio: los cambios de cada ticket se aplican juntos al terminar (ver _apply_parser_changes).
+        :param ticket: registro helpdesk.ticket
+        :param vals: Valores a escribir
+        """
+        run = self._parser_run()
+        if run is not None:
+            run.record_write(ticket.id, vals)
+            return
+        ticket.write(vals)
+
+    def _parser_post(self, ticket, body):
+        """
+        Publicar un mensaje en el chatter de un ticket durante el procesamiento. Dentro de una
+        ejecución solo se registra el mensaje, que se publica después de aplicar los cambios del ticket.
+        :param ticket: registro helpdesk.ticket
+        :param body: Cuerpo del mensaje
+        """
+        run = self._parser_run()
+        if run is not None:
+            run.record_message(ticket.id, body)
+            return
+        ticket.message_post(body=body)
+
+    def _parser_lap(self, stage):
+        """
+        Registrar la latencia de una etapa del procesamiento en la ejecución en curso
+        :param stage: Nombre de la etapa que termina
+        """
+        run = self._parser_run()
+        if run is not None:
+            run.lap(stage)
 
     def process_invoice_pdf(self, ticket, attachment, sin_po_stage, po_inexistente_stage):
         """
@@ -207,296 +886,426 @@ class InvoiceParser(models.Model):
         :return: Tupla (Booleano indicando éxito, Booleano indicando si PO# inexistente)
         """
         _logger.info(f"Iniciando procesamiento de PDF: {attachment.name}")
-        ticket.message_post(
+        self._parser_post(
+            ticket,
             body=f"Iniciando procesamiento del PDF: {attachment.name}"
         )
 
         try:
-            # Obtener contenido del PDF
-            pdf_content = base64.b64decode(attachment.datas)
-            pdf_file = BytesIO(pdf_content)
-
-            # Extraer texto del PDF
-            text_content = self.convert_pdf_to_text(pdf_file)
+            # Obtener el resultado de extracción del adjunto (solo se parsea el PDF si no hay texto almacenado)
+            extraction = self.env['bmi.invoice.extraction.result']._get_for_attachment(ticket, attachment)
+            if extraction.state != EXTRACTION_DONE:
+                run = self._parser_run()
+                if run is not None:
+                    run.record_extraction_failure(ticket.id, extraction.state, extraction.next_attempt_date)
+                if extraction.state == EXTRACTION_QUARANTINED:
+                    body = (f"PDF {attachment.name} en cuarentena tras {extraction.failure_count} intentos "
+                            f"fallidos: {extraction.last_error}")
+                else:
+                    body = (f"No se pudo leer el PDF {attachment.name} (intento {extraction.failure_count}): "
+                            f"{extraction.last_error}. Próximo intento: {extraction.next_attempt_date}")
+                self._parser_post(ticket, body=body)
+                self._parser_lap('reglas')
+                return (False, False, False)
+            text_content = extraction.text_content or ''
+            self._parser_lap('reglas')
 
             # Registrar un fragmento del texto extraído para diagnóstico
             text_sample = text_content[:500] + ('...' if len(text_content) > 500 else '')
             _logger.info(f"Muestra del texto extraído del PDF: {text_sample}")
 
-            # Primero, verificar si hay un patrón de "Pedido de compra" específico
-            pedido_pattern = r'pedido de compra[^\n]*?#P([0-9]{4,})'
-            pedido_match = re.search(pedido_pattern, text_content, re.IGNORECASE)
-            if pedido_match:
-                pedido_po = pedido_match.group(1).strip()
-                p_number = f"#P{pedido_po}"
-                _logger.info(f"Encontrada referencia especial de 'Pedido de compra': {p_number}")
+            # PDF con varias facturas: cada una se procesa por separado
+            if extraction.segments:
+                return self._process_invoice_segments(ticket, attachment, extraction, sin_po_stage,
+                                                      po_inexistente_stage)
+            return self._process_extraction(ticket, attachment, extraction, sin_po_stage, po_inexistente_stage)
 
-                # Registrar en el chatter el número encontrado
-                ticket.message_post(
-                    body=f"Número de PO encontrado en el PDF: {p_number}"
-                )
+        except Exception as e:
+            error_msg = f"Error al procesar el PDF adjunto {attachment.name}: {str(e)}"
+            _logger.error(error_msg)
+            self._parser_post(ticket, body=error_msg)
+            return (False, False, False)
 
-                # Check if this specific PO exists
-                pedido_purchase_order = self.env['purchase.order'].search([
-                    '|', '|',
-                    ('name', '=ilike', f"P{pedido_po}"),
-                    ('name', '=ilike', f"#P{pedido_po}"),
-                    ('name', '=ilike', pedido_po)
-                ], limit=1)
 
-                if pedido_purchase_order:
-                    oc_message = f"PO coincidente encontrada para 'Pedido de compra': {pedido_purchase_order.name}"
-                    _logger.info(oc_message)
-                    # Añadir al chatter
-                    ticket.message_post(body=oc_message)
+    def _process_extraction(self, ticket, attachment, extraction, sin_po_stage, po_inexistente_stage):
+        """
+        Buscar la PO de una factura extraída y crear la factura en borrador
+        :param ticket: registro helpdesk.ticket
+        :param attachment: registro ir.attachment
+        :param extraction: registro bmi.invoice.extraction.result (o un segmento en memoria)
+        :param sin_po_stage: registro helpdesk.stage para 'PDF sin PO#'
+        :param po_inexistente_stage: registro helpdesk.stage para 'PO# Inexistente'
+        :return: Tupla (éxito, PO# inexistente, factura creada)
+        """
+        if extraction.rule_errors:
+            self._parser_post(ticket, body=extraction.rule_errors)
+
+        # Primero, verificar si hay un patrón de "Pedido de compra" específico
+        if extraction.pedido_po:
+            pedido_po = extraction.pedido_po
+            p_number = f"#P{pedido_po}"
+            _logger.info(f"Encontrada referencia especial de 'Pedido de compra': {p_number}")
+
+            # Registrar en el chatter el número encontrado
+            self._parser_post(
+                ticket,
+                body=f"Número de PO encontrado en el PDF: {p_number}"
+            )
 
-                    purchase_order = pedido_purchase_order
-                    po_number = pedido_po
-                    original_po = f"#P{pedido_po}"
+            # Check if this specific PO exists
+            pedido_purchase_order = self.env['purchase.order'].search([
+                '|', '|',
+                ('name', '=ilike', f"P{pedido_po}"),
+                ('name', '=ilike', f"#P{pedido_po}"),
+                ('name', '=ilike', pedido_po)
+            ], limit=1)
 
-                    # Extract invoice data and create invoice
-                    invoice_data = self.extract_invoice_data(text_content, po_number)
-                    invoice = self.create_draft_invoice(ticket, invoice_data, purchase_order, attachment)
-                    return (True if invoice else False, False, True if invoice else False)
-                else:
-                    # Mover al estado "PO# Inexistente" si se encuentra pero no existe
-                    ticket.write({
-                        'stage_id': po_inexistente_stage.id,
-                        'x_po_number': f"P{pedido_po}"  # Guardar el número de PO aunque no exista
-                    })
-                    ticket.message_post(
-                        body=f"Ticket movido a 'PO# Inexistente' - Se encontró el número de PO ({p_number}) "
-                             f"en el PDF pero no existe en el sistema."
-                    )
-                    return (False, True, False)
+            if pedido_purchase_order:
+                oc_message = f"PO coincidente encontrada para 'Pedido de compra': {pedido_purchase_order.name}"
+                _logger.info(oc_message)
+                # Añadir al chatter
+                self._parser_post(ticket, body=oc_message)
 
-            # Extraer número de PO usando el método principal
-            try:
-                result = self.extract_po_number(text_content)
-                # Asegurarse de que result sea una tupla con el formato esperado
-                if isinstance(result, tuple) and len(result) >= 2:
-                    po_number = result[0]
-                    all_found_pos = result[1]
-                else:
-                    po_number = result
-                    all_found_pos = [po_number] if po_number else []
-            except Exception as e:
-                error_msg = f"Error al extraer número de PO: {str(e)}"
-                _logger.error(error_msg)
-                ticket.message_post(body=error_msg)
-                po_number = False
-                all_found_pos = []
-
-            # Registrar todos los posibles números de PO encontrados en el chatter
-            if all_found_pos:
-                po_list_text = ", ".join([str(p) for p in all_found_pos if p])
-                # if po_list_text:
-                #    ticket.message_post(body=f"Posibles números de PO encontrados en el PDF: {po_list_text}")
-
-            # VALIDACIÓN ADICIONAL: Verificar que el número de PO tiene un formato válido
-            # Una PO válida debe tener al menos 4 caracteres y contener un número de al menos 4 dígitos
-            if po_number:
-                # Extraer solo dígitos del número de PO
-                po_digits = ''.join(filter(str.isdigit, str(po_number)))
-                if len(po_digits) < 4 or len(str(po_number)) < 4:
-                    _logger.info(f"Número de PO descartado por ser demasiado corto: {po_number} (dígitos: {po_digits})")
-                    po_number = False
-
-            # Si no se encontró un número de OC, actualizar mensaje y devolver false
-            if not po_number:
-                # Mover el ticket a "PDF sin PO#"
-                ticket.write({
-                    'stage_id': sin_po_stage.id
+                purchase_order = pedido_purchase_order
+                po_number = pedido_po
+                original_po = f"#P{pedido_po}"
+
+                # Extract invoice data and create invoice
+                invoice_data = extraction._get_invoice_data(po_number)
+                invoice = self.create_draft_invoice(ticket, invoice_data, purchase_order, attachment)
+                return (True if invoice else False, False, True if invoice else False)
+            else:
+                self._parser_lap('busqueda_po')
+                # Mover al estado "PO# Inexistente" si se encuentra pero no existe
+                self._parser_write(ticket, {
+                    'stage_id': po_inexistente_stage.id,
+                    'x_po_number': f"P{pedido_po}"  # Guardar el número de PO aunque no exista
                 })
-                ticket.message_post(
-                    body=f"No se encontró número de PO válido en el PDF: {attachment.name}<br/>"
-                         f"El ticket ha sido movido a 'PDF sin PO#'.<br/>"
-                         f"Por favor, verifique si esta factura contiene una referencia de orden de compra."
+                self._parser_post(
+                    ticket,
+                    body=f"Ticket movido a 'PO# Inexistente' - Se encontró el número de PO ({p_number}) "
+                         f"en el PDF pero no existe en el sistema."
                 )
-                return (False, False, False)
+                return (False, True, False)
 
-            # Guardar el formato original antes de limpiarlo
-            original_po = po_number
-            _logger.info(f"Número de PO extraído (formato original): {original_po}")
-            # ticket.message_post( body=f"Número de PO extraído (formato original): {original_po}" )
+        # Número de PO obtenido por el método principal (ya validado por las reglas)
+        po_number = extraction.po_number
 
-            # Limpiar prefijos si es necesario
-            if original_po.startswith('#'):
-                po_number = original_po[1:]
-            else:
-                po_number = original_po
+        # Si no se encontró un número de OC, actualizar mensaje y devolver false
+        if not po_number:
+            # Mover el ticket a "PDF sin PO#"
+            self._parser_write(ticket, {
+                'stage_id': sin_po_stage.id
+            })
+            self._parser_post(
+                ticket,
+                body=f"No se encontró número de PO válido en el PDF: {attachment.name}<br/>"
+                     f"El ticket ha sido movido a 'PDF sin PO#'.<br/>"
+                     f"Por favor, verifique si esta factura contiene una referencia de orden de compra."
+            )
+            return (False, False, False)
 
-            # Para búsqueda, necesitamos el número sin el prefijo P en algunos casos
-            search_number = po_number
-            if po_number.upper().startswith('P') and po_number[1:].isdigit():
-                search_number = po_number[1:]
+        # Guardar el formato original antes de limpiarlo
+        original_po = po_number
+        _logger.info(f"Número de PO extraído (formato original): {original_po}")
+        # ticket.message_post( body=f"Número de PO extraído (formato original): {original_po}" )
 
-            # Limpiar posibles caracteres no alfanuméricos
-            search_number = re.sub(r'^[^A-Z0-9]+', '', search_number, flags=re.IGNORECASE)
+        # Limpiar prefijos si es necesario
+        if original_po.startswith('#'):
+            po_number = original_po[1:]
+        else:
+            po_number = original_po
 
-            if search_number.isdigit():
-                search_number = search_number.zfill(5)
+        # Para búsqueda, necesitamos el número sin el prefijo P en algunos casos
+        search_number = po_number
+        if po_number.upper().startswith('P') and po_number[1:].isdigit():
+            search_number = po_number[1:]
 
-            _logger.info(f"Número de PO para búsqueda: {search_number}")
+        # Limpiar posibles caracteres no alfanuméricos
+        search_number = re.sub(r'^[^A-Z0-9]+', '', search_number, flags=re.IGNORECASE)
 
-            # Crear versiones del número de PO para buscar
-            search_variants = [
-                po_number,
-                search_number,
-                'P' + search_number if not search_number.startswith('P') else search_number,
-                '#P' + search_number if not search_number.startswith('#P') else search_number,
-                'PO' + search_number if not search_number.startswith('PO') else search_number,
-                '#PO' + search_number if not search_number.startswith('#PO') else search_number,
-            ]
+        if search_number.isdigit():
+            search_number = search_number.zfill(5)
 
-            # Eliminar duplicados y cadenas vacías
-            search_variants = [v for v in set(search_variants) if v]
-            _logger.info(f"Variantes de búsqueda: {search_variants}")
+        _logger.info(f"Número de PO para búsqueda: {search_number}")
 
-            # Construir dominio para la búsqueda
-            domain = []
-            for variant in search_variants:
-                domain.append(('name', '=ilike', variant))
+        # Crear versiones del número de PO para buscar
+        search_variants = [
+            po_number,
+            search_number,
+            'P' + search_number if not search_number.startswith('P') else search_number,
+            '#P' + search_number if not search_number.startswith('#P') else search_number,
+            'PO' + search_number if not search_number.startswith('PO') else search_number,
+            '#PO' + search_number if not search_number.startswith('#PO') else search_number,
+        ]
 
-            if len(domain) > 1:
-                domain = ['|'] * (len(domain) - 1) + domain
+        # Eliminar duplicados y cadenas vacías
+        search_variants = [v for v in set(search_variants) if v]
+        _logger.info(f"Variantes de búsqueda: {search_variants}")
 
-            # Verificar que la PO existe en el sistema
-            purchase_order = self.env['purchase.order'].search(domain, limit=1)
+        # Construir dominio para la búsqueda
+        domain = []
+        for variant in search_variants:
+            domain.append(('name', '=ilike', variant))
 
-            if purchase_order:
-                oc_message = f"PO coincidente encontrada: {purchase_order.name}"
-                _logger.info(oc_message)
-                # Añadir al chatter
-                ticket.message_post(body=oc_message)
-            else:
-                _logger.warning(f"No se encontró PO coincidente para las variantes: {search_variants}")
+        if len(domain) > 1:
+            domain = ['|'] * (len(domain) - 1) + domain
 
-                # Intentar una búsqueda más permisiva
-                number_only = re.sub(r'[^0-9]', '', search_number)
-                if number_only and len(number_only) >= 4:
-                    search_msg = f"Intentando búsqueda solo por números con: {number_only}"
-                    _logger.info(search_msg)
+        # Verificar que la PO existe en el sistema
+        purchase_order = self.env['purchase.order'].search(domain, limit=1)
 
-                    # Buscar OCs que contengan esta secuencia de números
-                    purchase_order = self.env['purchase.order'].search([
-                        ('name', 'ilike', number_only)
-                    ], limit=1)
+        if purchase_order:
+            oc_message = f"PO coincidente encontrada: {purchase_order.name}"
+            _logger.info(oc_message)
+            # Añadir al chatter
+            self._parser_post(ticket, body=oc_message)
+        else:
+            _logger.warning(f"No se encontró PO coincidente para las variantes: {search_variants}")
 
-                    if purchase_order:
-                        oc_message = f"PO coincidente encontrada con búsqueda solo por números: {purchase_order.name}"
-                        _logger.info(oc_message)
-                        ticket.message_post(body=oc_message)
+            # Intentar una búsqueda más permisiva
+            number_only = re.sub(r'[^0-9]', '', search_number)
+            if number_only and len(number_only) >= 4:
+                search_msg = f"Intentando búsqueda solo por números con: {number_only}"
+                _logger.info(search_msg)
 
-            if not purchase_order:
-                # Intentar con una búsqueda más extendida
-                extended_domain = []
+                # Buscar OCs que contengan esta secuencia de números
+                purchase_order = self.env['purchase.order'].search([
+                    ('name', 'ilike', number_only)
+                ], limit=1)
 
-                # Añadir variantes con y sin prefijos
-                if search_number.isdigit():
-                    extended_domain.append(('name', 'ilike', search_number))
-                    if len(search_number) >= 4:
-                        extended_domain.append(('name', 'ilike', f"P{search_number}"))
-                        extended_domain.append(('name', 'ilike', f"PO{search_number}"))
+                if purchase_order:
+                    oc_message = f"PO coincidente encontrada con búsqueda solo por números: {purchase_order.name}"
+                    _logger.info(oc_message)
+                    self._parser_post(ticket, body=oc_message)
 
-                if len(extended_domain) > 1:
-                    extended_domain = ['|'] * (len(extended_domain) - 1) + extended_domain
+        if not purchase_order:
+            # Intentar con una búsqueda más extendida
+            extended_domain = []
 
-                ext_search_msg = f"Realizando búsqueda extendida con variantes adicionales"
-                _logger.info(ext_search_msg)
-                ticket.message_post(body=ext_search_msg)
+            # Añadir variantes con y sin prefijos
+            if search_number.isdigit():
+                extended_domain.append(('name', 'ilike', search_number))
+                if len(search_number) >= 4:
+                    extended_domain.append(('name', 'ilike', f"P{search_number}"))
+                    extended_domain.append(('name', 'ilike', f"PO{search_number}"))
 
-                purchase_order = self.env['purchase.order'].search(extended_domain, limit=1)
+            if len(extended_domain) > 1:
+                extended_domain = ['|'] * (len(extended_domain) - 1) + extended_domain
 
-                if purchase_order:
-                    oc_message = f"PO coincidente encontrada con búsqueda extendida: {purchase_order.name}"
-                    _logger.info(oc_message)
-                    ticket.message_post(body=oc_message)
+            ext_search_msg = f"Realizando búsqueda extendida con variantes adicionales"
+            _logger.info(ext_search_msg)
+            self._parser_post(ticket, body=ext_search_msg)
 
-            if not purchase_order:
-                # Cambiado: Mover el ticket al estado "PO# Inexistente" en lugar de solo enviar un mensaje
-                ticket.write({
-                    'stage_id': po_inexistente_stage.id,
-                    'x_po_number': original_po  # Guardar el número de PO aunque no exista
-                })
-                ticket.message_post(
-                    body=f"Ticket movido a 'PO# Inexistente'<br/>"
-                         f"Se extrajo número de PO ({po_number}) del PDF, pero no existe en el sistema.<br/>"
-                         f"Formato original: {original_po}<br/>"
-                         f"Se buscaron las variaciones: {', '.join(search_variants)}<br/>"
-                         f"También se intentó con búsqueda extendida y búsqueda por números."
-                )
-                return (False, True, False)
+            purchase_order = self.env['purchase.order'].search(extended_domain, limit=1)
 
-            # Si llegamos aquí, hemos encontrado una PO válida
-            # Extraer datos restantes de la factura
-            invoice_data = self.extract_invoice_data(text_content, po_number)
+            if purchase_order:
+                oc_message = f"PO coincidente encontrada con búsqueda extendida: {purchase_order.name}"
+                _logger.info(oc_message)
+                self._parser_post(ticket, body=oc_message)
+
+        if not purchase_order:
+            self._parser_lap('busqueda_po')
+            # Cambiado: Mover el ticket al estado "PO# Inexistente" en lugar de solo enviar un mensaje
+            self._parser_write(ticket, {
+                'stage_id': po_inexistente_stage.id,
+                'x_po_number': original_po  # Guardar el número de PO aunque no exista
+            })
+            self._parser_post(
+                ticket,
+                body=f"Ticket movido a 'PO# Inexistente'<br/>"
+                     f"Se extrajo número de PO ({po_number}) del PDF, pero no existe en el sistema.<br/>"
+                     f"Formato original: {original_po}<br/>"
+                     f"Se buscaron las variaciones: {', '.join(search_variants)}<br/>"
+                     f"También se intentó con búsqueda extendida y búsqueda por números."
+            )
+            return (False, True, False)
 
-            # Crear factura en borrador
-            invoice = self.create_draft_invoice(ticket, invoice_data, purchase_order, attachment)
+        # Si llegamos aquí, hemos encontrado una PO válida
+        # Extraer datos restantes de la factura
+        invoice_data = extraction._get_invoice_data(po_number)
 
-            # Si la factura se creó exitosamente
-            if invoice:
-                return (True, False, True)
-            else:
-                # Si la factura no se pudo crear pero la PO existe
-                # NO debemos mover el ticket a "PDF sin PO#" porque sí encontramos la OC
-                ticket.message_post(
-                    body=f"Se encontró la PO {purchase_order.name} "
-                         f"pero no se pudo crear la factura. Por favor, revise los mensajes "
-                         f"anteriores para más detalles."
-                )
-                return (False, False, False)
+        # Crear factura en borrador
+        invoice = self.create_draft_invoice(ticket, invoice_data, purchase_order, attachment)
 
-        except Exception as e:
-            error_msg = f"Error al procesar el PDF adjunto {attachment.name}: {str(e)}"
-            _logger.error(error_msg)
-            ticket.message_post(body=error_msg)
+        # Si la factura se creó exitosamente
+        if invoice:
+            return (True, False, True)
+        else:
+            # Si la factura no se pudo crear pero la PO existe
+            # NO debemos mover el ticket a "PDF sin PO#" porque sí encontramos la OC
+            self._parser_post(
+                ticket,
+                body=f"Se encontró la PO {purchase_order.name} "
+                     f"pero no se pudo crear la factura. Por favor, revise los mensajes "
+                     f"anteriores para más detalles."
+            )
             return (False, False, False)
 
-    def extract_po_number(self, text_content):
+    def _process_invoice_segments(self, ticket, attachment, extraction, sin_po_stage, po_inexistente_stage):
         """
-        Extraer número de PO del contenido de texto usando múltiples patrones
-        :param text_content: Texto extraído del PDF
-        :return: Tupla (número de PO extraído o False, lista de todos los números encontrados)
+        Procesar un PDF que trae varias facturas: cada segmento pasa por la búsqueda de PO y la
+        creación de la factura, y todas las facturas quedan vinculadas al ticket (x_invoice_ids).
+        El PDF se considera procesado solo si todas sus facturas se crearon; si no, el ticket sigue
+        el circuito de un PDF sin resultado para revisión manual (las facturas creadas se conservan).
+        :param ticket: registro helpdesk.ticket
+        :param attachment: registro ir.attachment
+        :param extraction: registro bmi.invoice.extraction.result con segments
+        :param sin_po_stage: registro helpdesk.stage para 'PDF sin PO#'
+        :param po_inexistente_stage: registro helpdesk.stage para 'PO# Inexistente'
+        :return: Tupla (éxito, PO# inexistente, factura creada)
         """
-        # Lista de patrones principales para números de OC
-        primary_patterns = [
-            # Patrones directos para números de PO - estos tienen prioridad
-            r'(?<!\w)P([0-9]{4,})(?!\w)',  # P seguido de números (P03324)
-            r'(?<!\w)PO([0-9]{4,})(?!\w)',  # PO seguido de números (PO03324)
-            r'(?<!\w)OC([0-9]{4,})(?!\w)',  # PO seguido de números (OC03324)
-            r'(?<!\w)#P([0-9]{4,})(?!\w)',  # #P seguido de números (#P03324)
-            r'(?<!\w)#PO([0-9]{4,})(?!\w)',  # #PO seguido de números (#PO03324)
-        ]
-
-        # Patrones secundarios (se utilizan si los primarios no encuentran nada)
-        secondary_patterns = [
-            # Patrones con palabras clave que podrían ayudar a identificar OCs
-            r'(?:CORRESPONDE)[:\s]*(?:P|#P)?([0-9]{4,})',
-            r'(?:CORRESPONDE)[:\s]*([A-Z][0-9]{4,})',
-
-            # Patrones en inglés - asegurando que incluyan números
-            r'(?:P\.O\.|PO|Purchase Order)[:\s#]*([A-Z0-9]*[0-9]+[A-Z0-9]*)',
-            r'(?:P|#P|#PO)[:\s#]*([0-9]{4,})',
-
-            # Patrones en español (OC = Orden de Compra)
-            r'(?:OC|OC#|OCN|OCN#)[:\s#]*([A-Z0-9]*[0-9]+[A-Z0-9]*)',
-            r'(?:O\.C\.|O\.C\.#)[:\s#]*([A-Z0-9]*[0-9]+[A-Z0-9]*)',
+        run = self._parser_run()
+        dry_run = run is not None and run.dry_run
+        segments = extraction.segments
+        self._parser_post(
+            ticket,
+            body=f"El PDF {attachment.name} contiene {len(segments)} facturas (páginas: "
+                 f"{', '.join(self._format_pages(segment['pages']) for segment in segments)}); "
+                 f"se procesan por separado"
+        )
 
-            # Palabras clave adicionales que podrían preceder a un número de OC
-            r'(?:REFERENCIA|REF|REF\.|REFERENCIA:|REF:|REF\.:|NRO\.?)[:\s#]*([A-Z0-9]*[0-9]+[A-Z0-9]*)',
+        results = []
+        invoices = self.env['account.move']
+        excluded_before = set(run.excluded_invoice_ids) if run is not None else set()
+        for index, segment in enumerate(segments, 1):
+            self._parser_post(ticket, body=f"Factura {index}/{len(segments)} del PDF {attachment.name} "
+                                           f"(páginas {self._format_pages(segment['pages'])})")
+            segment_extraction = extraction.new({
+                'ticket_id': ticket.id,
+                'attachment_id': attachment.id,
+                'state': EXTRACTION_DONE,
+                'pedido_po': segment['pedido_po'],
+                'po_number': segment['po_number'],
+                'po_candidates': segment['po_candidates'],
+                'invoice_data': segment['invoice_data'],
+                'rule_errors': segment['rule_errors'],
+            })
+            result = self._process_extraction(ticket, attachment, segment_extraction, sin_po_stage,
+                                              po_inexistente_stage)
+            results.append(result)
+            # La factura vinculada todavía no se escribió en el ticket (ver _parser_write)
+            invoice = (self.env['account.move'].browse(run.changes.get(ticket.id, {}).get('x_invoice_id'))
+                       if run is not None else ticket.x_invoice_id)
+            if result[2] and not dry_run and invoice:
+                invoices |= invoice
+                # Las facturas del mismo PDF no cuentan como duplicadas entre sí
+                if run is not None:
+                    run.excluded_invoice_ids.add(invoice.id)
+        if run is not None:
+            run.excluded_invoice_ids = excluded_before
+
+        if invoices:
+            self._parser_write(ticket, {'x_invoice_ids': [(4, invoice.id) for invoice in invoices]})
+
+        created = sum(1 for result in results if result[2])
+        self._parser_post(ticket, body=f"PDF {attachment.name}: {created} de {len(segments)} facturas creadas o "
+                                       f"vinculadas")
+        if created == len(segments):
+            return (True, False, True)
+
+        # Alguna factura no se pudo procesar: si alguna PO no existe, el ticket queda en 'PO# Inexistente'
+        # aunque un segmento posterior lo haya movido a otra etapa
+        if any(result[1] for result in results):
+            self._parser_write(ticket, {'stage_id': po_inexistente_stage.id})
+            return (False, True, False)
+        return (False, False, False)
+
+    @api.model
+    def _format_pages(self, pages):
+        """
+        :param pages: Lista de números de página
+        :return: Texto '3' o '3-5'
+        """
+        return str(pages[0]) if len(pages) == 1 else f"{pages[0]}-{pages[-1]}"
 
-            # Buscar patrones con números cerca de palabras clave
-            r'(?:orden de compra|orden|purchase|compra|pedido)[^\n]*?([A-Z]*[0-9]{4,}[A-Z0-9-]*)',
+    def _evaluate_extraction_rules(self, text_content, afip_qr=None, budget=None):
+        """
+        Evaluar las reglas de extracción sobre el texto de un PDF.
+        No accede al PDF ni a la base de datos, por lo que se puede repetir sobre el texto
+        almacenado cada vez que cambian las reglas (ver RULESET_VERSION).
+        Si el PDF tiene el QR de AFIP, los datos de la factura se toman del QR y no se
+        evalúan las heurísticas de extract_invoice_data.
+        El texto se acota en tamaño y largo de línea y la evaluación tiene un tiempo máximo
+        (ver bound_rule_text y RuleBudget): si se agota, el documento queda sin número de PO
+        para revisión manual.
+        :param text_content: Texto extraído del PDF
+        :param afip_qr: Diccionario con el JSON del QR de AFIP, si se encontró
+        :param budget: Tiempo máximo compartido por todas las evaluaciones del mismo documento (el
+                       texto completo y cada factura de un PDF con varias); si se omite, uno nuevo
+        :return: Diccionario con la referencia 'Pedido de compra', el número de PO validado,
+                 todos los candidatos, los datos de la factura y los errores encontrados
+        """
+        errors = []
+        text_content, bounded = bound_rule_text(text_content)
+        if bounded:
+            _logger.info(f"Texto acotado para la evaluación de reglas ({len(text_content)} caracteres)")
+        if budget is None:
+            budget = RuleBudget()
+
+        # Patrón específico de "Pedido de compra", tiene prioridad sobre el resto
+        pedido_match = budget.search(PEDIDO_PATTERN, text_content, re.IGNORECASE)
+        pedido_po = pedido_match.group(1).strip() if pedido_match else False
+
+        # Extraer número de PO usando el método principal
+        try:
+            result = self.extract_po_number(text_content, budget=budget)
+            # Asegurarse de que result sea una tupla con el formato esperado
+            if isinstance(result, tuple) and len(result) >= 2:
+                po_number = result[0]
+                all_found_pos = result[1]
+            else:
+                po_number = result
+                all_found_pos = [po_number] if po_number else []
+        except Exception as e:
+            error_msg = f"Error al extraer número de PO: {str(e)}"
+            _logger.error(error_msg)
+            errors.append(error_msg)
+            po_number = False
+            all_found_pos = []
+
+        # VALIDACIÓN ADICIONAL: Verificar que el número de PO tiene un formato válido
+        # Una PO válida debe tener al menos 4 caracteres y contener un número de al menos 4 dígitos
+        if po_number:
+            # Extraer solo dígitos del número de PO
+            po_digits = ''.join(filter(str.isdigit, str(po_number)))
+            if len(po_digits) < 4 or len(str(po_number)) < 4:
+                _logger.info(f"Número de PO descartado por ser demasiado corto: {po_number} (dígitos: {po_digits})")
+                po_number = False
 
-            # Patrones específicos con "Pedido de compra"
-            r'pedido de compra[:\s#]*([A-Z]*[0-9]{4,}[A-Z0-9-]*)',
-            r'pedido de compra[^\n]*?#P([0-9]{4,})',
-            r'pedido de compra[^\n]*?#([0-9]{4,})',
-            r'pedido\s*de\s*compra[^\n]*?#P([0-9]{4,})',
+        if afip_qr:
+            invoice_data = afip_qr_invoice_data(afip_qr, pedido_po or po_number)
+            if invoice_data['total_amount'] is None:
+                # QR en moneda extranjera sin cotización: los importes se toman del texto
+                text_data = self.extract_invoice_data(text_content, pedido_po or po_number, budget=budget)
+                invoice_data.update({key: text_data[key] for key in ('total_amount', 'iva_amount', 'base_amount')})
+        else:
+            invoice_data = self.extract_invoice_data(text_content, pedido_po or po_number, budget=budget)
+
+        if budget.exceeded:
+            # Resultado incompleto: no se usa un número de PO que pudo haber quedado sin validar
+            error_msg = (f"La evaluación de reglas superó el tiempo máximo de {budget.seconds:g}s; "
+                         f"el PDF queda para revisión manual")
+            _logger.warning(error_msg)
+            errors.append(error_msg)
+            pedido_po = po_number = False
+            invoice_data['po_number'] = False
+
+        return {
+            'pedido_po': pedido_po,
+            'po_number': po_number,
+            'po_candidates': [str(p) for p in all_found_pos if p],
+            'invoice_data': invoice_data,
+            'errors': errors,
+        }
 
-        ]
+    def extract_po_number(self, text_content, budget=None):
+        """
+        Extraer número de PO del contenido de texto usando múltiples patrones
+        :param text_content: Texto extraído del PDF
+        :param budget: RuleBudget del documento; sin límite de tiempo si no se indica
+        :return: Tupla (número de PO extraído o False, lista de todos los números encontrados)
+        """
+        budget = budget or RuleBudget(seconds=None)
 
         # Lista de palabras comunes que no deben ser interpretadas como números de OC
         palabras_descartadas = [
@@ -514,8 +1323,8 @@ class InvoiceParser(models.Model):
 
         # Primera pasada: buscar patrones directos en todo el texto
         _logger.info(f"Buscando patrones directos de PO en el texto")
-        for pattern in primary_patterns:
-            matches = re.finditer(pattern, text_content, re.IGNORECASE)
+        for pattern in PO_PRIMARY_PATTERNS:
+            matches = budget.finditer(pattern, text_content, re.IGNORECASE)
             for match in matches:
                 # Para patrones primarios, capturamos la coincidencia completa si comienza con P, o le añadimos P
                 if match.group(0).upper().startswith(('P', '#P')):
@@ -545,8 +1354,8 @@ class InvoiceParser(models.Model):
 
         # Segunda pasada: buscar patrones secundarios
         _logger.info(f"Buscando patrones secundarios de PO en el texto")
-        for pattern in secondary_patterns:
-            matches = re.finditer(pattern, text_content, re.IGNORECASE)
+        for pattern in PO_SECONDARY_PATTERNS:
+            matches = budget.finditer(pattern, text_content, re.IGNORECASE)
             for match in matches:
                 po_number = match.group(1).strip()
 
@@ -585,8 +1394,7 @@ class InvoiceParser(models.Model):
 
         # Última pasada: buscar cualquier combinación P + números que parezca ser una OC
         _logger.info(f"Realizando búsqueda final de P + números en el texto")
-        generic_po_pattern = r'P[0-9]{4,}'
-        generic_matches = re.finditer(generic_po_pattern, text_content, re.IGNORECASE)
+        generic_matches = budget.finditer(PO_GENERIC_PATTERN, text_content, re.IGNORECASE)
         for generic_match in generic_matches:
             po_candidate = generic_match.group(0)
 
@@ -607,36 +1415,28 @@ class InvoiceParser(models.Model):
         _logger.info("No se encontró ningún número de PO válido en el texto")
         return False, all_po_numbers
 
-    def extract_invoice_data(self, text_content, po_number):
+    def extract_invoice_data(self, text_content, po_number, budget=None):
         """
         Extraer datos de factura del contenido de texto del PDF
         :param text_content: Texto extraído del PDF
         :param po_number: Número de PO extraído del PDF
+        :param budget: RuleBudget del documento; sin límite de tiempo si no se indica
         :return: Diccionario con datos de la factura
         """
+        budget = budget or RuleBudget(seconds=None)
+
         # Buscar CUIT (ID fiscal argentino)
-        cuit_pattern = r'(?:CUIT|cuit)[:\s]*(\d{2}-\d{8}-\d{1})'
-        cuit_match = re.search(cuit_pattern, text_content)
+        cuit_match = budget.search(CUIT_PATTERN, text_content)
         cuit = cuit_match.group(1) if cuit_match else ''
 
         # Buscar número de factura
-        invoice_number_pattern = r'(?:FACTURA|FACTURA\s+[ABC]|FACTURA\s+ELECTRONICA)[^0-9]*([0-9]{4,5}-[0-9]{8})'
-        invoice_number_match = re.search(invoice_number_pattern, text_content, re.IGNORECASE)
+        invoice_number_match = budget.search(INVOICE_NUMBER_PATTERN, text_content, re.IGNORECASE)
         invoice_number = invoice_number_match.group(1) if invoice_number_match else ''
 
         # Buscar fecha de factura (formatos comunes en Argentina)
-        # date_patterns = [
-        #     r'(?:FECHA|DATE)[^0-9]*(\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4})',
-        #     r'(\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4})'
-        # ]
-        date_patterns = [
-            r'(?:FECHA|DATE)[^\d]*(\d{2}[/-]\d{2}[/-]\d{4})',  # e.g., FECHA 15/03/2025
-            r'\b(\d{2}[/-]\d{2}[/-]\d{4})\b'  # standalone date
-        ]
-
         invoice_date = ''
-        for date_pattern in date_patterns:
-            date_match = re.search(date_pattern, text_content, re.IGNORECASE)
+        for date_pattern in DATE_PATTERNS:
+            date_match = budget.search(date_pattern, text_content, re.IGNORECASE)
             if date_match:
                 invoice_date = date_match.group(1)
                 break
@@ -657,8 +1457,7 @@ class InvoiceParser(models.Model):
             document_type = 'NOTA DE DEBITO C'
 
         # Buscar monto total
-        total_pattern = r'(?:Total|TOTAL)[:\s]*\$?\s*([\d.,]+)'
-        total_match = re.search(total_pattern, text_content)
+        total_match = budget.search(TOTAL_PATTERN, text_content)
         total_amount = 0.0
 
         if total_match:
@@ -673,8 +1472,7 @@ class InvoiceParser(models.Model):
                     total_amount = float(total_str)
 
         # Buscar monto de IVA
-        iva_pattern = r'(?:IVA|iva|I\.V\.A\.)[:\s]*\$?\s*([\d.,]+)'
-        iva_match = re.search(iva_pattern, text_content)
+        iva_match = budget.search(IVA_PATTERN, text_content)
         iva_amount = 0.0
 
         if iva_match:
@@ -704,7 +1502,8 @@ class InvoiceParser(models.Model):
             'document_type': document_type,
             'total_amount': total_amount,
             'iva_amount': iva_amount,
-            'base_amount': base_amount
+            'base_amount': base_amount,
+            'source': 'text',
         }
 
         return invoice_data
@@ -716,8 +1515,16 @@ class InvoiceParser(models.Model):
         :param invoice_data: Diccionario con datos de la factura
         :param purchase_order: registro purchase.order
         :param attachment: registro ir.attachment
-        :return: registro account.move o False
+        :return: registro account.move o False (en dry-run, True si se hubiera creado la factura)
         """
+        self._parser_lap('busqueda_po')
+        run = self._parser_run()
+        dry_run = run is not None and run.dry_run
+        if run is not None:
+            run.record_invoice_data(ticket.id, invoice_data)
+        # Facturas que no cuentan como duplicadas (en un replay, la creada por el propio ticket)
+        excluded_invoice_ids = list(run.excluded_invoice_ids) if run is not None else []
+
         try:
             # Verificar si la factura ya existe
             existing_invoice = False
@@ -731,16 +1538,19 @@ class InvoiceParser(models.Model):
                 # Get PO name without spaces
                 po_name_clean = purchase_order.name.replace(" ", "")
 
-                # Search broadly, then filter manually
-                possible_invoices = self.env['account.move'].search([
-                    ('move_type', '=', 'in_invoice'),
-                    ('state', '!=', 'cancel'),
-                ])
-
-                # Filter by cleaned ref
-                existing_po_invoices = possible_invoices.filtered(
-                    lambda inv: (inv.ref or '').replace(" ", "") == po_name_clean
-                )
+                # Comparar la referencia sin espacios en la base de datos: una consulta, en lugar de
+                # leer todas las facturas de proveedor
+                self.env['account.move'].flush_model(['move_type', 'state', 'ref'])
+                self.env.cr.execute("""
+                    SELECT id
+                      FROM account_move
+                     WHERE move_type = 'in_invoice'
+                       AND state != 'cancel'
+                       AND replace(ref, ' ', '') = %s
+                       AND NOT (id = ANY(%s))
+                  ORDER BY date DESC, name DESC, id DESC
+                """, [po_name_clean, excluded_invoice_ids])
+                existing_po_invoices = self.env['account.move'].browse([row[0] for row in self.env.cr.fetchall()])
 
                 if existing_po_invoices:
                     existing_invoice = existing_po_invoices[0]
@@ -750,32 +1560,41 @@ class InvoiceParser(models.Model):
                                                                   f" ({existing_invoice.partner_id.name}) no coincide "
                                                                   f"con el de la PO ({purchase_order.partner_id.name})")
 
-                    ticket.message_post(
+                    self._parser_post(
+                        ticket,
                         body=f"Se encontró una factura existente para la PO {invoice_data['po_number']}: "
                              f"{existing_invoice.name}{partner_warning}"
                     )
 
-            # Buscar por CUIT y monto total (criterio adicional)
+            # Buscar por comprobante (CUIT, tipo, punto de venta y número) o, si alguna de las facturas no
+            # tiene número, por CUIT y monto total con tolerancia de redondeo, en la tabla de huellas de
+            # facturas (una sola consulta indexada)
             if not existing_invoice and invoice_data.get('cuit') and invoice_data.get('total_amount'):
-                existing_amount_invoices = self.env['account.move'].search([
-                    ('move_type', '=', 'in_invoice'),
-                    ('partner_id.vat', '=', invoice_data['cuit']),
-                    ('amount_total', '=', float(invoice_data['total_amount'])),
-                    ('state', '!=', 'cancel')
-                ])
-
-                if existing_amount_invoices:
-                    existing_invoice = existing_amount_invoices[0]
+                existing_invoice, same_document = self.env['bmi.invoice.fingerprint']._find_duplicate(
+                    invoice_data['cuit'],
+                    invoice_data.get('document_type'),
+                    invoice_data.get('invoice_number'),
+                    invoice_data['total_amount'],
+                    excluded_invoice_ids,
+                )
+
+                if existing_invoice:
                     # Verificar si el proveedor coincide con el de la orden de compra
                     is_same_partner = existing_invoice.partner_id.id == purchase_order.partner_id.id
                     partner_warning = "" if is_same_partner else (f"\n⚠️ ATENCIÓN: El proveedor de la factura existente"
                                                                   f" ({existing_invoice.partner_id.name}) no coincide "
                                                                   f"con el de la PO ({purchase_order.partner_id.name})")
 
-                    ticket.message_post(
-                        body=f"Se encontró una factura existente del proveedor con CUIT {invoice_data['cuit']} y "
-                             f"monto {invoice_data['total_amount']}: {existing_invoice.name}{partner_warning}"
-                    )
+                    if same_document:
+                        body = (f"Se encontró una factura existente del proveedor con CUIT {invoice_data['cuit']} y "
+                                f"comprobante {invoice_data['document_type']} {invoice_data['invoice_number']}: "
+                                f"{existing_invoice.name}{partner_warning}")
+                    else:
+                        body = (f"Se encontró una factura existente del proveedor con CUIT {invoice_data['cuit']} y "
+                                f"monto {invoice_data['total_amount']}: {existing_invoice.name}{partner_warning}<br/>"
+                                f"Coincidencia solo por CUIT y monto: la factura del PDF o la existente no tiene "
+                                f"número de comprobante, por lo que no se pudo comparar el comprobante.")
+                    self._parser_post(ticket, body=body)
 
             # Si se encontró una factura existente, mover el ticket a "Facturas Duplicadas" y detener
             if existing_invoice:
@@ -786,7 +1605,7 @@ class InvoiceParser(models.Model):
                     # Guardar la información de la PO original para la referencia
                     po_partner_name = purchase_order.partner_id.name
 
-                    ticket.write({
+                    self._parser_write(ticket, {
                         'stage_id': stage_duplicated.id,
                         'x_invoice_id': existing_invoice.id  # Vincular la factura existente al ticket
                     })
@@ -803,7 +1622,8 @@ class InvoiceParser(models.Model):
                         po_warning = (f"\n⚠️ ATENCIÓN: La factura existente está vinculada a otra PO: "
                                       f"{existing_invoice.purchase_id.name}")
 
-                    ticket.message_post(
+                    self._parser_post(
+                        ticket,
                         body=f"""
                         ⚠️ FACTURA DUPLICADA DETECTADA ⚠️
                         No se creó una nueva factura porque ya existe:
@@ -817,12 +1637,18 @@ class InvoiceParser(models.Model):
                         """
                     )
 
+                    if run is not None:
+                        run.record_outcome(ticket.id, OUTCOME_DUPLICADA)
+                    self._parser_lap('duplicados')
                     return existing_invoice
                 else:
-                    ticket.message_post(
+                    self._parser_post(
+                        ticket,
                         body="No se encontró la etapa 'Facturas Duplicadas'. Por favor, cree esta etapa en el sistema."
                     )
 
+            self._parser_lap('duplicados')
+
             # Encontrar cuenta apropiada
             cuenta_contable = self.env['account.account'].search([('code', '=', '511100000')], limit=1)
             if not cuenta_contable:
@@ -836,12 +1662,11 @@ class InvoiceParser(models.Model):
 
             # Si el CUIT está disponible, verificar socio
             if invoice_data.get('cuit'):
-                cuit_partner = self.env['res.partner'].search([
-                    ('vat', '=', invoice_data['cuit'])
-                ], limit=1)
+                cuit_partner = self._get_partner_by_cuit(invoice_data['cuit'])
 
-                if cuit_partner and cuit_partner.id != partner.id:
-                    ticket.message_post(
+                if cuit_partner and cuit_partner != partner.commercial_partner_id:
+                    self._parser_post(
+                        ticket,
                         body=f"Advertencia: El CUIT en la factura ({invoice_data['cuit']}) pertenece a {cuit_partner.name}, pero la PO {invoice_data['po_number']} es para {partner.name}"
                     )
 
@@ -871,13 +1696,14 @@ class InvoiceParser(models.Model):
 
                     proyecto_msg = f"PO vinculada al Proyecto {cliente_nombre}/{proyecto_nombre}"
                     _logger.info(proyecto_msg)
-                    ticket.message_post(body=proyecto_msg)
+                    self._parser_post(ticket, body=proyecto_msg)
 
                     # Obtener la cuenta analítica del proyecto
                     if hasattr(proyecto, 'cta_analitica') and proyecto.cta_analitica:
                         proyecto_analytic_account = proyecto.cta_analitica
                         _logger.info(f"Cuenta analítica obtenida del proyecto: {proyecto_analytic_account.name}")
-                        ticket.message_post(
+                        self._parser_post(
+                            ticket,
                             body=f"Cuenta analítica obtenida del proyecto: {proyecto_analytic_account.name}")
 
                         # Asignar distribución analítica del proyecto
@@ -885,12 +1711,12 @@ class InvoiceParser(models.Model):
 
                         # Actualizar la orden de compra con esta distribución analítica
                         for line in purchase_order.order_line:
-                            if not line.analytic_distribution:
+                            if not line.analytic_distribution and not dry_run:
                                 line.write({'analytic_distribution': analytic_distribution})
 
                         log_msg = f"Se actualizó la distribución analítica en la OC: {analytic_distribution}"
                         _logger.info(log_msg)
-                        ticket.message_post(body=log_msg)
+                        self._parser_post(ticket, body=log_msg)
 
             # 2. Si no hay cuenta analítica del proyecto, verificar si ya existe en las líneas de OC
             if not analytic_distribution and purchase_order.order_line:
@@ -899,7 +1725,7 @@ class InvoiceParser(models.Model):
                         analytic_distribution = line.analytic_distribution
                         log_msg = f"Usando distribución analítica de la línea de OC: {analytic_distribution}"
                         _logger.info(log_msg)
-                        ticket.message_post(body=log_msg)
+                        self._parser_post(ticket, body=log_msg)
                         break
 
             # 3. Si aún no tenemos distribución analítica, crear una con la primera cuenta disponible
@@ -910,16 +1736,16 @@ class InvoiceParser(models.Model):
 
                     # Actualizar la orden de compra con esta distribución analítica
                     for line in purchase_order.order_line:
-                        if not line.analytic_distribution:
+                        if not line.analytic_distribution and not dry_run:
                             line.write({'analytic_distribution': analytic_distribution})
 
                     log_msg = f"Se asignó la cuenta analítica predeterminada a la OC: {default_analytic.name}"
                     _logger.info(log_msg)
-                    ticket.message_post(body=log_msg)
+                    self._parser_post(ticket, body=log_msg)
                 else:
                     error_msg = "Error: No se encontró ninguna cuenta analítica y es obligatoria."
                     _logger.error(error_msg)
-                    ticket.message_post(body=error_msg)
+                    self._parser_post(ticket, body=error_msg)
                     return False
 
             # Crear línea de factura con distribución analítica (siempre es obligatoria)
@@ -964,9 +1790,10 @@ class InvoiceParser(models.Model):
                     ], limit=1)
 
                     if document_type:
-                        ticket.message_post(body=f"Tipo de documento identificado: {document_type.name}")
+                        self._parser_post(ticket, body=f"Tipo de documento identificado: {document_type.name}")
                     else:
-                        ticket.message_post(
+                        self._parser_post(
+                            ticket,
                             body=f"No se pudo encontrar el tipo de documento para: {document_type_name}")
 
             # Determinar fecha de factura
@@ -975,9 +1802,10 @@ class InvoiceParser(models.Model):
                 try:
                     # Procesar fecha desde formato string a date
                     invoice_date = fields.Date.from_string(invoice_data['invoice_date'])
-                    ticket.message_post(body=f"Fecha de factura extraída del PDF: {invoice_date}")
+                    self._parser_post(ticket, body=f"Fecha de factura extraída del PDF: {invoice_date}")
                 except Exception as e:
-                    ticket.message_post(
+                    self._parser_post(
+                        ticket,
                         body=f"Error al procesar la fecha de factura: {str(e)}. Se usará la fecha actual.")
 
             # Procesar número de documento del formato 99999-99999999
@@ -995,7 +1823,7 @@ class InvoiceParser(models.Model):
                         punto_venta = cleaned_number[:5].zfill(5)
                         numero = cleaned_number[5:].zfill(8)
                         l10n_latam_document_number = f"{punto_venta}-{numero}"
-                        ticket.message_post(body=f"Número de factura formateado: {l10n_latam_document_number}")
+                        self._parser_post(ticket, body=f"Número de factura formateado: {l10n_latam_document_number}")
 
             # Crear valores de factura
             invoice_vals = {
@@ -1014,6 +1842,12 @@ class InvoiceParser(models.Model):
             if l10n_latam_document_number:
                 invoice_vals['l10n_latam_document_number'] = l10n_latam_document_number
 
+            # En dry-run solo se registra la factura que se habría creado
+            if dry_run:
+                run.record_invoice(ticket.id, invoice_vals)
+                self._parser_lap('factura')
+                return True
+
             # Crear factura
             invoice = self.env['account.move'].create(invoice_vals)
 
@@ -1033,14 +1867,14 @@ class InvoiceParser(models.Model):
                     )
 
                     _logger.info(f"PDF adjuntado a la factura: {attachment.name}")
-                    ticket.message_post(body=f"PDF adjuntado a la factura: {attachment.name}")
+                    self._parser_post(ticket, body=f"PDF adjuntado a la factura: {attachment.name}")
                 except Exception as e:
                     error_msg = f"Error al adjuntar PDF a la factura: {str(e)}"
                     _logger.warning(error_msg)
-                    ticket.message_post(body=error_msg)
+                    self._parser_post(ticket, body=error_msg)
 
             # Vincular factura al ticket
-            ticket.write({
+            self._parser_write(ticket, {
                 'x_invoice_id': invoice.id,
                 'x_po_number': invoice_data['po_number'],
                 'x_cuit': invoice_data['cuit'],
@@ -1049,7 +1883,8 @@ class InvoiceParser(models.Model):
             })
 
             # Registrar éxito en el chatter
-            ticket.message_post(
+            self._parser_post(
+                ticket,
                 body=f"""
                 Factura en borrador creada exitosamente:
                 - Número de factura: {invoice.name}
@@ -1061,49 +1896,56 @@ class InvoiceParser(models.Model):
                 """
             )
 
+            self._parser_lap('factura')
             return invoice
 
         except Exception as e:
             error_msg = f"Error al crear la factura: {str(e)}"
             _logger.error(error_msg)
-            ticket.message_post(body=error_msg)
+            self._parser_post(ticket, body=error_msg)
             return False
 
-    def convert_pdf_to_text(self, pdf_file):
+    def extract_afip_qr(self, pdf_file, text_content=''):
+        """
+        Obtener el JSON del QR de AFIP desde las anotaciones de enlace, el texto o la imagen del PDF
+        :param pdf_file: Objeto BytesIO con el contenido del PDF
+        :param text_content: Texto ya extraído del PDF
+        :return: Diccionario con el JSON del QR o None
+        """
+        return extract_afip_qr(pdf_file, text_content)
+
+    def convert_pdf_to_text(self, pdf_file, layout=True):
         """
-        Convertir archivo PDF a texto. Si OCR está disponible, lo usa como respaldo.
+        Convertir archivo PDF a texto. Un sondeo previo de la capa de texto envía cada página
+        directamente al motor de extracción configurado o a OCR (si está disponible).
         :param pdf_file: Objeto BytesIO con el contenido del PDF.
+        :param layout: Si es False, pdfminer no hace análisis de layout (primera pasada rápida).
         :return: Texto extraído.
         """
-        try:
-            pdf_file.seek(0)
-            output_string = StringIO()
-            laparams = LAParams()
-
-            with TextConverter(PDFResourceManager(), output_string, codec='utf-8', laparams=laparams) as converter:
-                interpreter = PDFPageInterpreter(converter.rsrcmgr, converter)
-                for page in PDFPage.get_pages(pdf_file, check_extractable=True):
-                    interpreter.process_page(page)
+        return self._convert_pdf_to_text_with_method(pdf_file, layout)[0]
 
-            text = output_string.getvalue().strip()
-
-            if text:
-                return text
-
-            raise ValueError("No se extrajo texto. Posible PDF escaneado o protegido.")
-
-        except Exception as e:
-            _logger.warning(f"Extracción directa falló: {e}")
+    def _convert_pdf_to_text_with_method(self, pdf_file, layout=True):
+        """
+        Igual que convert_pdf_to_text, indicando además cómo se obtuvo el texto
+        :return: Tupla (texto extraído, método: motor de extracción, 'mixed' u 'ocr')
+        """
+        return extract_pdf_text_with_method(pdf_file, self._get_text_engine(), layout)
 
-            if OCR_AVAILABLE:
-                try:
-                    pdf_file.seek(0)
-                    images = convert_from_bytes(pdf_file.read())
-                    text_ocr = ''.join([pytesseract.image_to_string(img) for img in images])
-                    return text_ocr.strip()
-                except Exception as ocr_error:
-                    _logger.error(f"OCR también falló: {ocr_error}")
-            else:
-                _logger.warning("OCR no disponible en este entorno. Skipping OCR.")
+    def _convert_pdf_to_text_with_probe(self, pdf_file, layout=True, page_kinds=None):
+        """
+        Igual que _convert_pdf_to_text_with_method, reutilizando y devolviendo el sondeo de la capa de texto
+        :param page_kinds: Sondeo de una pasada anterior sobre el mismo PDF; con None se sondea
+        :return: Tupla (texto extraído, método, clasificación de cada página o None si el sondeo falló)
+        """
+        return extract_pdf_text_with_probe(pdf_file, self._get_text_engine(), layout, page_kinds)
 
-            return ""
+    @api.model
+    def _get_text_engine(self):
+        """
+        Motor de extracción de texto configurado en el parámetro del sistema
+        'bmi_invoice_parser.text_engine' (pdfminer, pypdfium2 o pdftotext). Si falla en un
+        documento, se usa pdfminer.
+        :return: Nombre del motor
+        """
+        return self.env['ir.config_parameter'].sudo().get_param('bmi_invoice_parser.text_engine',
+                                                                 DEFAULT_TEXT_ENGINE)
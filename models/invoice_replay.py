@@ -0,0 +1,245 @@
+import os
+import time
+import logging
+from collections import Counter
+from odoo import models, api
+
+from .invoice_parser import OUTCOME_VINCULADA
+from .parser_run import ParserRun, PARSER_RUN_CONTEXT_KEY
+
+_logger = logging.getLogger(__name__)
+
+# Resultado de producción de los tickets que todavía no fueron procesados
+OUTCOME_PENDIENTE = 'pendiente'
+
+# Tickets por tanda: acota la memoria usada por los PDFs en vuelo
+REPLAY_CHUNK_SIZE = 200
+
+# Tolerancia al comparar montos
+AMOUNT_TOLERANCE = 0.01
+
+
+class InvoiceReplay(models.AbstractModel):
+    _name = 'bmi.invoice.replay'
+    _description = 'Replay en dry-run del procesamiento de facturas'
+
+    @api.model
+    def _search_tickets(self, ticket_ids=None, stage_names=None, date_from=None, date_to=None, limit=None):
+        """
+        Buscar los tickets históricos a reproducir
+        :param ticket_ids: Lista de IDs de tickets
+        :param stage_names: Lista de nombres de etapas
+        :param date_from: Fecha de creación mínima
+        :param date_to: Fecha de creación máxima
+        :param limit: Cantidad máxima de tickets
+        :return: conjunto de registros helpdesk.ticket
+        """
+        domain = []
+        if ticket_ids:
+            domain.append(('id', 'in', ticket_ids))
+        if stage_names:
+            domain.append(('stage_id.name', 'in', stage_names))
+        if date_from:
+            domain.append(('create_date', '>=', date_from))
+        if date_to:
+            domain.append(('create_date', '<=', date_to))
+        return self.env['helpdesk.ticket'].search(domain, order='id', limit=limit or None)
+
+    @api.model
+    def replay_tickets(self, tickets, workers=None):
+        """
+        Reproducir en dry-run la lógica de decisión sobre tickets históricos y compararla con lo
+        que se decidió en producción. No escribe tickets, no publica en el chatter ni crea facturas;
+        la extracción de los PDFs se reparte entre varios procesos.
+        :param tickets: conjunto de registros helpdesk.ticket
+        :param workers: Procesos para la extracción (por defecto, la cantidad de núcleos)
+        :return: Diccionario con el reporte (ver _build_report)
+        """
+        workers = workers or os.cpu_count() or 1
+        ticket_model = self.env['helpdesk.ticket']
+        stages = ticket_model._get_parser_stages()
+        engine = ticket_model._get_text_engine()
+        result_model = self.env['bmi.invoice.extraction.result']
+        run = ParserRun(dry_run=True)
+        replay_model = ticket_model.with_context(**{PARSER_RUN_CONTEXT_KEY: run})
+        rows = []
+        documents_count = 0
+        start = time.perf_counter()
+
+        for index in range(0, len(tickets), REPLAY_CHUNK_SIZE):
+            chunk = tickets[index:index + REPLAY_CHUNK_SIZE]
+            attachments = [attachment for ticket in chunk
+                           for attachment in ticket_model._get_ticket_pdf_attachments(ticket)]
+            documents = result_model._extract_documents([(a.id, a.raw) for a in attachments], workers, engine)
+            run.documents = documents
+            run.timings['extraccion'].extend(document['seconds'] for document in documents.values())
+            documents_count += len(documents)
+
+            for ticket in chunk:
+                production = self._get_production_decision(ticket, stages)
+                # La factura creada por el propio ticket no cuenta como duplicada
+                if production['outcome'] == OUTCOME_VINCULADA and ticket.x_invoice_id:
+                    run.excluded_invoice_ids = {ticket.x_invoice_id.id}
+                else:
+                    run.excluded_invoice_ids = set()
+                replay_model._procesar_ticket(ticket, stages)
+                rows.append(self._compare_decisions(ticket.id, ticket.name, production,
+                                                    self._get_replay_decision(run, ticket.id)))
+
+            _logger.info(f"Replay: {len(rows)}/{len(tickets)} tickets, {documents_count} PDFs, "
+                         f"{time.perf_counter() - start:.1f}s")
+
+        return self._build_report(rows, run, documents_count, time.perf_counter() - start)
+
+    @api.model
+    def replay_pdf_files(self, paths, workers=None):
+        """
+        Reproducir en dry-run la lógica de decisión sobre PDFs exportados (sin decisión de producción)
+        :param paths: Lista de rutas de archivos PDF
+        :param workers: Procesos para la extracción (por defecto, la cantidad de núcleos)
+        :return: Diccionario con el reporte (ver _build_report)
+        """
+        workers = workers or os.cpu_count() or 1
+        ticket_model = self.env['helpdesk.ticket']
+        stages = ticket_model._get_parser_stages()
+        engine = ticket_model._get_text_engine()
+        result_model = self.env['bmi.invoice.extraction.result']
+        run = ParserRun(dry_run=True)
+        replay_model = ticket_model.with_context(**{PARSER_RUN_CONTEXT_KEY: run})
+        rows = []
+        start = time.perf_counter()
+
+        for index in range(0, len(paths), REPLAY_CHUNK_SIZE):
+            chunk = paths[index:index + REPLAY_CHUNK_SIZE]
+            contents = []
+            for path in chunk:
+                with open(path, 'rb') as pdf:
+                    contents.append((path, pdf.read()))
+            extracted = result_model._extract_documents(contents, workers, engine)
+            run.timings['extraccion'].extend(document['seconds'] for document in extracted.values())
+
+            for path, content in contents:
+                # Ticket y adjunto en memoria: nada se guarda en la base de datos
+                name = os.path.basename(path)
+                ticket = ticket_model.new({'name': name})
+                attachment = self.env['ir.attachment'].new({
+                    'name': name,
+                    'mimetype': 'application/pdf',
+                    'raw': content,
+                })
+                run.documents = {attachment.id: extracted[path]}
+                run.begin_ticket()
+                outcome = replay_model._procesar_adjuntos(ticket, [attachment], stages)
+                run.record_outcome(ticket.id, outcome)
+                rows.append(self._compare_decisions(path, name, None, self._get_replay_decision(run, ticket.id)))
+
+        return self._build_report(rows, run, len(paths), time.perf_counter() - start)
+
+    @api.model
+    def _get_production_decision(self, ticket, stages):
+        """
+        Decisión tomada en producción, según la etapa y los campos del ticket
+        :param ticket: registro helpdesk.ticket
+        :param stages: Diccionario de etapas obtenido con _get_parser_stages
+        :return: Diccionario con el resultado, el número de PO, el CUIT y el monto total
+        """
+        outcome_by_stage = {stage.id: outcome for outcome, stage in stages.items() if stage}
+        return {
+            'outcome': outcome_by_stage.get(ticket.stage_id.id, OUTCOME_PENDIENTE),
+            'po_number': ticket.x_po_number or False,
+            'cuit': ticket.x_cuit or False,
+            'total_amount': ticket.x_total_amount or 0.0,
+        }
+
+    @api.model
+    def _get_replay_decision(self, run, ticket_id):
+        """
+        Decisión del replay, a partir de lo registrado en la ejecución dry-run
+        :param run: ParserRun del replay
+        :param ticket_id: ID del ticket (o ID en memoria)
+        :return: Diccionario con el resultado, el número de PO, el CUIT y el monto total
+        """
+        changes = run.changes.get(ticket_id, {})
+        invoice_data = run.invoice_data.get(ticket_id, {})
+        return {
+            'outcome': run.outcomes.get(ticket_id),
+            'po_number': changes.get('x_po_number') or invoice_data.get('po_number') or False,
+            'cuit': invoice_data.get('cuit') or False,
+            'total_amount': invoice_data.get('total_amount') or 0.0,
+        }
+
+    @api.model
+    def _compare_decisions(self, key, name, production, replay):
+        """
+        Comparar la decisión de producción con la del replay
+        :return: Diccionario con ambas decisiones y la lista de campos que difieren
+        """
+        differences = []
+        if production:
+            for field in ('outcome', 'po_number', 'cuit'):
+                if (production[field] or False) != (replay[field] or False):
+                    differences.append(field)
+            # Los montos solo se comparan cuando ambos lados tienen una factura
+            if production['total_amount'] and replay['total_amount'] and \
+                    abs(production['total_amount'] - replay['total_amount']) > AMOUNT_TOLERANCE:
+                differences.append('total_amount')
+        return {
+            'ticket': key,
+            'name': name,
+            'production': production,
+            'replay': replay,
+            'differences': differences,
+        }
+
+    @api.model
+    def _build_report(self, rows, run, documents_count, wall_seconds):
+        """
+        Construir el reporte del replay
+        :param rows: Comparaciones por ticket
+        :param run: ParserRun del replay
+        :param documents_count: Cantidad de PDFs procesados
+        :param wall_seconds: Duración total
+        :return: Diccionario con rendimiento, latencia por etapa, resultados y diferencias
+        """
+        transitions = Counter()
+        for row in rows:
+            if row['production']:
+                transitions[f"{row['production']['outcome']} -> {row['replay']['outcome']}"] += 1
+
+        return {
+            'tickets': len(rows),
+            'documents': documents_count,
+            'wall_seconds': round(wall_seconds, 3),
+            'tickets_per_minute': round(len(rows) * 60 / wall_seconds, 1) if wall_seconds else 0.0,
+            'documents_per_minute': round(documents_count * 60 / wall_seconds, 1) if wall_seconds else 0.0,
+            'latency': {stage: self._summarize_timings(values) for stage, values in run.timings.items()},
+            'outcomes': {
+                'production': dict(Counter(row['production']['outcome'] for row in rows if row['production'])),
+                'replay': dict(Counter(row['replay']['outcome'] for row in rows)),
+            },
+            'transitions': dict(transitions),
+            'layout_tiers': dict(run.layout_tiers),
+            'differences': [row for row in rows if row['differences']],
+        }
+
+    @api.model
+    def _summarize_timings(self, values):
+        """
+        Resumen de latencias en milisegundos
+        :param values: Lista de duraciones en segundos
+        :return: Diccionario con cantidad, p50, p95, máximo y total
+        """
+        values = sorted(values)
+        if not values:
+            return {'count': 0}
+
+        def percentile(fraction):
+            return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 1)
+
+        return {
+            'count': len(values),
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'max_ms': round(values[-1] * 1000, 1),
+            'total_s': round(sum(values), 3),
+        }
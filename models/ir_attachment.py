@@ -0,0 +1,42 @@
+from odoo import models, fields
+
+from ..extraction import estimate_pdf_cost, estimate_pages_cost
+
+
+class IrAttachment(models.Model):
+    _inherit = 'ir.attachment'
+
+    x_parser_cost = fields.Float(string='Costo estimado de extracción (s)', copy=False,
+                                 help='Estimado una sola vez a partir del tamaño, las páginas y la capa de texto '
+                                      'del PDF (ver estimate_pdf_cost); 0 si todavía no se estimó')
+
+    def write(self, vals):
+        # Un contenido nuevo invalida la estimación; se vuelve a estimar cuando se necesite
+        if 'raw' in vals or 'datas' in vals:
+            vals = dict(vals, x_parser_cost=0)
+        return super().write(vals)
+
+    def _get_parser_cost(self):
+        """
+        Costo estimado de extraer los PDFs, calculado una sola vez desde el cron (ver
+        helpdesk.ticket._estimate_parser_costs) y guardado en cada adjunto.
+        Si el PDF ya tiene un resultado de extracción con el sondeo de la capa de texto, se estima
+        con ese sondeo y el tamaño del adjunto, sin leer el contenido.
+        :return: Suma de los costos estimados en segundos
+        """
+        missing = self.filtered(lambda a: not a.x_parser_cost)
+        if missing:
+            results = self.env['bmi.invoice.extraction.result'].sudo().search([
+                ('attachment_id', 'in', missing.ids),
+            ])
+            probes = {
+                result.attachment_id.id: result.page_kinds for result in results
+                if result.page_kinds and result.checksum == result.attachment_id.checksum
+            }
+            for attachment in missing:
+                if attachment.id in probes:
+                    cost = estimate_pages_cost(attachment.file_size, probes[attachment.id])
+                else:
+                    cost = estimate_pdf_cost(attachment.raw or b'')
+                attachment.sudo().x_parser_cost = cost
+        return sum(self.mapped('x_parser_cost'))
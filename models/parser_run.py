@@ -0,0 +1,114 @@
+import time
+from collections import defaultdict, Counter
+
+# Clave de contexto con la ejecución en curso
+PARSER_RUN_CONTEXT_KEY = 'bmi_parser_run'
+
+
+class ParserRun:
+    """
+    Estado de una ejecución del procesamiento de facturas.
+
+    Se propaga por contexto (PARSER_RUN_CONTEXT_KEY) a process_invoice_pdf y create_draft_invoice.
+    Registra, por ticket, las escrituras, los mensajes del chatter, el resultado, los datos de factura
+    y la latencia de cada etapa. Las escrituras y los mensajes de un ticket se acumulan y se aplican
+    juntos al terminar (ver helpdesk.ticket._apply_parser_changes); en modo dry-run las escrituras,
+    los mensajes y las facturas solo se registran, sin aplicarse.
+    """
+
+    def __init__(self, dry_run=False, documents=None, partners_by_cuit=None):
+        """
+        :param dry_run: Si es True no se escriben tickets, no se publica en el chatter ni se crean facturas
+        :param documents: Diccionario {ID de adjunto: {'text_content', 'afip_qr'}} con PDFs ya extraídos
+        :param partners_by_cuit: Caché {CUIT normalizado: ID de proveedor} compartida entre ejecuciones
+                                 (por ejemplo, todos los tickets de una pasada del cron)
+        """
+        self.dry_run = dry_run
+        self.documents = documents or {}
+        self.changes = defaultdict(dict)
+        self.messages = defaultdict(list)
+        self.outcomes = {}
+        self.invoice_data = {}
+        self.invoices = {}
+        self.timings = defaultdict(list)
+        self.excluded_invoice_ids = set()
+        self.extraction_failures = defaultdict(list)
+        self.lease_tokens = {}
+        self.layout_tiers = Counter()
+        self.partners_by_cuit = partners_by_cuit if partners_by_cuit is not None else {}
+        self._lap_start = None
+
+    def get_document(self, attachment_id):
+        """
+        :return: Diccionario con el texto y el QR de AFIP ya extraídos del adjunto, o None
+        """
+        return self.documents.get(attachment_id)
+
+    def record_write(self, ticket_id, vals):
+        """
+        Acumular valores a escribir en un ticket: los valores posteriores reemplazan a los anteriores,
+        salvo los comandos de campos x2many, que se suman
+        """
+        changes = self.changes[ticket_id]
+        for field, value in vals.items():
+            if isinstance(value, list) and isinstance(changes.get(field), list):
+                changes[field] = changes[field] + value
+            else:
+                changes[field] = value
+
+    def record_lease(self, ticket_id, token):
+        """
+        Registrar la reserva con la que se postergaron los cambios de un ticket, para aplicarlos
+        solo si el ticket sigue reservado con ella (ver helpdesk.ticket._apply_pending_changes)
+        """
+        self.lease_tokens[ticket_id] = token
+
+    def discard_ticket(self, ticket_id):
+        """
+        Descartar las escrituras y los mensajes acumulados de un ticket
+        """
+        self.changes.pop(ticket_id, None)
+        self.messages.pop(ticket_id, None)
+        self.lease_tokens.pop(ticket_id, None)
+
+    def record_message(self, ticket_id, body):
+        self.messages[ticket_id].append(body)
+
+    def record_outcome(self, ticket_id, outcome):
+        self.outcomes[ticket_id] = outcome
+
+    def record_invoice_data(self, ticket_id, invoice_data):
+        self.invoice_data[ticket_id] = invoice_data
+
+    def record_invoice(self, ticket_id, invoice_vals):
+        self.invoices[ticket_id] = invoice_vals
+
+    def record_extraction_failure(self, ticket_id, state, next_attempt_date):
+        """
+        Registrar un PDF del ticket que no se pudo leer
+        :param state: Estado del resultado de extracción ('failed' o 'quarantined')
+        :param next_attempt_date: Fecha del próximo intento, o False si está en cuarentena
+        """
+        self.extraction_failures[ticket_id].append((state, next_attempt_date))
+
+    def record_layout_tier(self, tier):
+        """
+        Contar el nivel de extracción (pasada rápida o con layout) que resolvió un PDF
+        """
+        self.layout_tiers[tier] += 1
+
+    def begin_ticket(self):
+        """
+        Reiniciar el reloj de etapas al comenzar un ticket
+        """
+        self._lap_start = time.perf_counter()
+
+    def lap(self, stage):
+        """
+        Registrar el tiempo transcurrido desde la etapa anterior bajo el nombre indicado
+        :param stage: Nombre de la etapa que termina
+        """
+        now = time.perf_counter()
+        if self._lap_start is not None:
+            self.timings[stage].append(now - self._lap_start)
+        self._lap_start = now
@@ -0,0 +1,33 @@
+from odoo import models, fields, api
+
+from ..extraction import normalize_cuit
+
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+
+    x_cuit_key = fields.Char(
+        string='CUIT normalizado',
+        compute='_compute_x_cuit_key',
+        store=True,
+        index=True,
+        help='CUIT del contacto solo con dígitos, para buscar proveedores sin depender del formato del campo NIF',
+    )
+
+    @api.depends('vat')
+    def _compute_x_cuit_key(self):
+        for partner in self:
+            partner.x_cuit_key = normalize_cuit(partner.vat) or False
+
+    def write(self, vals):
+        cuit_keys = {partner.id: partner.x_cuit_key for partner in self} if 'vat' in vals else {}
+        result = super().write(vals)
+        changed = self.filtered(lambda p: p.id in cuit_keys and p.x_cuit_key != cuit_keys[p.id])
+        if changed:
+            # La huella de las facturas de proveedor usa el CUIT de la entidad comercial
+            moves = self.env['account.move'].sudo().search([
+                ('move_type', '=', 'in_invoice'),
+                ('commercial_partner_id', 'in', changed.ids),
+            ])
+            self.env['bmi.invoice.fingerprint'].sudo()._sync_moves(moves)
+        return result
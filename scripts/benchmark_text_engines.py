@@ -0,0 +1,105 @@
+"""
+Comparar los motores de extracción de texto sobre un directorio de PDFs.
+
+Para cada motor instalado mide el tiempo por documento (mediana, p95 y máximo), los documentos
+en los que falla o no obtiene texto y en cuántos aparece un número de PO (P/PO/#P seguido de al
+menos 4 dígitos), como aproximación a si el texto sirve para las reglas de extracción.
+El motor se elige con el parámetro del sistema 'bmi_invoice_parser.text_engine'.
+
+Uso:
+    python scripts/benchmark_text_engines.py /ruta/a/pdfs [--repeat 3] [--engines pdfminer,pypdfium2]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import TEXT_ENGINES, DEFAULT_TEXT_ENGINE, backend_available  # noqa: E402
+
+PO_PATTERN = re.compile(r'(?:#\s*P|\bPO|\bP)\s*-?\s*\d{4,}', re.IGNORECASE)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def benchmark_engine(engine, documents, repeat):
+    extract = TEXT_ENGINES[engine]
+    timings, failures, empty, po_found = [], 0, 0, 0
+    for content in documents.values():
+        best = None
+        text = ''
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                text = extract(BytesIO(content))
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        except Exception:
+            failures += 1
+            continue
+        timings.append(best)
+        if not text:
+            empty += 1
+        elif PO_PATTERN.search(text):
+            po_found += 1
+    return {
+        'documents': len(documents),
+        'failures': failures,
+        'empty': empty,
+        'po_found': po_found,
+        'p50_ms': percentile(timings, 0.50) * 1000 if timings else None,
+        'p95_ms': percentile(timings, 0.95) * 1000 if timings else None,
+        'max_ms': max(timings) * 1000 if timings else None,
+        'total_s': sum(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdf_dir', help="Directorio con PDFs de facturas")
+    parser.add_argument('--repeat', type=int, default=3, help="Extracciones por documento (se toma la mejor)")
+    parser.add_argument('--engines', default=','.join(TEXT_ENGINES), help="Motores a comparar, separados por coma")
+    args = parser.parse_args()
+
+    documents = {}
+    for name in sorted(os.listdir(args.pdf_dir)):
+        if name.lower().endswith('.pdf'):
+            with open(os.path.join(args.pdf_dir, name), 'rb') as pdf:
+                documents[name] = pdf.read()
+    if not documents:
+        parser.error(f"No hay PDFs en {args.pdf_dir}")
+
+    print(f"{len(documents)} PDFs, {args.repeat} repeticiones por documento\n")
+    print(f"{'Motor':<10} {'p50 (ms)':>9} {'p95 (ms)':>9} {'máx (ms)':>9} {'total (s)':>10} "
+          f"{'fallos':>7} {'vacíos':>7} {'con PO':>7}")
+    results = {}
+    for engine in [e.strip() for e in args.engines.split(',') if e.strip()]:
+        if engine not in TEXT_ENGINES:
+            print(f"{engine:<10} motor desconocido")
+            continue
+        # Cada motor se registra como backend con su mismo nombre
+        if not backend_available(engine):
+            print(f"{engine:<10} no instalado")
+            continue
+        result = results[engine] = benchmark_engine(engine, documents, args.repeat)
+        print(f"{engine:<10} {result['p50_ms'] or 0:>9.1f} {result['p95_ms'] or 0:>9.1f} {result['max_ms'] or 0:>9.1f} "
+              f"{result['total_s']:>10.2f} {result['failures']:>7} {result['empty']:>7} {result['po_found']:>7}")
+
+    default = results.get(DEFAULT_TEXT_ENGINE)
+    if default:
+        print(f"\nMotor por defecto: {DEFAULT_TEXT_ENGINE}")
+        for engine, result in results.items():
+            if engine == DEFAULT_TEXT_ENGINE or not result['total_s']:
+                continue
+            print(f"  {engine}: tiempo total {result['total_s'] / default['total_s']:.2f}x el de {DEFAULT_TEXT_ENGINE}, "
+                  f"PO encontrada en {result['po_found']} vs {default['po_found']} documentos")
+
+
+if __name__ == '__main__':
+    main()
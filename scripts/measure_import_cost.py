@@ -0,0 +1,96 @@
+"""
+Medir el costo de importación (tiempo y memoria residente) de los backends de extracción.
+
+Cada escenario se mide en un proceso nuevo, como un worker de Odoo recién creado en un despliegue
+prefork. La diferencia entre 'lazy' (lo que paga cualquier worker al cargar el módulo) y 'eager'
+(todos los backends importados, como cuando los imports estaban a nivel de módulo) es lo que
+ahorra cada worker que nunca procesa un PDF.
+
+Uso:
+    python scripts/measure_import_cost.py [--workers 8] [--repeat 5]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+MODULE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'baseline': None,
+    'lazy': [],
+    'pdfminer': ['pdfminer'],
+    'ocr': ['ocr'],
+    'qr_image': ['qr_image'],
+    'eager': ['pdfminer', 'ocr', 'qr_image'],
+}
+
+CHILD_CODE = """
+import json, sys, time, resource
+def rss_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+sys.path.insert(0, {module_dir!r})
+backends = {backends!r}
+rss_before = rss_kb()
+start = time.perf_counter()
+if backends is not None:
+    import extraction
+    for name in backends:
+        if not extraction.backend_available(name):
+            print(json.dumps({{'error': name + ' no instalado'}}))
+            sys.exit(0)
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'rss_kb': rss_kb(), 'delta_kb': rss_kb() - rss_before}}))
+"""
+
+
+def measure(backends):
+    code = CHILD_CODE.format(module_dir=MODULE_DIR, backends=backends)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Workers de Odoo para estimar el ahorro total")
+    parser.add_argument('--repeat', type=int, default=5, help="Mediciones por escenario (se toma la mediana)")
+    args = parser.parse_args()
+
+    results = {}
+    for name, backends in SCENARIOS.items():
+        samples = [measure(backends) for _ in range(args.repeat)]
+        errors = [sample['error'] for sample in samples if 'error' in sample]
+        if errors:
+            results[name] = {'error': errors[0]}
+            continue
+        samples.sort(key=lambda sample: sample['seconds'])
+        median = samples[len(samples) // 2]
+        results[name] = median
+
+    print(f"{'Escenario':<10} {'Import (ms)':>12} {'RSS (MB)':>10} {'Delta RSS (MB)':>15}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<10} {result['error']:>39}")
+            continue
+        print(f"{name:<10} {result['seconds'] * 1000:>12.1f} {result['rss_kb'] / 1024:>10.1f} "
+              f"{result['delta_kb'] / 1024:>15.1f}")
+
+    lazy, eager = results.get('lazy', {}), results.get('eager', {})
+    if 'seconds' in lazy and 'seconds' in eager:
+        saved_ms = (eager['seconds'] - lazy['seconds']) * 1000
+        saved_mb = (eager['rss_kb'] - lazy['rss_kb']) / 1024
+        print(f"\nAhorro por worker que no procesa PDFs: {saved_ms:.1f} ms de importación, {saved_mb:.1f} MB de RSS")
+        print(f"Con {args.workers} workers: {saved_mb * args.workers:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
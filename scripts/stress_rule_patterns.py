@@ -0,0 +1,120 @@
+"""
+Medir el peor caso de cada patrón de las reglas de extracción sobre textos adversos.
+
+Genera textos de una sola línea muy larga (como los que puede producir el OCR de una tabla o de
+una página sin saltos) que repiten palabras clave de los patrones sin el número que esperan, de
+modo que las búsquedas perezosas ([^\\n]*?) y las alternativas recorran la línea completa desde
+cada coincidencia parcial. Para cada patrón informa el tiempo del peor texto, sobre el texto tal
+cual y sobre el texto acotado con bound_rule_text (que es lo que evalúan las reglas), y el tiempo
+de todos los patrones juntos frente a RULE_TIME_BUDGET_SECONDS.
+Sin acotar, el tiempo de los peores patrones crece con el cuadrado del largo: con más de 20000
+caracteres la medición puede demorar varios minutos.
+
+Uso:
+    python scripts/stress_rule_patterns.py [--lengths 5000,20000] [--patterns po_secondary_7,pedido]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import bound_rule_text, RULE_PATTERNS, RULE_TIME_BUDGET_SECONDS  # noqa: E402
+
+# Fragmentos que se repiten hasta el largo pedido, sin saltos de línea
+ADVERSARIAL_FRAGMENTS = {
+    'orden': 'orden ',
+    'pedido_de_compra': 'pedido de compra ',
+    'compra_purchase': 'compra purchase ',
+    'factura': 'FACTURA ',
+    'fecha': 'FECHA ',
+    'ref': 'REF ',
+    'oc': 'OC# ',
+    'corresponde': 'CORRESPONDE ',
+    'cuit': 'CUIT ',
+    'total_iva': 'Total IVA $ ',
+    'hash_p': '#P ',
+    'digitos_cortos': 'P123 ',
+    'digitos': '1',
+    'espacios': ' ',
+}
+
+
+def adversarial_inputs(length):
+    """
+    :param length: Largo de cada texto
+    :return: Diccionario {nombre: texto}
+    """
+    inputs = {}
+    for name, fragment in ADVERSARIAL_FRAGMENTS.items():
+        inputs[name] = (fragment * (length // len(fragment) + 1))[:length]
+    # Palabra clave al comienzo y la línea sin dígitos hasta el final
+    inputs['clave_y_relleno'] = ('orden de compra ' + 'x' * length)[:length]
+    return inputs
+
+
+def run_pattern(pattern, flags, text):
+    """
+    Recorrer todas las coincidencias, como hacen las reglas en el peor caso
+    :return: Segundos
+    """
+    start = time.perf_counter()
+    for _match in re.finditer(pattern, text, flags):
+        pass
+    return time.perf_counter() - start
+
+
+def stress(patterns, inputs):
+    """
+    :return: Diccionario {nombre de patrón: (peor tiempo, nombre del texto)}
+    """
+    worst = {}
+    for name, pattern, flags in patterns:
+        for input_name, text in inputs.items():
+            elapsed = run_pattern(pattern, flags, text)
+            if name not in worst or elapsed > worst[name][0]:
+                worst[name] = (elapsed, input_name)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lengths', default='5000,20000', help="Largos de texto, separados por coma")
+    parser.add_argument('--patterns', default='', help="Nombres de patrones a medir, separados por coma (todos si "
+                                                       "se omite)")
+    args = parser.parse_args()
+
+    selected = {p.strip() for p in args.patterns.split(',') if p.strip()}
+    patterns = [item for item in RULE_PATTERNS if not selected or item[0] in selected]
+    if not patterns:
+        parser.error(f"Patrones desconocidos: {', '.join(sorted(selected))}. "
+                     f"Disponibles: {', '.join(name for name, _pattern, _flags in RULE_PATTERNS)}")
+
+    for length in [int(value) for value in args.lengths.split(',') if value.strip()]:
+        inputs = adversarial_inputs(length)
+        bounded_inputs = {name: bound_rule_text(text)[0] for name, text in inputs.items()}
+        raw = stress(patterns, inputs)
+        bounded = stress(patterns, bounded_inputs)
+
+        print(f"\nTexto de {length} caracteres en una línea ({len(inputs)} textos adversos)")
+        print(f"{'Patrón':<16} {'sin acotar (ms)':>16} {'peor texto':<18} {'acotado (ms)':>13} {'peor texto':<18}")
+        for name, _pattern, _flags in sorted(patterns, key=lambda item: -raw[item[0]][0]):
+            print(f"{name:<16} {raw[name][0] * 1000:>16.1f} {raw[name][1]:<18} "
+                  f"{bounded[name][0] * 1000:>13.1f} {bounded[name][1]:<18}")
+
+        # Peor documento para el conjunto de reglas: todos los patrones sobre el mismo texto
+        totals = {}
+        for input_name in inputs:
+            totals[input_name] = (
+                sum(run_pattern(pattern, flags, inputs[input_name]) for _name, pattern, flags in patterns),
+                sum(run_pattern(pattern, flags, bounded_inputs[input_name]) for _name, pattern, flags in patterns),
+            )
+        input_name, (raw_total, bounded_total) = max(totals.items(), key=lambda item: item[1][0])
+        print(f"Peor documento ({input_name}): {raw_total:.2f}s sin acotar, {bounded_total:.2f}s acotado "
+              f"(tiempo máximo de las reglas: {RULE_TIME_BUDGET_SECONDS:g}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,36 @@ odoo.define('bmi_invoice_parser.helpdesk_kanban', function (require) {
     const viewRegistry = require('web.view_registry');
     const core = require('web.core');
     const _t = core._t;
-    const ajax = require('web.ajax');
-    const session = require('web.session');
+
+    // Tipo de notificación del bus enviada por bmi.invoice.batch
+    const BATCH_NOTIFICATION_TYPE = 'bmi_invoice_parser/batch_progress';
 
     const HelpdeskKanbanController = KanbanController.extend({
+        /**
+         * @override
+         */
+        init: function () {
+            this._super.apply(this, arguments);
+            this.batchId = false;
+            this._onBusNotification = this._onBusNotification.bind(this);
+        },
+
+        /**
+         * @override
+         */
+        start: function () {
+            this.call('bus_service', 'addEventListener', 'notification', this._onBusNotification);
+            return this._super.apply(this, arguments);
+        },
+
+        /**
+         * @override
+         */
+        destroy: function () {
+            this.call('bus_service', 'removeEventListener', 'notification', this._onBusNotification);
+            this._super.apply(this, arguments);
+        },
+
         /**
          * @override
          */
@@ -17,87 +43,100 @@ odoo.define('bmi_invoice_parser.helpdesk_kanban', function (require) {
             this._super.apply(this, arguments);
             if (this.$buttons) {
                 this.$processButton = $('<button/>', {
-                    text: _t('Procesar Primeros 10'),
+                    text: _t('Procesar Facturas Nuevas'),
                     class: 'btn btn-primary o_process_tickets_button',
                 });
-                this.$processButton.on('click', this._onProcessFirstTickets.bind(this));
+                this.$processButton.on('click', this._onProcessTickets.bind(this));
                 this.$buttons.append(this.$processButton);
             }
         },
 
         /**
-         * Handler when clicking on 'Process First Tickets' button
+         * Restaurar el botón de procesamiento
+         * @private
+         */
+        _resetProcessButton: function () {
+            this.batchId = false;
+            this.$processButton.text(_t('Procesar Facturas Nuevas'));
+            this.$processButton.removeAttr('disabled');
+        },
+
+        /**
+         * Handler when clicking on 'Procesar Facturas Nuevas' button.
+         * Encola un lote en segundo plano; el avance llega por el bus.
          * @private
          */
-        _onProcessFirstTickets: function () {
+        _onProcessTickets: function () {
             const self = this;
             // Show loading indicator
-            this.$processButton.text(_t('Procesando...'));
+            this.$processButton.text(_t('Encolando...'));
             this.$processButton.attr('disabled', 'disabled');
 
-            // Get the first 10 tickets with status "Facturas nuevas"
             this._rpc({
-                model: 'helpdesk.stage',
-                method: 'search',
-                args: [[['name', '=', 'Facturas nuevas']]],
-                limit: 1,
-            }).then(function(stageIds) {
-                if (!stageIds || stageIds.length === 0) {
-                    self.displayNotification({
-                        title: _t('Error'),
-                        message: _t('No se encontró la etapa "Facturas nuevas"'),
-                        type: 'danger',
-                    });
-                    self.$processButton.text(_t('Procesar Primeros 10'));
-                    self.$processButton.removeAttr('disabled');
-                    return;
-                }
-
-                // Get tickets with that stage
-                return self._rpc({
-                    model: 'helpdesk.ticket',
-                    method: 'search',
-                    args: [[['stage_id', '=', stageIds[0]]]],
-                    limit: 10,
-                });
-            }).then(function(ticketIds) {
-                if (!ticketIds || ticketIds.length === 0) {
+                model: 'helpdesk.ticket',
+                method: 'action_enqueue_procesar_facturas',
+                args: [],
+            }).then(function (result) {
+                if (!result.batch_id) {
                     self.displayNotification({
                         title: _t('Información'),
-                        message: _t('No hay tickets con estado "Facturas nuevas" para procesar'),
+                        message: _t('No hay tickets con estado "Facturas Nuevas" para procesar'),
                         type: 'info',
                     });
-                    self.$processButton.text(_t('Procesar Primeros 10'));
-                    self.$processButton.removeAttr('disabled');
+                    self._resetProcessButton();
                     return;
                 }
-
-                // Process those tickets
-                return self._rpc({
-                    model: 'helpdesk.ticket',
-                    method: 'procesar_facturas',
-                    args: [ticketIds],
-                }).then(function() {
-                    self.displayNotification({
-                        title: _t('Éxito'),
-                        message: _t('Se procesaron ' + ticketIds.length + ' tickets correctamente'),
-                        type: 'success',
-                    });
-                    // Reload the view
-                    self.reload();
+                self.batchId = result.batch_id;
+                self.$processButton.text(_.str.sprintf(_t('Procesando 0/%s...'), result.total));
+                self.displayNotification({
+                    title: _t('Procesamiento encolado'),
+                    message: _.str.sprintf(_t('Se encolaron %s tickets para procesar en segundo plano'), result.total),
+                    type: 'info',
                 });
-            }).catch(function(error) {
-                console.error("Error processing tickets:", error);
+            }).catch(function (error) {
+                console.error("Error enqueuing tickets:", error);
                 self.displayNotification({
                     title: _t('Error'),
-                    message: _t('Ocurrió un error al procesar los tickets'),
+                    message: _t('Ocurrió un error al encolar los tickets'),
                     type: 'danger',
                 });
-            }).finally(function() {
-                self.$processButton.text(_t('Procesar Primeros 10'));
-                self.$processButton.removeAttr('disabled');
+                self._resetProcessButton();
             });
-        }
+        },
+
+        /**
+         * Avance del lote recibido por el bus
+         * @private
+         * @param {CustomEvent} ev
+         */
+        _onBusNotification: function (ev) {
+            for (const notification of ev.detail) {
+                if (notification.type !== BATCH_NOTIFICATION_TYPE) {
+                    continue;
+                }
+                const payload = notification.payload;
+                if (!this.batchId || payload.batch_id !== this.batchId) {
+                    continue;
+                }
+                if (payload.state !== 'done') {
+                    this.$processButton.text(
+                        _.str.sprintf(_t('Procesando %s/%s...'), payload.processed, payload.total)
+                    );
+                    continue;
+                }
+                const summary = _.map(payload.summary || {}, function (count, label) {
+                    return label + ': ' + count;
+                }).join(', ');
+                this.displayNotification({
+                    title: _t('Éxito'),
+                    message: _.str.sprintf(_t('Se procesaron %s tickets. %s'), payload.processed, summary),
+                    type: 'success',
+                });
+                this._resetProcessButton();
+                // Reload the view
+                this.reload();
+            }
+        },
     });
 
     const HelpdeskKanbanView = KanbanView.extend({
@@ -108,4 +147,5 @@ odoo.define('bmi_invoice_parser.helpdesk_kanban', function (require) {
 
     viewRegistry.add('helpdesk_kanban_bmi', HelpdeskKanbanView);
 
-    return HelpdeskKanbanView;
\ No newline at end of file
+    return HelpdeskKanbanView;
+});
@@ -0,0 +1,5 @@
+from . import test_query_budgets
+from . import test_afip_qr
+from . import test_probe
+from . import test_segments
+from . import test_rule_budget
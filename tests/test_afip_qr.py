@@ -0,0 +1,116 @@
+import base64
+import json
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.bmi_invoice_parser.extraction.afip_qr import (
+    decode_afip_qr_url, afip_qr_invoice_data, parse_document_number, has_afip_qr_marker,
+)
+
+QR_PAYLOAD = {
+    'ver': 1,
+    'fecha': '2024-03-15',
+    'cuit': 30712345678,
+    'ptoVta': 2,
+    'tipoCmp': 1,
+    'nroCmp': 1234,
+    'importe': 12100,
+    'moneda': 'PES',
+    'ctz': 1,
+}
+
+
+def qr_url(payload, urlsafe=False, padding=True):
+    raw = json.dumps(payload).encode('utf-8')
+    encoded = (base64.urlsafe_b64encode(raw) if urlsafe else base64.b64encode(raw)).decode('ascii')
+    if not padding:
+        encoded = encoded.rstrip('=')
+    return f"https://www.afip.gob.ar/fe/qr/?p={encoded}"
+
+
+@tagged('post_install', '-at_install')
+class TestAfipQr(BaseCase):
+    """
+    Funciones puras del QR de AFIP: decodificación de la URL, datos de la factura y número de comprobante
+    """
+
+    def test_decode_standard_and_urlsafe(self):
+        # Un JSON cuyo base64 estándar tiene '+' y '/' (y el urlsafe, '-' y '_')
+        payload = dict(QR_PAYLOAD, extra='>>>???')
+        for urlsafe in (False, True):
+            for padding in (True, False):
+                with self.subTest(urlsafe=urlsafe, padding=padding):
+                    self.assertEqual(decode_afip_qr_url(qr_url(payload, urlsafe, padding)), payload)
+
+    def test_decode_space_instead_of_plus(self):
+        # Un '+' sin codificar en la URL llega como espacio
+        payload = dict(QR_PAYLOAD, extra='>>>???')
+        url = qr_url(payload)
+        self.assertIn('+', url)
+        self.assertEqual(decode_afip_qr_url(url.replace('+', ' ')), payload)
+
+    def test_decode_invalid(self):
+        self.assertIsNone(decode_afip_qr_url('https://www.afip.gob.ar/fe/qr/'))
+        self.assertIsNone(decode_afip_qr_url('https://www.afip.gob.ar/fe/qr/?p=%%%'))
+        self.assertIsNone(decode_afip_qr_url('https://www.afip.gob.ar/fe/qr/?p=' +
+                                             base64.b64encode(b'no es json').decode('ascii')))
+        self.assertIsNone(decode_afip_qr_url(qr_url([1, 2, 3])))
+
+    def test_decode_missing_keys(self):
+        for key in ('fecha', 'cuit', 'ptoVta', 'tipoCmp', 'nroCmp', 'importe'):
+            with self.subTest(key=key):
+                payload = {field: value for field, value in QR_PAYLOAD.items() if field != key}
+                self.assertIsNone(decode_afip_qr_url(qr_url(payload)))
+
+    def test_decode_malformed_numbers(self):
+        for key, value in (('ptoVta', 'A'), ('nroCmp', None), ('tipoCmp', '1.5'), ('importe', 'mil')):
+            with self.subTest(key=key):
+                self.assertIsNone(decode_afip_qr_url(qr_url(dict(QR_PAYLOAD, **{key: value}))))
+
+    def test_invoice_data_local_currency(self):
+        data = afip_qr_invoice_data(QR_PAYLOAD, 'P01234')
+        self.assertEqual(data['cuit'], '30-71234567-8')
+        self.assertEqual(data['invoice_number'], '00002-00001234')
+        self.assertEqual(data['document_type'], 'FACTURA A')
+        self.assertEqual(data['total_amount'], 12100.0)
+        self.assertAlmostEqual(data['base_amount'], 10000.0)
+        self.assertAlmostEqual(data['iva_amount'], 2100.0)
+        self.assertEqual((data['currency'], data['exchange_rate']), ('PES', 1.0))
+        # Sin 'moneda' se asume la moneda local
+        payload = {key: value for key, value in QR_PAYLOAD.items() if key not in ('moneda', 'ctz')}
+        self.assertEqual(afip_qr_invoice_data(payload, False)['total_amount'], 12100.0)
+
+    def test_invoice_data_foreign_currency(self):
+        data = afip_qr_invoice_data(dict(QR_PAYLOAD, moneda='DOL', importe=100, ctz=900.5), False)
+        self.assertEqual(data['total_amount'], 90050.0)
+        self.assertEqual((data['currency'], data['exchange_rate']), ('DOL', 900.5))
+
+    def test_invoice_data_foreign_currency_without_rate(self):
+        payloads = [{key: value for key, value in QR_PAYLOAD.items() if key != 'ctz'}] + [
+            dict(QR_PAYLOAD, ctz=ctz) for ctz in (None, 0, -1, 'x')
+        ]
+        for payload in payloads:
+            with self.subTest(ctz=payload.get('ctz')):
+                data = afip_qr_invoice_data(dict(payload, moneda='DOL'), False)
+                self.assertIsNone(data['total_amount'])
+                self.assertIsNone(data['iva_amount'])
+                self.assertIsNone(data['base_amount'])
+                self.assertIsNone(data['exchange_rate'])
+                self.assertEqual(data['invoice_number'], '00002-00001234')
+
+    def test_parse_document_number(self):
+        self.assertEqual(parse_document_number('00002-00001234'), (2, 1234))
+        self.assertEqual(parse_document_number('N° 0002 - 00001234'), (2, 1234))
+        for value in (None, False, '', '00001234', '00002-', '-00001234', '1-2-3', 'A-B'):
+            with self.subTest(value=value):
+                self.assertEqual(parse_document_number(value), (None, None))
+
+    def test_marker(self):
+        for text in ('CAE N°: 74123456789012', 'C.A.E.: 741', 'Comprobante Autorizado', 'COMPROBANTE AUTORIZADO',
+                     'Consultas en AFIP', 'Validado por ARCA'):
+            with self.subTest(text=text):
+                self.assertTrue(has_afip_qr_marker(text))
+        # Las palabras "cae" y "arca" no son las siglas
+        for text in ('El vencimiento cae en feriado', 'Cae la tarde', 'Un arca de madera', None, ''):
+            with self.subTest(text=text):
+                self.assertFalse(has_afip_qr_marker(text))
@@ -0,0 +1,57 @@
+from io import BytesIO
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.bmi_invoice_parser.extraction.probe import (
+    probe_text_layer, classify_document, PAGE_TEXT, PAGE_IMAGE, PAGE_EMPTY, DOC_TEXT, DOC_IMAGE, DOC_MIXED,
+)
+
+TEXT_PAGE = b"BT /F1 11 Tf 50 780 Td (FACTURA A 00001-00000001) Tj ET"
+IMAGE_PAGE = b"q 100 0 0 100 0 0 cm BI /W 1 /H 1 /CS /G /BPC 8 ID \x80 EI Q"
+
+
+def build_pdf(contents):
+    """
+    PDF mínimo con una página por content stream, todas con la fuente Helvetica en sus recursos
+    """
+    count = len(contents)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b' '.join(b"%d 0 R" % (4 + 2 * index) for index in range(count)), count),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for index, stream in enumerate(contents):
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % (5 + 2 * index))
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b''.join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+@tagged('post_install', '-at_install')
+class TestProbe(BaseCase):
+    """
+    Sondeo de la capa de texto
+    """
+
+    def test_classify_document(self):
+        self.assertEqual(classify_document([PAGE_TEXT, PAGE_EMPTY, PAGE_TEXT]), DOC_TEXT)
+        self.assertEqual(classify_document([PAGE_TEXT, PAGE_IMAGE]), DOC_MIXED)
+        self.assertEqual(classify_document([PAGE_IMAGE, PAGE_EMPTY]), DOC_IMAGE)
+        # Sin páginas con contenido se trata como imagen, para que pase por OCR
+        self.assertEqual(classify_document([PAGE_EMPTY]), DOC_IMAGE)
+        self.assertEqual(classify_document([]), DOC_IMAGE)
+
+    def test_probe_pages(self):
+        pdf = build_pdf([TEXT_PAGE, IMAGE_PAGE, b""])
+        self.assertEqual(probe_text_layer(BytesIO(pdf)), (DOC_MIXED, [PAGE_TEXT, PAGE_IMAGE, PAGE_EMPTY]))
+        self.assertEqual(probe_text_layer(BytesIO(build_pdf([TEXT_PAGE]))), (DOC_TEXT, [PAGE_TEXT]))
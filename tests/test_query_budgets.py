@@ -0,0 +1,43 @@
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.bmi_invoice_parser.models.invoice_loadtest import LOADTEST_MIX
+from odoo.addons.bmi_invoice_parser.models.invoice_parser import QUERY_BUDGETS
+from odoo.addons.bmi_invoice_parser.models.parser_run import ParserRun
+
+
+@tagged('post_install', '-at_install')
+class TestQueryBudgets(TransactionCase):
+    """
+    Consultas SQL de la transacción de un ticket (_procesar_ticket_reservado) contra QUERY_BUDGETS,
+    con los mismos datos y el mismo circuito que bmi_invoice_loadtest
+    """
+
+    def setUp(self):
+        super().setUp()
+        # La reserva, la extracción y cada ticket confirman su transacción: en la prueba todo queda
+        # en la transacción del caso, que se descarta al terminar
+        self.patch(self.env.cr, 'commit', lambda: None)
+        self.patch(self.env.cr, 'rollback', lambda: None)
+        # Con esta semilla y 20 tickets aparecen todos los resultados de LOADTEST_MIX
+        self.seeded = self.env['bmi.invoice.loadtest']._seed(20, suppliers=3, existing_bills=5, seed=0)
+
+    def test_query_budget_per_outcome(self):
+        ticket_model = self.env['helpdesk.ticket']
+        expected = self.seeded['expected']
+        self.assertEqual(set(expected.values()), set(LOADTEST_MIX))
+
+        stages = ticket_model._get_parser_stages()
+        tickets, token = ticket_model._claim_tickets([('id', 'in', self.seeded['ticket_ids'])],
+                                                     len(self.seeded['ticket_ids']))
+        self.assertEqual(sorted(tickets.ids), sorted(self.seeded['ticket_ids']))
+        documents = ticket_model._extract_claimed_documents(tickets)
+        partners_by_cuit = {}
+        pending = ParserRun()
+        for ticket in tickets:
+            outcome = expected[ticket.id]
+            with self.subTest(ticket=ticket.id, outcome=outcome):
+                with self.assertQueryCount(QUERY_BUDGETS[outcome]):
+                    result = ticket_model._procesar_ticket_reservado(ticket, stages, token, partners_by_cuit,
+                                                                     documents, pending=pending)
+                self.assertEqual(result, outcome)
+        self.assertTrue(ticket_model._apply_pending_changes(pending))
@@ -0,0 +1,52 @@
+import re
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.bmi_invoice_parser.extraction.rule_budget import bound_rule_text, RuleBudget
+
+
+@tagged('post_install', '-at_install')
+class TestRuleBudget(BaseCase):
+    """
+    Acotado del texto y tiempo máximo de la evaluación de reglas
+    """
+
+    def test_bound_short_text_unchanged(self):
+        self.assertEqual(bound_rule_text('FACTURA A\nTotal: $ 100'), ('FACTURA A\nTotal: $ 100', False))
+        self.assertEqual(bound_rule_text(None), ('', False))
+
+    def test_bound_truncates(self):
+        text, changed = bound_rule_text('a\n' * 100, max_chars=50)
+        self.assertTrue(changed)
+        self.assertEqual(len(text), 50)
+
+    def test_bound_wraps_long_lines_at_space(self):
+        line = ' '.join(['palabra'] * 500)
+        text, changed = bound_rule_text(line, max_line_chars=200)
+        self.assertTrue(changed)
+        lines = text.split('\n')
+        self.assertTrue(all(len(part) <= 200 for part in lines))
+        # Se corta en los espacios: no se parte ninguna palabra
+        self.assertEqual(' '.join(lines).split(), line.split())
+
+    def test_bound_wraps_line_without_spaces(self):
+        text, changed = bound_rule_text('x' * 450, max_line_chars=200)
+        self.assertTrue(changed)
+        self.assertEqual([len(part) for part in text.split('\n')], [200, 200, 50])
+
+    def test_budget_unlimited(self):
+        budget = RuleBudget(seconds=None)
+        self.assertFalse(budget.expired())
+        self.assertEqual(budget.search(r'\d+', 'PO 123').group(), '123')
+        self.assertEqual([match.group() for match in budget.finditer(r'\d', 'a1b2')], ['1', '2'])
+
+    def test_budget_expired(self):
+        budget = RuleBudget(seconds=0)
+        budget.deadline -= 1
+        self.assertIsNone(budget.search(r'\d+', 'PO 123'))
+        self.assertEqual(list(budget.finditer(r'\d', 'a1b2')), [])
+        self.assertTrue(budget.exceeded)
+
+    def test_budget_flags(self):
+        budget = RuleBudget()
+        self.assertTrue(budget.search(r'factura', 'FACTURA A', re.IGNORECASE))
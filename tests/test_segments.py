@@ -0,0 +1,49 @@
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.bmi_invoice_parser.extraction.pdf_text import PAGE_SEPARATOR
+from odoo.addons.bmi_invoice_parser.extraction.rule_budget import RULE_MAX_CHARS
+from odoo.addons.bmi_invoice_parser.extraction.segments import segment_invoice_pages, page_document_key
+
+
+def invoice_page(number, copy='ORIGINAL', cuit='30-71234567-8'):
+    return f"{copy}\nFACTURA A 00001-{number:08d}\nCUIT: {cuit}\nTotal: $ 1.000,00"
+
+
+@tagged('post_install', '-at_install')
+class TestSegments(BaseCase):
+    """
+    Separación de un PDF con varias facturas a partir del texto de cada página
+    """
+
+    def test_page_document_key(self):
+        self.assertEqual(page_document_key(invoice_page(12)), ('30712345678', 1, 12))
+        self.assertEqual(page_document_key("FACTURA\nPunto de Venta: 00003 Comp. Nro: 00000045"), ('', 3, 45))
+        # Sin encabezado o sin número, la página continúa la factura anterior
+        self.assertIsNone(page_document_key('Detalle de ítems (continuación)'))
+        self.assertIsNone(page_document_key('FACTURA sin número'))
+
+    def test_single_invoice(self):
+        text = PAGE_SEPARATOR.join([invoice_page(1), 'Detalle (continuación)', invoice_page(1, 'DUPLICADO')])
+        self.assertEqual(segment_invoice_pages(text), [])
+        self.assertEqual(segment_invoice_pages(''), [])
+
+    def test_several_invoices_with_copies(self):
+        text = PAGE_SEPARATOR.join([
+            'Estimados: adjuntamos las facturas del mes',
+            invoice_page(1),
+            'Detalle (continuación)',
+            invoice_page(2),
+            invoice_page(1, 'DUPLICADO'),
+        ])
+        segments = segment_invoice_pages(text)
+        self.assertEqual([segment['key'] for segment in segments], [('30712345678', 1, 1), ('30712345678', 1, 2)])
+        self.assertEqual([segment['pages'] for segment in segments], [[1, 2, 3, 5], [4]])
+        self.assertIn('FACTURA A 00001-00000002', segments[1]['text'])
+
+    def test_invoice_after_rule_limit(self):
+        # Una factura que empieza después del límite de caracteres de las reglas también se separa
+        filler = PAGE_SEPARATOR.join(['x' * 900] * (RULE_MAX_CHARS // 900 + 10))
+        text = PAGE_SEPARATOR.join([invoice_page(1), filler, invoice_page(2)])
+        self.assertGreater(len(text), RULE_MAX_CHARS)
+        segments = segment_invoice_pages(text)
+        self.assertEqual([segment['key'][2] for segment in segments], [1, 2])